@@ -1,7 +1,14 @@
+import asyncio
 import json
 import os
 from core.base_agent import BaseAgent
 from core.llm_provider import LLMProvider
+from core.llm_cache import TTL_COMPANY_PROFILE, TTL_FUNDAMENTALS
+from core.market_data import get_market_data_gateway
+from core.ohlcv_store import OHLCVStore
+from core.sanitize import sanitize_float
+from core.chart_payload import render_charts
+from core.fanout import map_bounded, run_blocking
 import yfinance as yf
 import pandas as pd
 import requests
@@ -11,7 +18,6 @@ import numpy as np
 from typing import Dict, Any, List, Optional
 import time
 from requests.exceptions import RequestException
-import pickle
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
@@ -20,9 +26,11 @@ class InvestmentAdvisor(BaseAgent):
     def __init__(self):
         super().__init__()
         self.llm_provider = LLMProvider()
+        self.market_data = get_market_data_gateway()
         self.default_symbols = ['AAPL', 'GOOGL', 'MSFT', 'AMZN', 'META']
         self.cache_dir = Path("cache/stock_data")
         self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.store = OHLCVStore(str(self.cache_dir))
         
         # 配置requests session
         self.session = requests.Session()
@@ -44,32 +52,31 @@ class InvestmentAdvisor(BaseAgent):
             'NVIDIA': 'NVDA'
         }
 
-    def _get_cache_path(self, symbol: str) -> Path:
-        """获取缓存文件路径"""
-        return self.cache_dir / f"{symbol}_data.pkl"
-
     def _load_from_cache(self, symbol: str) -> tuple:
         """从缓存加载数据"""
-        cache_path = self._get_cache_path(symbol)
-        if cache_path.exists():
-            cache_age = time.time() - cache_path.stat().st_mtime
-            # 如果缓存不超过10分钟，直接使用
-            if cache_age < 600:  # 10 minutes
-                try:
-                    with open(cache_path, 'rb') as f:
-                        data = pickle.load(f)
-                        logger.info(f"Using cached data for {symbol}")
-                        return data
-                except Exception as e:
-                    logger.warning(f"Failed to load cache for {symbol}: {str(e)}")
+        cache_age = self.store.age(symbol)
+        # 网关刷新K线时不会更新公司信息，因此两者都需要在有效期内
+        info_age = self.store.info_age(symbol)
+        # 如果缓存不超过10分钟，直接使用
+        if cache_age is not None and info_age is not None and max(cache_age, info_age) < 600:  # 10 minutes
+            hist = self.store.read(symbol)
+            if hist is not None and not hist.empty:
+                logger.info(f"Using cached data for {symbol}")
+                return self._trim_history(hist), self.store.info(symbol)
         return None
 
+    def _trim_history(self, hist: pd.DataFrame) -> pd.DataFrame:
+        """只保留最近一个月的数据，与完整下载时的period一致"""
+        if hist.empty:
+            return hist
+        return hist[hist.index >= hist.index[-1] - pd.DateOffset(months=1)]
+
     def _save_to_cache(self, symbol: str, data: tuple):
         """保存数据到缓存"""
         try:
-            cache_path = self._get_cache_path(symbol)
-            with open(cache_path, 'wb') as f:
-                pickle.dump(data, f)
+            hist, info = data
+            # 合并而不是覆盖，避免截断网关保存的更长日线序列
+            self.store.append(symbol, hist, info)
             logger.info(f"Saved data to cache for {symbol}")
         except Exception as e:
             logger.warning(f"Failed to save cache for {symbol}: {str(e)}")
@@ -93,19 +100,16 @@ class InvestmentAdvisor(BaseAgent):
                     # 添加延迟以避免请求限制
                     time.sleep(2)  # 在每次请求前添加2秒延迟
                     
-                    # 尝试使用yfinance的备用方法
-                    stock = yf.Ticker(symbol)
-                    
                     # 首先获取基本信息
                     try:
-                        info = stock.info
+                        info = self.market_data.info(symbol)
                     except Exception as e:
                         logger.warning(f"Failed to get info for {symbol}: {str(e)}")
                         info = {}
                     
                     # 然后获取历史数据
                     try:
-                        hist = stock.history(period="1mo", interval="1d")
+                        hist = self.market_data.history(symbol, period="1mo", interval="1d")
                     except Exception as e:
                         logger.warning(f"Failed to get history for {symbol}: {str(e)}")
                         # 尝试使用download方法
@@ -289,17 +293,7 @@ class InvestmentAdvisor(BaseAgent):
 
     def _sanitize_float(self, value: float) -> float:
         """处理浮点数，确保其在JSON可接受的范围内"""
-        try:
-            if value is None:
-                return 0.0
-            if np.isnan(value) or np.isinf(value):
-                return 0.0
-            # 确保数值在JSON可接受的范围内
-            if abs(value) > 1e308:  # JSON的最大值限制
-                return 0.0
-            return float(value)
-        except:
-            return 0.0
+        return sanitize_float(value)
 
     async def _analyze_company_info(self, symbol: str, info: Dict[str, Any]) -> Dict[str, str]:
         """使用LLM分析公司信息并生成详细介绍"""
@@ -328,7 +322,7 @@ class InvestmentAdvisor(BaseAgent):
                 请用中文回答，确保内容专业、准确、易懂。
                 """
 
-                response = self.llm_provider.generate_response(prompt)
+                response = await self.llm_provider.generate_response_async(prompt, cache_ttl=TTL_COMPANY_PROFILE)
                 
                 # 分离公司介绍和主营业务
                 sections = response.split("【主营业务】")
@@ -357,8 +351,8 @@ class InvestmentAdvisor(BaseAgent):
                 "businesses": ["暂无主营业务信息"]
             }
 
-    async def _analyze_fundamentals(self, symbol: str, info: Dict[str, Any], hist: pd.DataFrame) -> Dict[str, Any]:
-        """分析股票基本面数据"""
+    def _calculate_fundamentals(self, symbol: str, info: Dict[str, Any], hist: pd.DataFrame) -> Dict[str, Any]:
+        """计算基本面指标，analysis字段留空，由LLM分析填充"""
         try:
             # 确保历史数据不为空且包含必要的列
             if hist.empty or not all(col in hist.columns for col in ['Close', 'Volume']):
@@ -401,27 +395,6 @@ class InvestmentAdvisor(BaseAgent):
                 elif pe_ratio < 15:
                     valuation_status = "偏低"
             
-            # 使用LLM生成基本面分析（添加错误处理）
-            try:
-                analysis_prompt = f"""
-                请根据以下股票基本面数据，生成一个简短的分析报告，重点关注估值水平、盈利能力和投资风险：
-
-                市盈率: {pe_ratio:.2f}
-                预期市盈率: {forward_pe:.2f}
-                市净率: {price_to_book:.2f}
-                PEG比率: {peg_ratio:.2f}
-                利润率: {profit_margin:.2f}%
-                股息率: {dividend_yield:.2f}%
-                Beta系数: {beta:.2f}
-
-                请用中文回答，确保分析专业、客观，并给出具体的投资建议。
-                """
-                
-                fundamental_analysis = self.llm_provider.generate_response(analysis_prompt)
-            except Exception as e:
-                logger.error(f"Error generating fundamental analysis for {symbol}: {str(e)}")
-                fundamental_analysis = "暂时无法生成基本面分析报告。"
-            
             return {
                 "name": info.get("longName", symbol),
                 "sector": info.get("sector", "Unknown"),
@@ -455,13 +428,43 @@ class InvestmentAdvisor(BaseAgent):
                     "beta": beta,
                     "risk_level": "高" if beta > 1.5 else "低" if beta < 0.5 else "中等"
                 },
-                "analysis": fundamental_analysis
+                "analysis": ""
             }
             
         except Exception as e:
             logger.error(f"Error analyzing fundamentals for {symbol}: {str(e)}")
             return self._get_default_metrics()
 
+    async def _analyze_fundamentals(self, symbol: str, info: Dict[str, Any], hist: pd.DataFrame) -> Dict[str, Any]:
+        """分析股票基本面数据"""
+        fundamentals = self._calculate_fundamentals(symbol, info, hist)
+        if not fundamentals["analysis"]:
+            fundamentals["analysis"] = await self._generate_fundamental_analysis(symbol, fundamentals)
+        return fundamentals
+
+    async def _generate_fundamental_analysis(self, symbol: str, fundamentals: Dict[str, Any]) -> str:
+        """使用LLM生成基本面分析"""
+        valuation = fundamentals["valuation_metrics"]
+        try:
+            analysis_prompt = f"""
+            请根据以下股票基本面数据，生成一个简短的分析报告，重点关注估值水平、盈利能力和投资风险：
+
+            市盈率: {valuation["pe_ratio"]:.2f}
+            预期市盈率: {valuation["forward_pe"]:.2f}
+            市净率: {valuation["price_to_book"]:.2f}
+            PEG比率: {valuation["peg_ratio"]:.2f}
+            利润率: {fundamentals["profitMargin"]:.2f}%
+            股息率: {fundamentals["dividendYield"]:.2f}%
+            Beta系数: {fundamentals["beta"]:.2f}
+
+            请用中文回答，确保分析专业、客观，并给出具体的投资建议。
+            """
+            
+            return await self.llm_provider.generate_response_async(analysis_prompt, cache_ttl=TTL_FUNDAMENTALS)
+        except Exception as e:
+            logger.error(f"Error generating fundamental analysis for {symbol}: {str(e)}")
+            return "暂时无法生成基本面分析报告。"
+
     def _get_default_metrics(self) -> Dict[str, Any]:
         """返回默认的指标数据"""
         return {
@@ -500,9 +503,14 @@ class InvestmentAdvisor(BaseAgent):
             "analysis": "暂无基本面分析数据。"
         }
 
-    async def analyze_investment(self, symbols: List[str]) -> Dict[str, Any]:
+    async def analyze_investment(self, symbols: List[str], chart_format: str = "full",
+                                 max_points: Optional[int] = None,
+                                 concurrency: Optional[int] = None) -> Dict[str, Any]:
         """
-        分析投资标的并生成建议
+        分析投资标的并生成建议，chart_format见core.chart_payload
+
+        各股票并发分析，同时进行的不超过concurrency只（默认见core.fanout.analysis_concurrency），
+        结果按输入顺序合并。
         """
         logger.info(f"Analyzing stocks: {symbols}")
         
@@ -523,59 +531,23 @@ class InvestmentAdvisor(BaseAgent):
                 }
             }
             
-            for symbol in symbols:
-                logger.info(f"Fetching data for {symbol}")
-                try:
-                    stock_data = self._fetch_stock_data(symbol)
-                    if stock_data is None:
-                        continue
-                        
-                    hist, info = stock_data  # Unpack the tuple
-                    
-                    # 分析基本面数据（异步操作）
-                    fundamentals = await self._analyze_fundamentals(symbol, info, hist)
-                    result["investmentAdvice"]["fundamentals"][symbol] = fundamentals
-                    
-                    # 分析公司信息（异步操作）
-                    company_info = await self._analyze_company_info(symbol, info)
-                    result["investmentAdvice"]["companyInfo"][symbol] = {
-                        "name": info.get("longName", symbol),
-                        "introduction": company_info["introduction"],
-                        "industry": info.get("industry", "未知行业"),
-                        "sector": info.get("sector", "未知板块"),
-                        "website": info.get("website", ""),
-                        "country": info.get("country", ""),
-                        "employees": info.get("fullTimeEmployees", 0),
-                        "mainBusinesses": company_info["businesses"]
-                    }
-                    
-                    # 生成图表数据（同步操作）
-                    charts = self._generate_charts(symbol, hist)
-                    result["investmentAdvice"]["charts"].extend(charts)
-                    
-                    # 合并公司信息分析和投资建议生成（同步操作）
-                    prompt = f"""
-                    请基于以下信息生成详细的公司分析和投资建议：
-                    
-                    公司代码：{symbol}
-                    公司简介：{company_info['introduction']}
-                    主营业务：{' '.join(company_info['businesses'])}
-                    基本面数据：{fundamentals}
-                    
-                    请提供以下格式的分析：
-                    1. 财务分析（基于提供的基本面数据）
-                    2. 投资建议（包括投资评级、风险提示）
-                    """
-                    
-                    analysis = self.llm_provider.generate_response(prompt)
-                    
-                    # 解析LLM响应
-                    sections = analysis.split("\n\n")
-                    if len(sections) >= 2:
-                        result["investmentAdvice"]["advice"] = "\n\n".join(sections)
-                except Exception as e:
-                    logger.error(f"Error analyzing {symbol}: {str(e)}")
+            analyses = await map_bounded(
+                lambda symbol: self._analyze_symbol(symbol, chart_format, max_points),
+                symbols,
+                concurrency
+            )
+            
+            for symbol, analysis in zip(symbols, analyses):
+                if isinstance(analysis, Exception):
+                    logger.error(f"Error analyzing {symbol}: {str(analysis)}")
+                    continue
+                if analysis is None:
                     continue
+                result["investmentAdvice"]["fundamentals"][symbol] = analysis["fundamentals"]
+                result["investmentAdvice"]["companyInfo"][symbol] = analysis["companyInfo"]
+                result["investmentAdvice"]["charts"].extend(analysis["charts"])
+                if analysis["advice"]:
+                    result["investmentAdvice"]["advice"] = analysis["advice"]
             
             return result
             
@@ -583,8 +555,142 @@ class InvestmentAdvisor(BaseAgent):
             logger.error(f"Error in analyze_investment: {str(e)}")
             raise
 
-    def _generate_charts(self, symbol: str, hist: pd.DataFrame) -> List[Dict[str, Any]]:
-        """生成图表数据"""
+    async def _analyze_symbol(self, symbol: str, chart_format: str = "full",
+                              max_points: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """分析单只股票，无法获取数据时返回None
+
+        公司介绍、主营业务、基本面分析和投资建议优先通过一次结构化LLM调用生成，
+        失败时退回到逐项调用。
+        """
+        logger.info(f"Fetching data for {symbol}")
+        stock_data = await run_blocking(self._fetch_stock_data, symbol)
+        if stock_data is None:
+            return None
+            
+        hist, info = stock_data  # Unpack the tuple
+        
+        fundamentals, charts = await asyncio.gather(
+            run_blocking(self._calculate_fundamentals, symbol, info, hist),
+            run_blocking(self._generate_charts, symbol, hist, chart_format, max_points)
+        )
+        
+        structured = await self._structured_analysis(symbol, info, fundamentals)
+        if structured is not None:
+            if not fundamentals["analysis"]:
+                fundamentals["analysis"] = structured["fundamental_analysis"]
+            company_info = {
+                "introduction": structured["introduction"],
+                "businesses": [f"• {item.lstrip('•').strip()}" for item in structured["businesses"]]
+                              or ["暂无主营业务信息"]
+            }
+            advice = f"1. 财务分析\n{structured['financial_analysis']}\n\n2. 投资建议\n{structured['investment_advice']}"
+        else:
+            # 基本面分析和公司信息分析互不依赖，同时进行
+            if not fundamentals["analysis"]:
+                analysis, company_info = await asyncio.gather(
+                    self._generate_fundamental_analysis(symbol, fundamentals),
+                    self._analyze_company_info(symbol, info)
+                )
+                fundamentals["analysis"] = analysis
+            else:
+                company_info = await self._analyze_company_info(symbol, info)
+            advice = await self._generate_advice(symbol, company_info, fundamentals)
+        
+        return {
+            "fundamentals": fundamentals,
+            "companyInfo": {
+                "name": info.get("longName", symbol),
+                "introduction": company_info["introduction"],
+                "industry": info.get("industry", "未知行业"),
+                "sector": info.get("sector", "未知板块"),
+                "website": info.get("website", ""),
+                "country": info.get("country", ""),
+                "employees": info.get("fullTimeEmployees", 0),
+                "mainBusinesses": company_info["businesses"]
+            },
+            "charts": charts,
+            "advice": advice
+        }
+
+    # 单次结构化分析的输出格式，各字段对应逐项调用时的四类结果
+    ANALYSIS_SCHEMA = {
+        "type": "object",
+        "properties": {
+            "introduction": {"type": "string"},
+            "businesses": {"type": "array", "items": {"type": "string"}},
+            "fundamental_analysis": {"type": "string"},
+            "financial_analysis": {"type": "string"},
+            "investment_advice": {"type": "string"}
+        },
+        "required": ["introduction", "businesses", "fundamental_analysis",
+                     "financial_analysis", "investment_advice"],
+        "additionalProperties": False
+    }
+
+    async def _structured_analysis(self, symbol: str, info: Dict[str, Any],
+                                   fundamentals: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """一次LLM调用生成公司介绍、主营业务、基本面分析和投资建议，失败时返回None"""
+        valuation = fundamentals["valuation_metrics"]
+        prompt = f"""
+        请根据以下公司信息和基本面数据，对{symbol}进行完整的投资分析。
+
+        公司名称：{info.get("longName", symbol)}
+        公司描述：{info.get("longBusinessSummary", "")}
+        所属行业：{info.get("industry", "未知行业")}
+        所属板块：{info.get("sector", "未知板块")}
+        员工人数：{info.get("fullTimeEmployees", "未知")}
+
+        市盈率: {valuation["pe_ratio"]:.2f}
+        预期市盈率: {valuation["forward_pe"]:.2f}
+        市净率: {valuation["price_to_book"]:.2f}
+        PEG比率: {valuation["peg_ratio"]:.2f}
+        利润率: {fundamentals["profitMargin"]:.2f}%
+        股息率: {fundamentals["dividendYield"]:.2f}%
+        Beta系数: {fundamentals["beta"]:.2f}
+        基本面数据：{fundamentals}
+
+        请按JSON格式输出以下字段：
+        - introduction：用3-4段话介绍公司的发展历史、市场地位、核心竞争力等
+        - businesses：3-5个主要业务领域，每项说明其产品、服务和市场地位
+        - fundamental_analysis：简短的基本面分析，重点关注估值水平、盈利能力和投资风险
+        - financial_analysis：基于基本面数据的财务分析
+        - investment_advice：投资建议，包括投资评级和风险提示
+
+        请用中文回答，确保内容专业、准确、易懂。
+        """
+        try:
+            return await self.llm_provider.generate_structured_async(
+                prompt, self.ANALYSIS_SCHEMA, "investment_analysis", cache_ttl=TTL_FUNDAMENTALS
+            )
+        except Exception as e:
+            logger.warning(f"Structured analysis failed for {symbol}, falling back to separate prompts: {str(e)}")
+            return None
+
+    async def _generate_advice(self, symbol: str, company_info: Dict[str, Any],
+                               fundamentals: Dict[str, Any]) -> str:
+        """合并公司信息分析和基本面数据生成投资建议"""
+        prompt = f"""
+        请基于以下信息生成详细的公司分析和投资建议：
+        
+        公司代码：{symbol}
+        公司简介：{company_info['introduction']}
+        主营业务：{' '.join(company_info['businesses'])}
+        基本面数据：{fundamentals}
+        
+        请提供以下格式的分析：
+        1. 财务分析（基于提供的基本面数据）
+        2. 投资建议（包括投资评级、风险提示）
+        """
+        
+        analysis = await self.llm_provider.generate_response_async(prompt, cache_ttl=TTL_FUNDAMENTALS)
+        
+        # 解析LLM响应
+        sections = analysis.split("\n\n")
+        return "\n\n".join(sections) if len(sections) >= 2 else ""
+
+    def _generate_charts(self, symbol: str, hist: pd.DataFrame, chart_format: str = "full",
+                         max_points: Optional[int] = None) -> List[Dict[str, Any]]:
+        """生成图表数据，max_points限制每个图表的点数（LTTB降采样）"""
         try:
             if hist.empty:
                 return []
@@ -592,10 +698,9 @@ class InvestmentAdvisor(BaseAgent):
             price_chart = {
                 "type": "line",
                 "title": f"{symbol} Price History",
-                "labels": hist.index.strftime('%Y-%m-%d').tolist(),
                 "datasets": [{
                     "label": "Price",
-                    "data": hist['Close'].tolist(),
+                    "data": hist['Close'].to_numpy(),
                     "borderColor": "rgb(75, 192, 192)",
                     "tension": 0.1
                 }]
@@ -604,15 +709,16 @@ class InvestmentAdvisor(BaseAgent):
             volume_chart = {
                 "type": "bar",
                 "title": f"{symbol} Volume History",
-                "labels": hist.index.strftime('%Y-%m-%d').tolist(),
                 "datasets": [{
                     "label": "Volume",
-                    "data": hist['Volume'].tolist(),
+                    "data": hist['Volume'].to_numpy(),
                     "backgroundColor": "rgb(153, 102, 255)",
                 }]
             }
             
-            return [price_chart, volume_chart]
+            labels = hist.index.strftime('%Y-%m-%d').tolist()
+            return render_charts([price_chart, volume_chart], labels, chart_format=chart_format,
+                                 max_points=max_points)
         except Exception as e:
             logger.error(f"Error generating charts for {symbol}: {str(e)}")
             return []
@@ -635,7 +741,7 @@ class InvestmentAdvisor(BaseAgent):
             请用中文回答，直接列出业务领域，不要有其他内容。每行以"•"开头。
             """
 
-            response = await self.llm_provider.generate_response(prompt)
+            response = await self.llm_provider.generate_response_async(prompt, cache_ttl=TTL_COMPANY_PROFILE)
             
             # 处理响应
             businesses = [line.strip() for line in response.split('\n') if line.strip().startswith('•')]
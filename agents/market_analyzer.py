@@ -1,15 +1,20 @@
-import yfinance as yf
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import logging
 from core.base_agent import BaseAgent
 from core.llm_provider import LLMProvider
+from core.llm_cache import TTL_MARKET_REPORT, TTL_NEWS
+from core.market_data import get_market_data_gateway
+from core.indicator_memo import get_indicator_memo
+from core import indicators, screening
+from core.sanitize import sanitize
+from core.executors import run_cpu_sync
+from core.fanout import run_blocking
 import requests
 from bs4 import BeautifulSoup
 import json
 import os
-import ta  # 技术分析库
 from pandas_datareader import data as pdr
 import finnhub
 from stockstats import StockDataFrame
@@ -18,18 +23,12 @@ import time  # 添加time模块用于重试延迟
 
 logger = logging.getLogger(__name__)
 
-class CustomJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, (float, np.float64, np.float32)):
-            if np.isnan(obj) or np.isinf(obj):
-                return 0.0
-            return float(obj)
-        return super().default(obj)
-
 class MarketAnalyzer(BaseAgent):
     def __init__(self):
         super().__init__()
         self.llm_provider = LLMProvider(model="gpt-4o-2024-08-06")  # 指定使用 GPT-4 模型
+        self.market_data = get_market_data_gateway()
+        self.indicator_memo = get_indicator_memo()
         self.finnhub_client = None
         self._init_api_clients()
         
@@ -44,86 +43,14 @@ class MarketAnalyzer(BaseAgent):
         """分析整体市场状况和发掘潜力股"""
         try:
             logger.info("Starting market analysis...")
-            
-            # 初始化结果字典
-            result = {
-                "market_overview": {},
-                "hot_sectors": {},
-                "macro_indicators": {},
-                "news_summary": "",
-                "potential_stocks": [],
-                "market_sentiment": {},
-                "analysis_report": "",
-                "progress_updates": []  # 添加进度更新列表
-            }
-
-            # 1. 获取市场指数数据
-            logger.info("Analyzing market indices...")
-            result["market_overview"] = self._analyze_market_indices() or {}
-            result["progress_updates"].append({
-                "stage": "market_indices",
-                "message": "已完成市场指数分析",
-                "data": result["market_overview"]
-            })
-
-            # 2. 获取市场热点板块
-            logger.info("Analyzing sector performance...")
-            result["hot_sectors"] = self._analyze_sector_performance() or {}
-            result["progress_updates"].append({
-                "stage": "sector_performance",
-                "message": "已完成板块分析",
-                "data": result["hot_sectors"]
-            })
-
-            # 3. 获取宏观经济指标
-            logger.info("Analyzing macro indicators...")
-            result["macro_indicators"] = self._analyze_macro_indicators() or {}
-            result["progress_updates"].append({
-                "stage": "macro_indicators",
-                "message": "已完成宏观指标分析",
-                "data": result["macro_indicators"]
-            })
-
-            # 4. 获取最新金融新闻
-            logger.info("Fetching financial news...")
-            result["news_summary"] = self._fetch_financial_news() or "暂无最新市场新闻"
-            result["progress_updates"].append({
-                "stage": "financial_news",
-                "message": "已完成新闻分析",
-                "data": result["news_summary"]
-            })
-
-            # 5. 筛选潜力股
-            logger.info("Screening potential stocks...")
-            result["potential_stocks"] = self._screen_potential_stocks() or []
-            result["progress_updates"].append({
-                "stage": "potential_stocks",
-                "message": "已完成潜力股筛选",
-                "data": result["potential_stocks"]
-            })
-            
-            # 6. 获取市场情绪指标
-            logger.info("Analyzing market sentiment...")
-            result["market_sentiment"] = self._analyze_market_sentiment() or {}
-            result["progress_updates"].append({
-                "stage": "market_sentiment",
-                "message": "已完成市场情绪分析",
-                "data": result["market_sentiment"]
-            })
+            result = self._collect_market_data()
 
             # 7. 生成市场分析报告
             logger.info("Generating market report...")
-            prompt = self._generate_market_report_prompt(
-                result["market_overview"],
-                result["hot_sectors"],
-                result["macro_indicators"],
-                result["news_summary"],
-                result["potential_stocks"],
-                result["market_sentiment"]
-            )
-            
             # 使用同步方式调用LLM
-            result["analysis_report"] = self.llm_provider.generate_response_sync(prompt) or "暂无市场分析报告"
+            result["analysis_report"] = self.llm_provider.generate_response_sync(
+                self._build_report_prompt(result), cache_ttl=TTL_MARKET_REPORT
+            ) or "暂无市场分析报告"
             result["progress_updates"].append({
                 "stage": "final_report",
                 "message": "已完成市场分析报告",
@@ -146,17 +73,112 @@ class MarketAnalyzer(BaseAgent):
                 "progress_updates": []
             }
 
+    # 生成报告前的各分析阶段：(阶段名, 结果字段, 分析方法, 完成提示, 无结果时的默认值)
+    MARKET_STAGES = [
+        ("market_indices", "market_overview", "_analyze_market_indices", "已完成市场指数分析", {}),
+        ("sector_performance", "hot_sectors", "_analyze_sector_performance", "已完成板块分析", {}),
+        ("macro_indicators", "macro_indicators", "_analyze_macro_indicators", "已完成宏观指标分析", {}),
+        ("financial_news", "news_summary", "_fetch_financial_news", "已完成新闻分析", "暂无最新市场新闻"),
+        ("potential_stocks", "potential_stocks", "_screen_potential_stocks", "已完成潜力股筛选", []),
+        ("market_sentiment", "market_sentiment", "_analyze_market_sentiment", "已完成市场情绪分析", {}),
+    ]
+
+    async def stream_market_analysis(self):
+        """分阶段执行市场分析，逐个产出(事件类型, 数据)
+
+        每完成一个分析阶段产出("stage", 进度更新)，随后流式生成报告时产出("token", {"text": 片段})，
+        报告完成后产出final_report阶段。阻塞的分析阶段在线程池中执行。
+        """
+        result = self._new_result()
+        stages = self.iter_market_stages(result)
+        while True:
+            update = await run_blocking(next, stages, None)
+            if update is None:
+                break
+            yield "stage", self._sanitize_data(update)
+
+        logger.info("Streaming market report...")
+        chunks = []
+        # 与generate_response_sync使用相同的消息，两种方式共享LLM缓存
+        async for token in self.llm_provider.generate_response_stream(
+            self._build_report_prompt(result),
+            system_prompt="你是一个专业的AI助手，擅长分析和生成高质量内容。",
+            max_tokens=2000,
+            cache_ttl=TTL_MARKET_REPORT
+        ):
+            chunks.append(token)
+            yield "token", {"text": token}
+        yield "stage", {
+            "stage": "final_report",
+            "message": "已完成市场分析报告",
+            "data": "".join(chunks).strip() or "暂无市场分析报告"
+        }
+
+    async def analyze_market_async(self, on_progress=None):
+        """异步执行完整的市场分析，每完成一个阶段调用on_progress(进度更新)，返回与analyze_market相同结构的结果"""
+        result = self._new_result()
+        fields = {stage: field for stage, field, *_ in self.MARKET_STAGES}
+        fields["final_report"] = "analysis_report"
+        async for event, data in self.stream_market_analysis():
+            if event != "stage":
+                continue
+            result[fields[data["stage"]]] = data["data"]
+            result["progress_updates"].append(data)
+            if on_progress is not None:
+                on_progress(data)
+        return result
+
+    async def stream_market_report(self):
+        """收集市场数据后流式生成分析报告，逐段产出报告文本"""
+        async for event, data in self.stream_market_analysis():
+            if event == "token":
+                yield data["text"]
+
+    def _build_report_prompt(self, result):
+        return self._generate_market_report_prompt(
+            result["market_overview"],
+            result["hot_sectors"],
+            result["macro_indicators"],
+            result["news_summary"],
+            result["potential_stocks"],
+            result["market_sentiment"]
+        )
+
+    def _new_result(self):
+        return {
+            "market_overview": {},
+            "hot_sectors": {},
+            "macro_indicators": {},
+            "news_summary": "",
+            "potential_stocks": [],
+            "market_sentiment": {},
+            "analysis_report": "",
+            "progress_updates": []  # 添加进度更新列表
+        }
+
+    def iter_market_stages(self, result):
+        """依次执行生成报告前的各分析阶段，写入result并产出每个阶段的进度更新"""
+        for stage, field, method, message, default in self.MARKET_STAGES:
+            logger.info(f"Running market analysis stage: {stage}")
+            result[field] = getattr(self, method)() or default
+            update = {
+                "stage": stage,
+                "message": message,
+                "data": result[field]
+            }
+            result["progress_updates"].append(update)
+            yield update
+
+    def _collect_market_data(self):
+        """依次完成生成报告前的各项分析，返回结果字典（analysis_report留空）"""
+        result = self._new_result()
+        for _ in self.iter_market_stages(result):
+            pass
+        return result
+
     def _sanitize_data(self, data):
-        """递归清理数据中的特殊浮点数值"""
-        if isinstance(data, dict):
-            return {k: self._sanitize_data(v) for k, v in data.items()}
-        elif isinstance(data, list):
-            return [self._sanitize_data(item) for item in data]
-        elif isinstance(data, (float, np.float64, np.float32)):
-            if np.isnan(data) or np.isinf(data):
-                return 0.0
-            return float(data)
-        return data
+        """清理数据中的特殊浮点数值"""
+        return sanitize(data)
 
     def _analyze_market_indices(self):
         """分析主要市场指数"""
@@ -176,8 +198,7 @@ class MarketAnalyzer(BaseAgent):
             for attempt in range(3):  # 最多重试3次
                 try:
                     logger.info(f"Fetching data for {name} ({symbol}), attempt {attempt + 1}")
-                    index = yf.Ticker(symbol)
-                    hist = index.history(period="6mo", timeout=10)  # 设置较短的超时时间
+                    hist = self.market_data.history(symbol, period="6mo", timeout=10)  # 设置较短的超时时间
                     
                     if not hist.empty:
                         # 基础指标
@@ -185,11 +206,15 @@ class MarketAnalyzer(BaseAgent):
                         prev_close = self._sanitize_data(hist['Close'].iloc[-2])
                         month_ago = self._sanitize_data(hist['Close'].iloc[-22] if len(hist) >= 22 else hist['Close'].iloc[0])
                         
-                        # 技术指标
-                        sma_20 = self._sanitize_data(ta.trend.sma_indicator(hist['Close'], window=20).iloc[-1])
-                        sma_50 = self._sanitize_data(ta.trend.sma_indicator(hist['Close'], window=50).iloc[-1])
-                        rsi = self._sanitize_data(ta.momentum.rsi(hist['Close'], window=14).iloc[-1])
-                        macd = self._sanitize_data(ta.trend.macd_diff(hist['Close']).iloc[-1])
+                        # 技术指标：增量状态随新K线推进，不再重算整段序列
+                        latest = self.indicator_memo.get_or_compute(
+                            self.indicator_memo.key(symbol, hist, params=("streaming",)),
+                            lambda: self.market_data.latest_indicators(symbol, timeout=10)
+                        )
+                        sma_20 = self._sanitize_data(latest.get('sma_20', np.nan))
+                        sma_50 = self._sanitize_data(latest.get('sma_50', np.nan))
+                        rsi = self._sanitize_data(latest.get('rsi', np.nan))
+                        macd = self._sanitize_data(latest.get('macd_diff', np.nan))
                         
                         # 计算变化率时防止除以0
                         daily_change = self._sanitize_data(((last_close / prev_close) - 1) * 100 if prev_close != 0 else 0)
@@ -269,20 +294,19 @@ class MarketAnalyzer(BaseAgent):
         """分析市场情绪"""
         try:
             # 分析技术面情绪
-            spy = yf.Ticker('SPY')
-            hist = spy.history(period='1mo')
+            hist = self.market_data.history('SPY', period='1mo')
             
             if not hist.empty:
+                latest = self.indicator_memo.latest('SPY', hist, ['rsi', 'macd_diff', 'sma_20', 'sma_50'])
                 # 计算RSI
-                rsi = ta.momentum.rsi(hist['Close'], window=14).iloc[-1]
+                rsi = latest['rsi']
                 
                 # 计算MACD
-                macd = ta.trend.macd_diff(hist['Close'])
-                macd_signal = 'bullish' if macd.iloc[-1] > 0 else 'bearish'
+                macd_signal = 'bullish' if latest['macd_diff'] > 0 else 'bearish'
                 
                 # 计算趋势
-                sma_20 = ta.trend.sma_indicator(hist['Close'], window=20).iloc[-1]
-                sma_50 = ta.trend.sma_indicator(hist['Close'], window=50).iloc[-1]
+                sma_20 = latest['sma_20']
+                sma_50 = latest['sma_50']
                 current_price = hist['Close'].iloc[-1]
                 
                 if current_price > sma_20 and sma_20 > sma_50:
@@ -383,8 +407,7 @@ class MarketAnalyzer(BaseAgent):
         sector_data = {}
         for symbol, name in sectors.items():
             try:
-                ticker = yf.Ticker(symbol)
-                hist = ticker.history(period="5d")  # 获取5天的数据以计算更准确的变化
+                hist = self.market_data.history(symbol, period="5d")  # 获取5天的数据以计算更准确的变化
                 
                 if not hist.empty:
                     # 计算涨跌幅（使用收盘价）
@@ -401,15 +424,15 @@ class MarketAnalyzer(BaseAgent):
                     five_day_start = self._sanitize_data(hist['Close'].iloc[0])
                     momentum = ((last_close / five_day_start - 1) * 100) if five_day_start != 0 else 0
                     
+                    latest = self.indicator_memo.latest(symbol, hist, ['rsi', 'macd_diff', 'sma_20'])
                     # 计算相对强弱（RSI）
-                    rsi = self._sanitize_data(ta.momentum.rsi(hist['Close'], window=14).iloc[-1])
+                    rsi = self._sanitize_data(latest['rsi'])
                     
                     # 计算MACD
-                    macd = ta.trend.macd_diff(hist['Close'])
-                    macd_signal = 'bullish' if macd.iloc[-1] > 0 else 'bearish'
+                    macd_signal = 'bullish' if latest['macd_diff'] > 0 else 'bearish'
                     
                     # 计算趋势强度
-                    sma_20 = ta.trend.sma_indicator(hist['Close'], window=20).iloc[-1]
+                    sma_20 = latest['sma_20']
                     trend_strength = ((last_close / sma_20 - 1) * 100) if sma_20 != 0 else 0
                     
                     sector_data[name] = {
@@ -529,7 +552,7 @@ class MarketAnalyzer(BaseAgent):
 
 请直接输出分析内容，使用简单的自然语言，不要使用任何标题、序号或特殊格式。"""
             
-            return self.llm_provider.generate_response_sync(prompt=news_prompt)
+            return self.llm_provider.generate_response_sync(prompt=news_prompt, cache_ttl=TTL_NEWS)
             
         except Exception as e:
             logger.error(f"News fetching error: {str(e)}")
@@ -567,7 +590,7 @@ class MarketAnalyzer(BaseAgent):
 
 请用清晰的语言表达，避免使用任何特殊格式。"""
                 
-                return self.llm_provider.generate_response_sync(prompt=backup_prompt)
+                return self.llm_provider.generate_response_sync(prompt=backup_prompt, cache_ttl=TTL_NEWS)
             
             else:
                 return "目前无法获取最新市场新闻，建议稍后再试。"
@@ -640,95 +663,51 @@ class MarketAnalyzer(BaseAgent):
             # 使用S&P 500成分股作为基础股票池
             sp500_url = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
             tables = pd.read_html(sp500_url)
-            sp500_stocks = tables[0]['Symbol'].tolist()[:50]  # 限制为前50只股票以提高性能
+            # Yahoo Finance使用"-"代替"."，例如BRK.B -> BRK-B
+            sp500_stocks = [symbol.replace('.', '-') for symbol in tables[0]['Symbol'].tolist()]
+            
+            # 批量下载整个股票池的K线数据
+            panel = self.market_data.history_panel(sp500_stocks, period="6mo")
+            if panel.empty:
+                logger.warning("No price data available for stock screening")
+                return []
+            
+            # 1. 在整个股票池上一次性计算技术面因子和评分（在进程池中执行）
+            close_panel = panel['Close']
+            symbols = list(close_panel.columns)
+            factors, technical_scores = run_cpu_sync(screening.screen, close_panel.to_numpy(dtype=float).T)
+            volumes = indicators.last_valid(panel['Volume'][symbols].to_numpy(dtype=float).T)
+            
+            # 基本面最多20分，技术面不足40分的股票不可能达到60分
+            candidates = np.flatnonzero(technical_scores >= 40)
+            
+            # 2. 只为候选股票获取基本面数据
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                infos = list(executor.map(self._fetch_stock_info, [symbols[i] for i in candidates]))
+            
+            pe_ratios = np.array([info.get('forwardPE') or np.nan for info in infos], dtype=float)
+            profit_margins = np.array([(info.get('profitMargins') or np.nan) * 100 for info in infos], dtype=float)
+            scores = technical_scores[candidates] + screening.fundamental_scores(pe_ratios, profit_margins)
             
             potential_stocks = []
-            for symbol in sp500_stocks:
-                for attempt in range(3):  # 最多重试3次
-                    try:
-                        logger.info(f"Analyzing stock {symbol} (attempt {attempt + 1})")
-                        # 获取股票数据，设置较短的超时时间
-                        stock = yf.Ticker(symbol)
-                        hist = stock.history(period="6mo", timeout=10)
-                        info = stock.info
-                        
-                        if hist.empty or not info:
-                            logger.warning(f"No data available for {symbol}")
-                            break  # 如果没有数据，直接跳过这只股票
-                            
-                        # 计算技术指标
-                        close_prices = hist['Close']
-                        rsi = ta.momentum.rsi(close_prices, window=14).iloc[-1]
-                        macd = ta.trend.macd_diff(close_prices).iloc[-1]
-                        sma_20 = ta.trend.sma_indicator(close_prices, window=20).iloc[-1]
-                        sma_50 = ta.trend.sma_indicator(close_prices, window=50).iloc[-1]
-                        
-                        # 计算动量
-                        momentum = ((close_prices.iloc[-1] / close_prices.iloc[-20]) - 1) * 100
-                        
-                        # 获取基本面数据
-                        pe_ratio = info.get('forwardPE', 0)
-                        profit_margin = info.get('profitMargins', 0)
-                        if profit_margin:
-                            profit_margin = profit_margin * 100
-                        
-                        # 评分系统
-                        score = 0
-                        
-                        # RSI评分 (0-20分)
-                        if 40 <= rsi <= 60:
-                            score += 20
-                        elif 30 <= rsi < 40 or 60 < rsi <= 70:
-                            score += 15
-                        elif rsi < 30:  # 超卖
-                            score += 10
-                        
-                        # MACD评分 (0-20分)
-                        if macd > 0:
-                            score += 20
-                        
-                        # 均线评分 (0-20分)
-                        if close_prices.iloc[-1] > sma_20 > sma_50:
-                            score += 20
-                        elif close_prices.iloc[-1] > sma_20:
-                            score += 10
-                        
-                        # 动量评分 (0-20分)
-                        if momentum > 0:
-                            score += 20
-                        elif momentum > -5:
-                            score += 10
-                        
-                        # 基本面评分 (0-20分)
-                        if 0 < pe_ratio < 30:
-                            score += 10
-                        if profit_margin > 10:
-                            score += 10
-                        
-                        # 只添加评分大于60的股票
-                        if score >= 60:
-                            stock_data = {
-                                'symbol': symbol,
-                                'name': info.get('longName', symbol),
-                                'sector': info.get('sector', 'Unknown'),
-                                'momentum': round(momentum, 2),
-                                'rsi': round(rsi, 2),
-                                'pe_ratio': round(pe_ratio, 2) if pe_ratio else None,
-                                'profit_margin': round(profit_margin, 2) if profit_margin else None,
-                                'score': score,
-                                'current_price': round(close_prices.iloc[-1], 2),
-                                'volume': int(hist['Volume'].iloc[-1]),
-                                'market_cap': info.get('marketCap', 0)
-                            }
-                            potential_stocks.append(stock_data)
-                            
-                        break  # 成功获取数据后跳出重试循环
-                        
-                    except Exception as e:
-                        logger.error(f"Error analyzing stock {symbol} (attempt {attempt + 1}): {str(e)}")
-                        if attempt == 2:  # 最后一次尝试失败
-                            continue
-                        time.sleep(2 ** attempt)  # 指数退避
+            for i, info, score, pe_ratio, profit_margin in zip(candidates, infos, scores, pe_ratios, profit_margins):
+                # 只添加评分大于60的股票
+                if not info or score < 60:
+                    continue
+                symbol = symbols[i]
+                potential_stocks.append({
+                    'symbol': symbol,
+                    'name': info.get('longName', symbol),
+                    'sector': info.get('sector', 'Unknown'),
+                    'momentum': round(float(factors['momentum'][i]), 2),
+                    'rsi': round(float(factors['rsi'][i]), 2),
+                    'pe_ratio': round(float(pe_ratio), 2) if np.isfinite(pe_ratio) else None,
+                    'profit_margin': round(float(profit_margin), 2) if np.isfinite(profit_margin) else None,
+                    'score': int(score),
+                    'current_price': round(float(factors['price'][i]), 2),
+                    'volume': int(volumes[i]) if np.isfinite(volumes[i]) else 0,
+                    'market_cap': info.get('marketCap', 0)
+                })
             
             # 按评分排序
             potential_stocks.sort(key=lambda x: x['score'], reverse=True)
@@ -738,6 +717,14 @@ class MarketAnalyzer(BaseAgent):
             logger.error(f"Error in stock screening: {str(e)}")
             return []
 
+    def _fetch_stock_info(self, symbol):
+        """获取单只股票的基本面信息，失败时返回空字典"""
+        try:
+            return self.market_data.info(symbol)
+        except Exception as e:
+            logger.error(f"Error fetching info for {symbol}: {str(e)}")
+            return {}
+
     def handle_task(self, task):
         """处理任务"""
         try:
@@ -747,20 +734,8 @@ class MarketAnalyzer(BaseAgent):
             # 执行市场分析
             result = self.analyze_market()
             
-            # 清理并序列化结果
-            sanitized_result = self._sanitize_data(result)
-            
-            # 使用自定义编码器进行JSON序列化测试
-            try:
-                json.dumps(sanitized_result, cls=CustomJSONEncoder)
-                return {"status": "success", "data": sanitized_result}
-            except Exception as e:
-                logger.error(f"Error serializing result: {e}")
-                return {
-                    "status": "error",
-                    "error": "数据序列化失败",
-                    "message": str(e)
-                }
+            # 清理特殊浮点数，序列化由NumpyJSONResponse一次完成
+            return {"status": "success", "data": self._sanitize_data(result)}
         except Exception as e:
             logger.error(f"Error in handle_task: {e}")
             return {
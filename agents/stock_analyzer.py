@@ -1,9 +1,12 @@
-import yfinance as yf
 import pandas as pd
 import json
 from core.base_agent import BaseAgent
 from datetime import datetime, timedelta
 from core.llm_provider import LLMProvider
+from core.llm_cache import TTL_NEWS
+from core.market_data import get_market_data_gateway
+from core.downsample import downsample_indices
+from core.sanitize import series_to_list
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,8 +16,9 @@ class StockAnalyzer(BaseAgent):
         super().__init__()
         self.default_symbols = ['AAPL', 'GOOGL', 'MSFT', 'AMZN', 'META']
         self.llm_provider = LLMProvider()
+        self.market_data = get_market_data_gateway()
 
-    def analyze_stocks(self, analysis_type, symbols=None, period='1mo'):
+    def analyze_stocks(self, analysis_type, symbols=None, period='1mo', max_points=None):
         try:
             symbols = symbols or self.default_symbols
             if isinstance(symbols, str):
@@ -27,18 +31,16 @@ class StockAnalyzer(BaseAgent):
             
             data = {}
             for symbol in symbols[:5]:  # 限制最多5个股票
-                stock = yf.Ticker(symbol)
-                hist = stock.history(period=period)
-                data[symbol] = hist
+                data[symbol] = self.market_data.history(symbol, period=period)
 
             if analysis_type == "价格趋势":
-                return self._analyze_price_trends(data)
+                return self._analyze_price_trends(data, max_points)
             elif analysis_type == "成交量分析":
                 return self._analyze_volume(data)
             elif analysis_type == "技术指标":
                 return self._analyze_technical_indicators(data)
             else:
-                return self._analyze_price_trends(data)  # 默认分析
+                return self._analyze_price_trends(data, max_points)  # 默认分析
 
         except Exception as e:
             return {
@@ -48,18 +50,26 @@ class StockAnalyzer(BaseAgent):
                 "datasets": []
             }
 
-    def _analyze_price_trends(self, data):
+    def _analyze_price_trends(self, data, max_points=None):
+        """价格走势图，max_points限制点数，超出时按第一只股票的走势做LTTB降采样"""
         labels = []
         datasets = []
+        indices = None
         
         for symbol, df in data.items():
             if len(df) > 0:
                 if not labels:
                     labels = df.index.strftime('%Y-%m-%d').tolist()
+                    indices = downsample_indices(df['Close'].to_numpy(), max_points)
+                    if indices is not None:
+                        labels = [labels[i] for i in indices]
                 
+                close = df['Close'].to_numpy()
+                if indices is not None:
+                    close = close[indices[indices < len(close)]]
                 datasets.append({
                     "label": symbol,
-                    "data": df['Close'].round(2).tolist(),
+                    "data": series_to_list(close, decimals=2),
                     "borderColor": self._get_color(len(datasets)),
                     "fill": False
                 })
@@ -82,7 +92,7 @@ class StockAnalyzer(BaseAgent):
                 
                 datasets.append({
                     "label": f"{symbol} 成交量",
-                    "data": (df['Volume'] / 1_000_000).round(2).tolist(),  # 转换为百万股
+                    "data": series_to_list(df['Volume'] / 1_000_000, decimals=2),  # 转换为百万股
                     "backgroundColor": self._get_color(len(datasets), 0.5),
                     "type": "bar"
                 })
@@ -110,19 +120,19 @@ class StockAnalyzer(BaseAgent):
                 datasets.extend([
                     {
                         "label": f"{symbol} 收盘价",
-                        "data": df['Close'].round(2).tolist(),
+                        "data": series_to_list(df['Close'], decimals=2),
                         "borderColor": self._get_color(len(datasets)),
                         "fill": False
                     },
                     {
                         "label": f"{symbol} 5日均线",
-                        "data": df['MA5'].round(2).tolist(),
+                        "data": series_to_list(df['MA5'], decimals=2),
                         "borderColor": self._get_color(len(datasets) + 1),
                         "borderDash": [5, 5]
                     },
                     {
                         "label": f"{symbol} 20日均线",
-                        "data": df['MA20'].round(2).tolist(),
+                        "data": series_to_list(df['MA20'], decimals=2),
                         "borderColor": self._get_color(len(datasets) + 2),
                         "borderDash": [2, 2]
                     }
@@ -142,8 +152,7 @@ class StockAnalyzer(BaseAgent):
         
         for symbol in symbols[:5]:
             try:
-                stock = yf.Ticker(symbol)
-                info = stock.info
+                info = self.market_data.info(symbol)
                 
                 # 获取关键财务指标
                 pe_ratio = info.get('trailingPE', 0)
@@ -211,8 +220,7 @@ class StockAnalyzer(BaseAgent):
         
         for symbol in symbols[:3]:  # 限制分析前3个股票
             try:
-                stock = yf.Ticker(symbol)
-                news = stock.news[:5]  # 获取最新的5条新闻
+                news = self.market_data.news(symbol)[:5]  # 获取最新的5条新闻
                 
                 # 收集新闻数据
                 symbol_news = []
@@ -228,7 +236,7 @@ class StockAnalyzer(BaseAgent):
                 # 使用LLM分析新闻情绪
                 news_texts = "\n".join([f"标题: {n['title']}" for n in symbol_news])
                 prompt = f"分析以下{symbol}股票的新闻标题，总结整体市场情绪（积极/中性/消极）并给出简要理由：\n{news_texts}"
-                sentiment_analysis = self.llm_provider.generate_response(prompt)
+                sentiment_analysis = self.llm_provider.generate_response(prompt, cache_ttl=TTL_NEWS)
                 
                 news_data.append({
                     'symbol': symbol,
@@ -267,8 +275,9 @@ class StockAnalyzer(BaseAgent):
         analysis_type = task.kwargs.get("analysisType", "价格趋势")
         symbols = task.kwargs.get("symbols", None)
         period = task.kwargs.get("period", "1mo")
+        max_points = task.kwargs.get("max_points")
         
-        result = self.analyze_stocks(analysis_type, symbols, period)
+        result = self.analyze_stocks(analysis_type, symbols, period, max_points)
         
         # 确保结果可以被JSON序列化
         try:
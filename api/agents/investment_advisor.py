@@ -1,28 +1,60 @@
+import asyncio
 import logging
 from functools import lru_cache
 from typing import Dict, List, Optional, Union, Any, Tuple
-import yfinance as yf
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from core.llm_provider import LLMProvider
+from core.llm_cache import TTL_COMPANY_PROFILE, TTL_FUNDAMENTALS, TTL_MARKET_REPORT, TTL_NEWS
+from core.market_data import get_market_data_gateway, GatewayTicker
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
 from sklearn.model_selection import train_test_split
-from ta.trend import SMAIndicator, EMAIndicator, MACD, ADXIndicator, IchimokuIndicator, KSTIndicator
-from ta.momentum import RSIIndicator, StochasticOscillator, WilliamsRIndicator, ROCIndicator
-from ta.volatility import BollingerBands, AverageTrueRange, KeltnerChannels
-from ta.volume import OnBalanceVolumeIndicator, ForceIndexIndicator, ChaikinMoneyFlowIndicator, MFIIndicator
-from ta.others import DailyReturnIndicator, CumulativeReturnIndicator
+from core import indicators
+from core.sanitize import sanitize_float
+from core.chart_payload import render_charts
+from core.fanout import map_bounded, run_blocking
+from core.executors import run_cpu
+from core.indicator_memo import indicator_graph
 from prophet import Prophet
 
 logger = logging.getLogger(__name__)
 
+
+def prophet_forecast(dates: np.ndarray, closes: np.ndarray, days_to_predict: int) -> List[float]:
+    """拟合Prophet模型并返回未来days_to_predict天的预测值
+
+    模块级函数，参数均为数组，便于在进程池中执行。
+    """
+    # 准备数据
+    df = pd.DataFrame({
+        'ds': pd.to_datetime(dates),
+        'y': closes
+    })
+    
+    # 创建和训练模型
+    model = Prophet(
+        daily_seasonality=True,
+        weekly_seasonality=True,
+        yearly_seasonality=True,
+        changepoint_prior_scale=0.05
+    )
+    model.fit(df)
+    
+    # 创建预测日期
+    future_dates = model.make_future_dataframe(periods=days_to_predict)
+    forecast = model.predict(future_dates)
+    
+    # 返回预测结果
+    return forecast.tail(days_to_predict)['yhat'].tolist()
+
 class InvestmentAdvisor:
     def __init__(self):
         self.cache = {}
         self.cache_timeout = timedelta(minutes=5)
         self.llm_provider = LLMProvider()
+        self.market_data = get_market_data_gateway()
     
     def _get_cached_data(self, symbol: str) -> Optional[Dict[str, Any]]:
         """从缓存中获取数据"""
@@ -100,24 +132,16 @@ class InvestmentAdvisor:
 
     def _sanitize_float(self, value: Any) -> float:
         """处理浮点数，确保JSON兼容"""
-        try:
-            if pd.isna(value) or np.isinf(value):
-                return 0.0
-            value = float(value)
-            if abs(value) > 1e308:  # JSON的最大值限制
-                return 0.0
-            return value
-        except (TypeError, ValueError):
-            return 0.0
-
-    def _fetch_stock_data(self, symbol: str) -> Optional[yf.Ticker]:
+        return sanitize_float(value)
+
+    def _fetch_stock_data(self, symbol: str) -> Optional[GatewayTicker]:
         """获取股票数据"""
         try:
             # 转换公司名称为股票代码
             symbol = self._convert_to_symbol(symbol)
             logger.info(f"Fetching data for symbol: {symbol}")
             
-            stock = yf.Ticker(symbol)
+            stock = self.market_data.ticker(symbol)
             # 验证是否能获取到数据
             hist = stock.history(period="1y")
             if hist.empty:
@@ -130,16 +154,21 @@ class InvestmentAdvisor:
             logger.error(f"获取股票数据时出错 {symbol}: {str(e)}")
             return None
 
-    def _generate_charts(self, symbol: str, hist: pd.DataFrame, prediction_result: Dict[str, Any] = None) -> List[Dict[str, Any]]:
-        """生成增强的图表数据"""
+    def _generate_charts(self, symbol: str, hist: pd.DataFrame, prediction_result: Dict[str, Any] = None,
+                         chart_format: str = "full", max_points: Optional[int] = None) -> List[Dict[str, Any]]:
+        """生成增强的图表数据
+
+        chart_format为"compact"时输出共享日期轴的紧凑格式；max_points限制每个图表的点数。
+        """
         try:
             if hist.empty:
                 return []
             
-            # 计算技术指标
-            technical_indicators = self._calculate_technical_indicators(hist)
+            # 计算技术指标的完整序列
+            series = self._calculate_indicator_series(hist)
+            labels = hist.index.strftime('%Y-%m-%d').tolist()
             
-            # 基础样式配置
+            # 基础样式配置，各图表共享
             chart_config = {
                 "responsive": True,
                 "maintainAspectRatio": False,
@@ -163,32 +192,30 @@ class InvestmentAdvisor:
             price_chart = {
                 "type": "line",
                 "title": f"{symbol} 价格走势与预测",
-                "labels": hist.index.strftime('%Y-%m-%d').tolist(),
                 "datasets": [
                     {
                         "label": "收盘价",
-                        "data": hist['Close'].tolist(),
+                        "data": hist['Close'].to_numpy(),
                         "borderColor": "rgb(75, 192, 192)",
                         "fill": False,
                         "tension": 0.1
                     },
                     {
                         "label": "20日均线",
-                        "data": technical_indicators['trend_indicators']['sma_20'],
+                        "data": series['sma_20'],
                         "borderColor": "rgb(255, 159, 64)",
                         "borderDash": [5, 5],
                         "fill": False
                     },
                     {
                         "label": "50日均线",
-                        "data": technical_indicators['trend_indicators']['sma_50'],
+                        "data": series['sma_50'],
                         "borderColor": "rgb(54, 162, 235)",
                         "borderDash": [5, 5],
                         "fill": False
                     }
                 ],
                 "config": {
-                    **chart_config,
                     "scales": {
                         "y": {
                             "title": {
@@ -204,7 +231,7 @@ class InvestmentAdvisor:
             if prediction_result and prediction_result.get('lstm_predictions'):
                 price_chart["datasets"].append({
                     "label": "LSTM预测",
-                    "data": [None] * len(hist) + prediction_result['lstm_predictions'],
+                    "data": np.concatenate([np.full(len(hist), np.nan), prediction_result['lstm_predictions']]),
                     "borderColor": "rgb(153, 102, 255)",
                     "borderDash": [5, 5],
                     "fill": False
@@ -213,7 +240,7 @@ class InvestmentAdvisor:
             if prediction_result and prediction_result.get('prophet_predictions'):
                 price_chart["datasets"].append({
                     "label": "Prophet预测",
-                    "data": [None] * len(hist) + prediction_result['prophet_predictions'],
+                    "data": np.concatenate([np.full(len(hist), np.nan), prediction_result['prophet_predictions']]),
                     "borderColor": "rgb(255, 99, 132)",
                     "borderDash": [5, 5],
                     "fill": False
@@ -223,29 +250,28 @@ class InvestmentAdvisor:
             technical_chart = {
                 "type": "line",
                 "title": f"{symbol} 技术指标",
-                "labels": hist.index.strftime('%Y-%m-%d').tolist()[-60:],  # 显示最近60天
+                "window": 60,  # 显示最近60天
                 "datasets": [
                     {
                         "label": "RSI",
-                        "data": technical_indicators['momentum_indicators']['rsi'],
+                        "data": series['rsi'],
                         "borderColor": "rgb(255, 99, 132)",
                         "yAxisID": "rsi"
                     },
                     {
                         "label": "MACD",
-                        "data": technical_indicators['trend_indicators']['macd_line'],
+                        "data": series['macd_line'],
                         "borderColor": "rgb(54, 162, 235)",
                         "yAxisID": "macd"
                     },
                     {
                         "label": "MACD信号",
-                        "data": technical_indicators['trend_indicators']['macd_signal'],
+                        "data": series['macd_signal'],
                         "borderColor": "rgb(75, 192, 192)",
                         "yAxisID": "macd"
                     }
                 ],
                 "config": {
-                    **chart_config,
                     "scales": {
                         "rsi": {
                             "position": "right",
@@ -271,43 +297,42 @@ class InvestmentAdvisor:
             volatility_chart = {
                 "type": "line",
                 "title": f"{symbol} 波动率指标",
-                "labels": hist.index.strftime('%Y-%m-%d').tolist()[-30:],  # 显示最近30天
+                "window": 30,  # 显示最近30天
                 "datasets": [
                     {
                         "label": "布林带上轨",
-                        "data": technical_indicators['volatility_indicators']['bb_high'],
+                        "data": series['bb_high'],
                         "borderColor": "rgba(255, 99, 132, 0.8)",
                         "fill": False
                     },
                     {
                         "label": "布林带中轨",
-                        "data": technical_indicators['volatility_indicators']['bb_mid'],
+                        "data": series['bb_mid'],
                         "borderColor": "rgba(54, 162, 235, 0.8)",
                         "fill": False
                     },
                     {
                         "label": "布林带下轨",
-                        "data": technical_indicators['volatility_indicators']['bb_low'],
+                        "data": series['bb_low'],
                         "borderColor": "rgba(75, 192, 192, 0.8)",
                         "fill": False
                     },
                     {
                         "label": "Keltner通道上轨",
-                        "data": technical_indicators['volatility_indicators']['keltner_high'],
+                        "data": series['keltner_high'],
                         "borderColor": "rgba(153, 102, 255, 0.8)",
                         "borderDash": [5, 5],
                         "fill": False
                     },
                     {
                         "label": "Keltner通道下轨",
-                        "data": technical_indicators['volatility_indicators']['keltner_low'],
+                        "data": series['keltner_low'],
                         "borderColor": "rgba(255, 159, 64, 0.8)",
                         "borderDash": [5, 5],
                         "fill": False
                     }
                 ],
                 "config": {
-                    **chart_config,
                     "scales": {
                         "y": {
                             "title": {
@@ -323,32 +348,31 @@ class InvestmentAdvisor:
             volume_chart = {
                 "type": "mixed",
                 "title": f"{symbol} 成交量和资金流向",
-                "labels": hist.index.strftime('%Y-%m-%d').tolist()[-30:],
+                "window": 30,
                 "datasets": [
                     {
                         "type": "bar",
                         "label": "成交量",
-                        "data": hist['Volume'].tolist()[-30:],
+                        "data": hist['Volume'].to_numpy(),
                         "backgroundColor": "rgba(153, 102, 255, 0.5)",
                         "yAxisID": "volume"
                     },
                     {
                         "type": "line",
                         "label": "资金流量指标(MFI)",
-                        "data": technical_indicators['volume_indicators']['mfi'],
+                        "data": series['mfi'],
                         "borderColor": "rgb(255, 99, 132)",
                         "yAxisID": "mfi"
                     },
                     {
                         "type": "line",
                         "label": "钱德动量(CMF)",
-                        "data": technical_indicators['volume_indicators']['cmf'],
+                        "data": series['cmf'],
                         "borderColor": "rgb(54, 162, 235)",
                         "yAxisID": "cmf"
                     }
                 ],
                 "config": {
-                    **chart_config,
                     "scales": {
                         "volume": {
                             "position": "left",
@@ -379,13 +403,16 @@ class InvestmentAdvisor:
                 }
             }
             
-            return [price_chart, technical_chart, volatility_chart, volume_chart]
+            return render_charts(
+                [price_chart, technical_chart, volatility_chart, volume_chart],
+                labels, chart_config, chart_format, max_points
+            )
             
         except Exception as e:
             logger.error(f"生成图表时出错 {symbol}: {str(e)}")
             return []
 
-    def _analyze_fundamentals(self, symbol: str, stock: yf.Ticker) -> Dict[str, Any]:
+    def _analyze_fundamentals(self, symbol: str, stock: GatewayTicker) -> Dict[str, Any]:
         """分析股票基本面数据"""
         try:
             hist = stock.history(period="1y")
@@ -430,7 +457,7 @@ class InvestmentAdvisor:
             logger.error(f"分析基本面数据时出错 {symbol}: {str(e)}")
             return self._get_default_metrics()
 
-    def _generate_investment_advice(self, symbol: str, fundamentals: Dict[str, Any]) -> str:
+    async def _generate_investment_advice(self, symbol: str, fundamentals: Dict[str, Any]) -> str:
         """生成投资建议"""
         try:
             prompt = f"""基于以下基本面数据生成详细的投资建议：
@@ -449,9 +476,12 @@ class InvestmentAdvisor:
             请从估值水平、盈利能力和投资风险三个维度进行分析，并给出具体的投资建议。
             """
             
-            # 使用同步方式调用
-            response = self.llm_provider.generate_response_sync(prompt)
-            return response
+            return await self.llm_provider.generate_response_async(
+                prompt,
+                system_prompt="你是一个专业的AI助手，擅长分析和生成高质量内容。",
+                max_tokens=2000,
+                cache_ttl=TTL_FUNDAMENTALS
+            )
             
         except Exception as e:
             logger.error(f"生成投资建议时出错: {str(e)}")
@@ -482,8 +512,7 @@ class InvestmentAdvisor:
             ]
             
             # 计算波动性指标
-            atr = AverageTrueRange(high=hist['High'], low=hist['Low'], close=hist['Close'])
-            current_atr = atr.average_true_range().iloc[-1]
+            current_atr = indicator_graph(hist)["atr"][-1]
             atr_percent = (current_atr / hist['Close'].iloc[-1]) * 100
             
             # 计算成交量分析
@@ -565,7 +594,7 @@ class InvestmentAdvisor:
             """
             
             # 使用流式响应
-            analysis = await self.llm_provider.generate_response_stream(prompt, model="gpt-4-turbo-preview")
+            analysis = "".join([chunk async for chunk in self.llm_provider.generate_response_stream(prompt, model="gpt-4-turbo-preview")])
             
             return {
                 "quantitative_metrics": {
@@ -607,8 +636,14 @@ class InvestmentAdvisor:
                 "analysis": "无法生成分析"
             }
 
-    async def analyze_investment(self, symbols: List[str]) -> Dict[str, Any]:
-        """分析投资标的并生成建议"""
+    async def analyze_investment(self, symbols: List[str], chart_format: str = "full",
+                                 max_points: Optional[int] = None,
+                                 concurrency: Optional[int] = None) -> Dict[str, Any]:
+        """分析投资标的并生成建议，chart_format见core.chart_payload
+
+        各股票并发分析，同时进行的不超过concurrency只（默认见core.fanout.analysis_concurrency），
+        结果按输入顺序合并。
+        """
         logger.info(f"Analyzing stocks: {symbols}")
         
         try:
@@ -645,69 +680,24 @@ class InvestmentAdvisor:
             if not processed_symbols:
                 raise ValueError("没有有效的股票代码可供分析")
             
-            for symbol in processed_symbols:
-                logger.info(f"Fetching data for {symbol}")
-                try:
-                    stock = self._fetch_stock_data(symbol)
-                    if stock is None:
-                        logger.error(f"无法获取股票数据: {symbol}")
-                        continue
-                    
-                    # 获取历史数据和信息
-                    hist = stock.history(period="1y")
-                    if hist.empty:
-                        logger.warning(f"No historical data for {symbol}")
-                        continue
-                        
-                    info = stock.info
-                    if not info:
-                        logger.warning(f"No information available for {symbol}")
-                        continue
-                    
-                    # 分析基本面数据
-                    fundamentals = self._analyze_fundamentals(symbol, stock)
-                    result["investmentAdvice"]["fundamentals"][symbol] = fundamentals
-                    
-                    # 分析公司信息
-                    company_info = {
-                        "name": info.get("longName", symbol),
-                        "introduction": info.get("longBusinessSummary", "暂无简介"),
-                        "industry": info.get("industry", "未知行业"),
-                        "sector": info.get("sector", "未知板块"),
-                        "website": info.get("website", ""),
-                        "country": info.get("country", ""),
-                        "employees": info.get("fullTimeEmployees", 0),
-                        "mainBusinesses": [info.get("industry", "未知业务")]
-                    }
-                    result["investmentAdvice"]["companyInfo"][symbol] = company_info
-                    
-                    # 生成价格预测
-                    prediction_result = self._predict_stock_price(hist)
-                    result["investmentAdvice"]["predictions"][symbol] = prediction_result
-                    
-                    # 使用GPT-4进行深度分析
-                    gpt_analysis = await self._analyze_stock_with_gpt4(
-                        symbol, 
-                        hist, 
-                        fundamentals,
-                        prediction_result["market_analysis"]
-                    )
-                    result["investmentAdvice"]["gptAnalysis"][symbol] = gpt_analysis
-                    
-                    # 生成图表数据
-                    charts = self._generate_charts(symbol, hist, prediction_result)
-                    result["investmentAdvice"]["charts"].extend(charts)
-                    
-                    # 生成投资建议
-                    advice = self._generate_investment_advice(symbol, fundamentals)
-                    if not result["investmentAdvice"]["advice"]:
-                        result["investmentAdvice"]["advice"] = advice
-                    else:
-                        result["investmentAdvice"]["advice"] += f"\n\n{advice}"
-                    
-                except Exception as e:
-                    logger.error(f"Error analyzing {symbol}: {str(e)}")
+            analyses = await map_bounded(
+                lambda symbol: self._analyze_symbol(symbol, chart_format, max_points),
+                processed_symbols,
+                concurrency
+            )
+            
+            advice_parts = []
+            for symbol, analysis in zip(processed_symbols, analyses):
+                if isinstance(analysis, Exception):
+                    logger.error(f"Error analyzing {symbol}: {str(analysis)}")
                     continue
+                if analysis is None:
+                    continue
+                for key in ("fundamentals", "companyInfo", "predictions", "gptAnalysis"):
+                    result["investmentAdvice"][key][symbol] = analysis[key]
+                result["investmentAdvice"]["charts"].extend(analysis["charts"])
+                advice_parts.append(analysis["advice"])
+            result["investmentAdvice"]["advice"] = "\n\n".join(advice_parts)
             
             if not result["investmentAdvice"]["fundamentals"]:
                 raise ValueError("无法获取任何股票的数据")
@@ -718,7 +708,71 @@ class InvestmentAdvisor:
             logger.error(f"Error in analyze_investment: {str(e)}")
             raise
 
-    def _analyze_company_info(self, symbol: str, stock: yf.Ticker) -> Dict[str, Any]:
+    async def _analyze_symbol(self, symbol: str, chart_format: str = "full",
+                              max_points: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """分析单只股票，无法获取数据时返回None"""
+        logger.info(f"Fetching data for {symbol}")
+        stock = await run_blocking(self._fetch_stock_data, symbol)
+        if stock is None:
+            logger.error(f"无法获取股票数据: {symbol}")
+            return None
+        
+        # 获取历史数据和信息
+        hist = await run_blocking(stock.history, period="1y")
+        if hist.empty:
+            logger.warning(f"No historical data for {symbol}")
+            return None
+            
+        info = await run_blocking(lambda: stock.info)
+        if not info:
+            logger.warning(f"No information available for {symbol}")
+            return None
+        
+        # 分析基本面数据
+        fundamentals = await run_blocking(self._analyze_fundamentals, symbol, stock)
+        
+        # 分析公司信息
+        company_info = {
+            "name": info.get("longName", symbol),
+            "introduction": info.get("longBusinessSummary", "暂无简介"),
+            "industry": info.get("industry", "未知行业"),
+            "sector": info.get("sector", "未知板块"),
+            "website": info.get("website", ""),
+            "country": info.get("country", ""),
+            "employees": info.get("fullTimeEmployees", 0),
+            "mainBusinesses": [info.get("industry", "未知业务")]
+        }
+        
+        async def predict_and_analyze() -> Tuple[Dict[str, Any], Dict[str, Any]]:
+            # 价格预测完成后才能进行依赖其市场状况的深度分析
+            prediction_result = await self._predict_stock_price(hist)
+            gpt_analysis = await self._analyze_stock_with_gpt4(
+                symbol, 
+                hist, 
+                fundamentals,
+                prediction_result["market_analysis"]
+            )
+            return prediction_result, gpt_analysis
+        
+        # 投资建议只依赖基本面数据，与预测和深度分析同时进行
+        (prediction_result, gpt_analysis), advice = await asyncio.gather(
+            predict_and_analyze(),
+            self._generate_investment_advice(symbol, fundamentals)
+        )
+        
+        # 生成图表数据
+        charts = await run_blocking(self._generate_charts, symbol, hist, prediction_result, chart_format, max_points)
+        
+        return {
+            "fundamentals": fundamentals,
+            "companyInfo": company_info,
+            "predictions": prediction_result,
+            "gptAnalysis": gpt_analysis,
+            "charts": charts,
+            "advice": advice
+        }
+
+    def _analyze_company_info(self, symbol: str, stock: GatewayTicker) -> Dict[str, Any]:
         """分析公司信息"""
         try:
             info = stock.info
@@ -730,7 +784,7 @@ class InvestmentAdvisor:
             """
             
             # 使用同步方式调用
-            response = self.llm_provider.generate_response_sync(prompt)
+            response = self.llm_provider.generate_response_sync(prompt, cache_ttl=TTL_COMPANY_PROFILE)
             
             # 解析响应
             sections = response.split('\n\n')
@@ -811,56 +865,29 @@ class InvestmentAdvisor:
             }
         }
 
+    # 返回字段名 -> 指标图中的节点名
+    MARKET_INDICATOR_GROUPS = {
+        "trend": {"macd": "macd_line", "macd_signal": "macd_signal", "macd_diff": "macd_diff",
+                  "adx": "adx", "adx_pos": "adx_pos", "adx_neg": "adx_neg"},
+        "momentum": {"stoch_k": "stoch_k", "stoch_d": "stoch_d"},
+        "volume": {"obv": "obv", "force_index": "force_index"},
+        "volatility": {"atr": "atr"}
+    }
+
     def _calculate_market_indicators(self, hist: pd.DataFrame) -> Dict[str, Any]:
         """计算市场技术指标"""
         try:
             if hist.empty:
                 return {}
                 
-            close = hist['Close']
-            high = hist['High']
-            low = hist['Low']
-            volume = hist['Volume']
-            
-            # 趋势指标
-            macd = MACD(close=close)
-            adx = ADXIndicator(high=high, low=low, close=close)
-            
-            # 动量指标
-            stoch = StochasticOscillator(high=high, low=low, close=close)
-            
-            # 成交量指标
-            obv = OnBalanceVolumeIndicator(close=close, volume=volume)
-            fi = ForceIndexIndicator(close=close, volume=volume)
-            
-            # 波动率指标
-            atr = AverageTrueRange(high=high, low=low, close=close)
-            
-            # 计算各项指标的最新值
-            indicators = {
-                "trend": {
-                    "macd": self._sanitize_float(macd.macd().iloc[-1]),
-                    "macd_signal": self._sanitize_float(macd.macd_signal().iloc[-1]),
-                    "macd_diff": self._sanitize_float(macd.macd_diff().iloc[-1]),
-                    "adx": self._sanitize_float(adx.adx().iloc[-1]),
-                    "adx_pos": self._sanitize_float(adx.adx_pos().iloc[-1]),
-                    "adx_neg": self._sanitize_float(adx.adx_neg().iloc[-1])
-                },
-                "momentum": {
-                    "stoch_k": self._sanitize_float(stoch.stoch().iloc[-1]),
-                    "stoch_d": self._sanitize_float(stoch.stoch_signal().iloc[-1])
-                },
-                "volume": {
-                    "obv": self._sanitize_float(obv.on_balance_volume().iloc[-1]),
-                    "force_index": self._sanitize_float(fi.force_index().iloc[-1])
-                },
-                "volatility": {
-                    "atr": self._sanitize_float(atr.average_true_range().iloc[-1])
-                }
+            latest = indicator_graph(hist).latest(
+                name for names in self.MARKET_INDICATOR_GROUPS.values() for name in names.values()
+            )
+            return {
+                group: {key: self._sanitize_float(latest[name]) for key, name in names.items()}
+                for group, names in self.MARKET_INDICATOR_GROUPS.items()
             }
             
-            return indicators
-            
         except Exception as e:
             logger.error(f"计算市场指标时出错: {str(e)}")
             return {}
@@ -1021,7 +1048,7 @@ class InvestmentAdvisor:
 }}"""
 
             # 使用GPT-4进行预测
-            response = await self.llm_provider.generate_response(prompt, model="gpt-4-turbo-preview")
+            response = await self.llm_provider.generate_response_async(prompt, model="gpt-4-turbo-preview")
             
             try:
                 # 解析JSON响应
@@ -1086,14 +1113,20 @@ class InvestmentAdvisor:
                 }
             
             # 计算技术指标
-            technical_indicators = self._calculate_technical_indicators(hist)
-            market_analysis = self._analyze_market_condition(hist)
+            technical_indicators, market_analysis = await asyncio.gather(
+                run_blocking(self._calculate_technical_indicators, hist),
+                run_blocking(self._analyze_market_condition, hist)
+            )
             
-            # 使用LLM进行预测
-            prediction_result = await self._predict_with_llm(hist, technical_indicators, prediction_days)
+            # LLM预测与Prophet模型拟合（进程池）同时进行
+            prediction_result, prophet_predictions = await asyncio.gather(
+                self._predict_with_llm(hist, technical_indicators, prediction_days),
+                self._predict_with_prophet(hist, prediction_days)
+            )
             
             return {
                 **prediction_result,
+                "prophet_predictions": prophet_predictions,
                 "technical_indicators": technical_indicators,
                 "market_analysis": market_analysis
             }
@@ -1116,115 +1149,44 @@ class InvestmentAdvisor:
                 "analysis": "预测过程出错"
             }
 
+    # _calculate_technical_indicators返回结构中各分组包含的指标
+    TECHNICAL_INDICATOR_GROUPS = {
+        "trend_indicators": ["sma_20", "sma_50", "ema_20", "macd_line", "macd_signal", "macd_diff",
+                             "adx", "ichimoku_a", "ichimoku_b", "kst", "kst_sig"],
+        "momentum_indicators": ["rsi", "stoch_k", "stoch_d", "williams_r", "roc"],
+        "volatility_indicators": ["bb_high", "bb_mid", "bb_low", "atr",
+                                  "keltner_high", "keltner_mid", "keltner_low"],
+        "volume_indicators": ["obv", "force_index", "cmf", "mfi"],
+        "return_indicators": ["daily_return", "cumulative_return"]
+    }
+
+    def _calculate_indicator_series(self, hist: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """全部技术指标的完整序列，与同一请求中的其他计算共享指标图"""
+        return indicator_graph(hist).series(indicators.INDICATOR_NAMES)
+
     def _calculate_technical_indicators(self, hist: pd.DataFrame) -> Dict[str, Any]:
         """计算扩展的技术指标"""
         try:
-            close = hist['Close']
-            high = hist['High']
-            low = hist['Low']
-            volume = hist['Volume']
-            
-            # 趋势指标
-            sma_20 = SMAIndicator(close, window=20).sma_indicator()
-            sma_50 = SMAIndicator(close, window=50).sma_indicator()
-            ema_20 = EMAIndicator(close, window=20).ema_indicator()
-            macd = MACD(close)
-            adx = ADXIndicator(high, low, close)
-            ichimoku = IchimokuIndicator(high, low)
-            kst = KSTIndicator(close)
-            
-            # 动量指标
-            rsi = RSIIndicator(close)
-            stoch = StochasticOscillator(high, low, close)
-            williams_r = WilliamsRIndicator(high, low, close)
-            roc = ROCIndicator(close)
-            
-            # 波动率指标
-            bollinger = BollingerBands(close)
-            atr = AverageTrueRange(high, low, close)
-            keltner = KeltnerChannels(high, low, close)
-            
-            # 成交量指标
-            obv = OnBalanceVolumeIndicator(close, volume)
-            fi = ForceIndexIndicator(close, volume)
-            cmf = ChaikinMoneyFlowIndicator(high, low, close, volume)
-            mfi = MFIIndicator(high, low, close, volume)
-            
-            # 收益率指标
-            daily_return = DailyReturnIndicator(close)
-            cumulative_return = CumulativeReturnIndicator(close)
-            
+            latest = indicator_graph(hist).latest(
+                name for names in self.TECHNICAL_INDICATOR_GROUPS.values() for name in names
+            )
             return {
-                "trend_indicators": {
-                    "sma_20": self._sanitize_float(sma_20.iloc[-1]),
-                    "sma_50": self._sanitize_float(sma_50.iloc[-1]),
-                    "ema_20": self._sanitize_float(ema_20.iloc[-1]),
-                    "macd_line": self._sanitize_float(macd.macd().iloc[-1]),
-                    "macd_signal": self._sanitize_float(macd.macd_signal().iloc[-1]),
-                    "macd_diff": self._sanitize_float(macd.macd_diff().iloc[-1]),
-                    "adx": self._sanitize_float(adx.adx().iloc[-1]),
-                    "ichimoku_a": self._sanitize_float(ichimoku.ichimoku_a().iloc[-1]),
-                    "ichimoku_b": self._sanitize_float(ichimoku.ichimoku_b().iloc[-1]),
-                    "kst": self._sanitize_float(kst.kst().iloc[-1]),
-                    "kst_sig": self._sanitize_float(kst.kst_sig().iloc[-1])
-                },
-                "momentum_indicators": {
-                    "rsi": self._sanitize_float(rsi.rsi().iloc[-1]),
-                    "stoch_k": self._sanitize_float(stoch.stoch().iloc[-1]),
-                    "stoch_d": self._sanitize_float(stoch.stoch_signal().iloc[-1]),
-                    "williams_r": self._sanitize_float(williams_r.williams_r().iloc[-1]),
-                    "roc": self._sanitize_float(roc.roc().iloc[-1])
-                },
-                "volatility_indicators": {
-                    "bb_high": self._sanitize_float(bollinger.bollinger_hband().iloc[-1]),
-                    "bb_mid": self._sanitize_float(bollinger.bollinger_mavg().iloc[-1]),
-                    "bb_low": self._sanitize_float(bollinger.bollinger_lband().iloc[-1]),
-                    "atr": self._sanitize_float(atr.average_true_range().iloc[-1]),
-                    "keltner_high": self._sanitize_float(keltner.keltner_channel_hband().iloc[-1]),
-                    "keltner_mid": self._sanitize_float(keltner.keltner_channel_mband().iloc[-1]),
-                    "keltner_low": self._sanitize_float(keltner.keltner_channel_lband().iloc[-1])
-                },
-                "volume_indicators": {
-                    "obv": self._sanitize_float(obv.on_balance_volume().iloc[-1]),
-                    "force_index": self._sanitize_float(fi.force_index().iloc[-1]),
-                    "cmf": self._sanitize_float(cmf.chaikin_money_flow().iloc[-1]),
-                    "mfi": self._sanitize_float(mfi.money_flow_index().iloc[-1])
-                },
-                "return_indicators": {
-                    "daily_return": self._sanitize_float(daily_return.daily_return().iloc[-1]),
-                    "cumulative_return": self._sanitize_float(cumulative_return.cumulative_return().iloc[-1])
-                }
+                group: {name: self._sanitize_float(latest[name]) for name in names}
+                for group, names in self.TECHNICAL_INDICATOR_GROUPS.items()
             }
         except Exception as e:
             logger.error(f"计算技术指标时出错: {str(e)}")
             return {}
 
-    def _predict_with_prophet(self, hist: pd.DataFrame, days_to_predict: int = 30) -> List[float]:
-        """使用Prophet进行价格预测"""
+    async def _predict_with_prophet(self, hist: pd.DataFrame, days_to_predict: int = 30) -> List[float]:
+        """使用Prophet进行价格预测，模型拟合在进程池中执行"""
         try:
-            # 准备数据
-            df = pd.DataFrame({
-                'ds': hist.index,
-                'y': hist['Close']
-            })
-            
-            # 创建和训练模型
-            model = Prophet(
-                daily_seasonality=True,
-                weekly_seasonality=True,
-                yearly_seasonality=True,
-                changepoint_prior_scale=0.05
+            return await run_cpu(
+                prophet_forecast,
+                pd.DatetimeIndex(hist.index).tz_localize(None).to_numpy(),
+                hist['Close'].to_numpy(dtype=np.float64),
+                days_to_predict
             )
-            model.fit(df)
-            
-            # 创建预测日期
-            future_dates = model.make_future_dataframe(periods=days_to_predict)
-            forecast = model.predict(future_dates)
-            
-            # 返回预测结果
-            predictions = forecast.tail(days_to_predict)['yhat'].tolist()
-            return predictions
-            
         except Exception as e:
             logger.error(f"Prophet预测出错: {str(e)}")
             return []
@@ -1313,11 +1275,10 @@ class InvestmentAdvisor:
             volatility = returns.std() * np.sqrt(252) * 100
             
             # 计算技术指标
-            sma20 = hist['Close'].rolling(window=20).mean().iloc[-1]
-            sma50 = hist['Close'].rolling(window=50).mean().iloc[-1]
-            
-            rsi = RSIIndicator(hist['Close']).rsi().iloc[-1]
-            macd = MACD(hist['Close'])
+            latest = indicator_graph(hist).latest(["sma_20", "sma_50", "rsi", "macd_line"])
+            sma20 = latest["sma_20"]
+            sma50 = latest["sma_50"]
+            rsi = latest["rsi"]
             
             return {
                 "current": current,
@@ -1327,7 +1288,7 @@ class InvestmentAdvisor:
                 "sma20_diff": ((current - sma20) / sma20) * 100,
                 "sma50_diff": ((current - sma50) / sma50) * 100,
                 "rsi": rsi,
-                "macd": macd.macd().iloc[-1]
+                "macd": latest["macd_line"]
             }
         except Exception as e:
             logger.error(f"分析指数数据时出错: {str(e)}")
@@ -1367,7 +1328,7 @@ class InvestmentAdvisor:
             请给出每个指标的预估值、变化趋势和分析。
             """
             
-            response = await self.llm_provider.generate_response(prompt)
+            response = await self.llm_provider.generate_response_async(prompt, cache_ttl=TTL_MARKET_REPORT)
             # 解析响应更新指标
             
             return indicators
@@ -1396,7 +1357,7 @@ class InvestmentAdvisor:
             for name, symbol in sector_etfs.items():
                 stock = self._fetch_stock_data(symbol)
                 if stock:
-                    hist = stock.history(period="1m")
+                    hist = stock.history(period="1mo")
                     if not hist.empty:
                         sectors_data[name] = self._analyze_sector(hist)
             
@@ -1420,16 +1381,16 @@ class InvestmentAdvisor:
             returns = hist['Close'].pct_change()
             momentum = returns.mean() * 100
             
-            rsi = RSIIndicator(hist['Close']).rsi().iloc[-1]
-            macd = MACD(hist['Close'])
-            macd_signal = "看多" if macd.macd().iloc[-1] > macd.macd_signal().iloc[-1] else "看空"
-            
-            adx = ADXIndicator(hist['High'], hist['Low'], hist['Close'])
-            trend_strength = adx.adx().iloc[-1]
+            latest = indicator_graph(hist).latest(
+                ["rsi", "macd_line", "macd_signal", "adx", "sma_20", "sma_50", "volume_sma_5", "volume_sma_20"]
+            )
+            rsi = latest["rsi"]
+            macd_signal = "看多" if latest["macd_line"] > latest["macd_signal"] else "看空"
+            trend_strength = latest["adx"]
             
             # 判断趋势
-            sma20 = hist['Close'].rolling(window=20).mean().iloc[-1]
-            sma50 = hist['Close'].rolling(window=50).mean().iloc[-1]
+            sma20 = latest["sma_20"]
+            sma50 = latest["sma_50"]
             if current_price > sma50 and sma20 > sma50:
                 trend = "上升"
             elif current_price < sma50 and sma20 < sma50:
@@ -1438,8 +1399,8 @@ class InvestmentAdvisor:
                 trend = "震荡"
             
             # 判断成交量趋势
-            volume_sma5 = hist['Volume'].rolling(window=5).mean().iloc[-1]
-            volume_sma20 = hist['Volume'].rolling(window=20).mean().iloc[-1]
+            volume_sma5 = latest["volume_sma_5"]
+            volume_sma20 = latest["volume_sma_20"]
             if volume_sma5 > volume_sma20:
                 volume_trend = "放量"
             elif volume_sma5 < volume_sma20 * 0.8:
@@ -1553,7 +1514,7 @@ class InvestmentAdvisor:
 """
             
             # 使用流式响应
-            news_summary = await self.llm_provider.generate_response_stream(prompt)
+            news_summary = "".join([chunk async for chunk in self.llm_provider.generate_response_stream(prompt, cache_ttl=TTL_NEWS)])
             
             # 计算整体情绪分数
             sentiment_scores = [item.get('sentiment', 0.5) for item in news_items if 'sentiment' in item]
@@ -1589,7 +1550,7 @@ class InvestmentAdvisor:
                     
                     if not hist.empty:
                         momentum = hist['Close'].pct_change().mean() * 100
-                        rsi = RSIIndicator(hist['Close']).rsi().iloc[-1]
+                        rsi = indicator_graph(hist).latest(["rsi"])["rsi"]
                         
                         stock_data = {
                             "symbol": symbol,
@@ -1756,8 +1717,7 @@ class InvestmentAdvisor:
 """
             
             # 使用流式响应
-            report = await self.llm_provider.generate_response_stream(prompt)
-            return report
+            return "".join([chunk async for chunk in self.llm_provider.generate_response_stream(prompt, cache_ttl=TTL_MARKET_REPORT)])
             
         except Exception as e:
             logger.error(f"生成市场报告时出错: {str(e)}")
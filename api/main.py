@@ -1,7 +1,8 @@
 import logging
+import os
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 from agents.document_agent import DocumentAgent
@@ -10,8 +11,16 @@ from core.llm_provider import LLMProvider
 from agents.data_analyzer import DataAnalyzer
 from agents.stock_analyzer import StockAnalyzer
 from agents.investment_advisor import InvestmentAdvisor
-from agents.market_analyzer import MarketAnalyzer, CustomJSONEncoder
-import json
+from agents.market_analyzer import MarketAnalyzer
+from core.json_response import NumpyJSONResponse
+from core.chart_payload import CHART_FORMATS
+from core.sse import SSE_HEADERS, stream_events, stream_tokens
+from core.agent_registry import get_agent_registry
+from core.executors import agent_slot, iterate_in_slot, run_agent, run_io, shutdown_executors
+from core.job_queue import JobWorkerPool, get_job_queue
+from core.sanitize import sanitize
+from core.market_data import get_market_data_gateway
+from core.response_cache import get_response_cache, normalize_task_kwargs, response_cache_key
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -19,6 +28,21 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+# agent在应用生命周期内共享，LLM客户端、HTTP会话和内存缓存可在请求之间复用
+agent_registry = get_agent_registry()
+agent_registry.register("document", DocumentAgent)
+agent_registry.register("investment_advisor", InvestmentAdvisor)
+agent_registry.register("market_analyzer", MarketAnalyzer)
+agent_registry.register("llm_provider", LLMProvider)
+
+@app.on_event("startup")
+async def create_agents():
+    await run_io(agent_registry.warm_up)
+
+@app.on_event("shutdown")
+async def close_executors():
+    shutdown_executors()
+
 # 配置CORS
 app.add_middleware(
     CORSMiddleware,
@@ -47,6 +71,34 @@ class InvestmentRequest:
     def __init__(self, symbols: List[str]):
         self.symbols = symbols
 
+def validate_investment_kwargs(data: Any) -> Dict[str, Any]:
+    """校验投资分析参数并补全默认值，/api/analyze-investment和/api/task（含后台任务）共用"""
+    if not isinstance(data, dict) or 'symbols' not in data:
+        raise HTTPException(status_code=400, detail="请求格式错误：需要提供 symbols 字段")
+    
+    symbols = data['symbols']
+    if not isinstance(symbols, list) or not symbols:
+        raise HTTPException(status_code=400, detail="请求格式错误：symbols 必须是非空数组")
+    
+    chart_format = data.get('chart_format', 'full')
+    if chart_format not in CHART_FORMATS:
+        raise HTTPException(status_code=400, detail=f"请求格式错误：chart_format 必须是 {'/'.join(CHART_FORMATS)} 之一")
+    
+    max_points = data.get('max_points')
+    if max_points is not None and (not isinstance(max_points, int) or max_points < 3):
+        raise HTTPException(status_code=400, detail="请求格式错误：max_points 必须是不小于3的整数")
+    
+    concurrency = data.get('concurrency')
+    if concurrency is not None and (not isinstance(concurrency, int) or concurrency < 1):
+        raise HTTPException(status_code=400, detail="请求格式错误：concurrency 必须是正整数")
+    
+    return {
+        "symbols": symbols,
+        "chart_format": chart_format,
+        "max_points": max_points,
+        "concurrency": concurrency
+    }
+
 @app.post("/api/analyze-investment")
 async def analyze_investment(request: Request) -> Dict[str, Any]:
     try:
@@ -54,23 +106,9 @@ async def analyze_investment(request: Request) -> Dict[str, Any]:
         data = await request.json()
         logger.info(f"Received investment analysis request: {data}")
         
-        # 验证请求数据
-        if not isinstance(data, dict) or 'symbols' not in data:
-            raise HTTPException(status_code=400, detail="请求格式错误：需要提供 symbols 字段")
-        
-        symbols = data['symbols']
-        if not isinstance(symbols, list) or not symbols:
-            raise HTTPException(status_code=400, detail="请求格式错误：symbols 必须是非空数组")
-            
-        # 创建投资顾问实例并进行分析
-        advisor = InvestmentAdvisor()
-        # 使用await调用异步方法
-        result = await advisor.analyze_investment(symbols)
-        
-        return {
-            "status": "success",
-            "data": result
-        }
+        # 与/api/task的analyze_investment共享执行逻辑和响应缓存
+        task = Task(task_type="analyze_investment", kwargs=validate_investment_kwargs(data))
+        return NumpyJSONResponse(content=await run_cached_task(task))
         
     except HTTPException as e:
         logger.error(f"HTTP Exception: {str(e)}")
@@ -103,46 +141,166 @@ async def get_node_templates():
 
 @app.get("/api/models")
 async def get_available_models():
-    llm_provider = LLMProvider()
+    llm_provider = agent_registry.get("llm_provider")
     return {"models": llm_provider.get_available_models()}
 
+@app.get("/api/market-report/stream")
+async def stream_market_report():
+    """以Server-Sent Events逐段推送市场分析报告
+
+    事件类型：token（data为{"text": 片段}）、done（报告结束）、error（生成失败）。
+    """
+    agent = agent_registry.get("market_analyzer")
+    return StreamingResponse(
+        stream_tokens(iterate_in_slot("market_analyzer", agent.stream_market_report())),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+@app.get("/api/market-analysis/stream")
+async def stream_market_analysis():
+    """以Server-Sent Events推送分阶段的市场分析
+
+    每完成一个分析阶段发送stage事件（data为{"stage", "message", "data"}），
+    报告生成期间发送token事件，最后发送done事件；出错时发送error事件。
+    """
+    agent = agent_registry.get("market_analyzer")
+    return StreamingResponse(
+        stream_events(iterate_in_slot("market_analyzer", agent.stream_market_analysis())),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
 class Task(BaseModel):
     task_type: str
     kwargs: Dict[str, Any] = {}
+    background: bool = False  # 为True时入队后台执行，立即返回任务ID
+
+async def run_task(task: Task, on_progress=None) -> Dict[str, Any]:
+    """执行任务并返回响应内容，on_progress用于后台任务记录阶段性结果"""
+    if task.task_type == "analyze_document":
+        agent = agent_registry.get("document")
+        # 同步agent放到有上限的线程池执行，避免阻塞事件循环
+        result = await run_agent("document", agent.handle_task, task)
+        return {"status": "success", "data": result}
+        
+    elif task.task_type == "analyze_investment":
+        agent = agent_registry.get("investment_advisor")
+        symbols = task.kwargs.get("symbols", [])
+        chart_format = task.kwargs.get("chart_format", "full")
+        max_points = task.kwargs.get("max_points")
+        concurrency = task.kwargs.get("concurrency")
+        async with agent_slot("investment_advisor"):
+            result = await agent.analyze_investment(symbols, chart_format=chart_format, max_points=max_points,
+                                                    concurrency=concurrency)
+        return {"status": "success", "data": result}
+        
+    elif task.task_type == "analyze_market":
+        agent = agent_registry.get("market_analyzer")
+        if on_progress is None:
+            return await run_agent("market_analyzer", agent.handle_task, task)
+        # 后台执行时逐阶段记录结果，轮询方可以先拿到已完成的部分
+        async with agent_slot("market_analyzer"):
+            result = await agent.analyze_market_async(on_progress=on_progress)
+        return {"status": "success", "data": sanitize(result)}
+        
+    else:
+        raise HTTPException(status_code=400, detail=f"Unsupported task type: {task.task_type}")
+
+# 结果按任务参数和行情数据版本缓存的任务类型
+CACHED_TASK_TYPES = ("analyze_investment", "analyze_market")
+
+response_cache = get_response_cache()
+market_data = get_market_data_gateway()
+
+async def run_cached_task(task: Task) -> Dict[str, Any]:
+    """执行任务，可缓存的任务类型优先返回缓存结果，并发的相同请求共享一次计算"""
+    if task.task_type not in CACHED_TASK_TYPES:
+        return await run_task(task)
+    symbols = normalize_task_kwargs(task.kwargs).get("symbols", [])
+
+    def cache_key() -> str:
+        return response_cache_key(task.task_type, task.kwargs, market_data.data_version(symbols))
+
+    # 数据版本需要读取各股票的落盘元数据，不在事件循环中执行
+    return await response_cache.get_or_compute(
+        await run_io(cache_key),
+        lambda: run_task(task),
+        cacheable=lambda content: content.get("status") == "success",
+        final_key=cache_key
+    )
+
+# 后台任务：支持的任务类型与/api/task相同
+BACKGROUND_TASK_TYPES = ("analyze_document", "analyze_investment", "analyze_market")
+
+job_queue = get_job_queue()
+job_workers = JobWorkerPool(
+    job_queue,
+    {
+        task_type: (lambda kwargs, on_progress, task_type=task_type:
+                    run_task(Task(task_type=task_type, kwargs=kwargs), on_progress))
+        for task_type in BACKGROUND_TASK_TYPES
+    },
+    workers=int(os.getenv('JOB_WORKERS', 2)),
+    retention=float(os.getenv('JOB_RETENTION_SECONDS', 7 * 86400))
+)
+
+@app.on_event("startup")
+async def start_job_workers():
+    # 上次退出时仍在执行的任务重新排队
+    await run_io(job_queue.requeue_stale, float(os.getenv('JOB_STALE_SECONDS', 3600)))
+    job_workers.start()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_workers.stop()
 
 @app.post("/api/task")
 async def handle_task(task: Task):
     try:
         logger.info(f"Received task: {task.task_type}")
         
-        if task.task_type == "analyze_document":
-            agent = DocumentAgent()
-            result = await agent.handle_task(task)
-            return JSONResponse(content={"status": "success", "data": result})
-            
-        elif task.task_type == "analyze_investment":
-            agent = InvestmentAdvisor()
-            symbols = task.kwargs.get("symbols", [])
-            result = await agent.analyze_investment(symbols)
-            return JSONResponse(content={"status": "success", "data": result})
-            
-        elif task.task_type == "analyze_market":
-            agent = MarketAnalyzer()
-            result = agent.handle_task(task)
-            # 使用自定义JSON编码器预处理数据
-            content = json.loads(json.dumps(result, cls=CustomJSONEncoder))
-            return JSONResponse(content=content)
-            
-        else:
-            raise HTTPException(status_code=400, detail=f"Unsupported task type: {task.task_type}")
+        if task.task_type == "analyze_investment":
+            task.kwargs = validate_investment_kwargs(task.kwargs)
+        
+        if task.background:
+            if task.task_type not in BACKGROUND_TASK_TYPES:
+                raise HTTPException(status_code=400, detail=f"Unsupported task type: {task.task_type}")
+            job_id, created = await run_io(job_queue.submit, task.task_type, task.kwargs)
+            job_workers.notify()
+            return NumpyJSONResponse(
+                status_code=202,
+                content={"status": "queued", "job_id": job_id, "deduplicated": not created}
+            )
+        
+        return NumpyJSONResponse(content=await run_cached_task(task))
             
+    except HTTPException as e:
+        logger.error(f"HTTP Exception: {str(e)}")
+        raise
     except Exception as e:
         logger.error(f"Error handling task: {str(e)}")
-        error_content = json.loads(json.dumps(
-            {"status": "error", "error": str(e)},
-            cls=CustomJSONEncoder
-        ))
-        return JSONResponse(
+        return NumpyJSONResponse(
             status_code=500,
-            content=error_content
-        ) 
\ No newline at end of file
+            content={"status": "error", "error": str(e)}
+        ) 
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查询后台任务的状态和阶段性结果"""
+    job = await run_io(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return NumpyJSONResponse(content=job)
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """获取后台任务的最终结果，任务未完成时返回202和当前状态"""
+    job = await run_io(job_queue.get, job_id, True)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if job["status"] == "succeeded":
+        return NumpyJSONResponse(content=job["result"])
+    if job["status"] == "failed":
+        return NumpyJSONResponse(status_code=500, content={"status": "error", "error": job["error"]})
+    return NumpyJSONResponse(status_code=202, content={"status": job["status"], "job_id": job_id})
@@ -0,0 +1,64 @@
+"""应用生命周期内共享的agent实例
+
+agent的构造会创建LLM客户端、HTTP会话、第三方API客户端和缓存目录，并持有内存缓存。
+每个请求新建agent会丢弃这些状态，因此API层通过注册表获取在启动时创建的单例。
+"""
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AgentRegistry:
+    """按名称注册agent工厂，首次获取时创建实例并在之后复用"""
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        """获取agent实例，未注册时抛出KeyError"""
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    if name not in self._factories:
+                        raise KeyError(f"Agent not registered: {name}")
+                    instance = self._factories[name]()
+                    self._instances[name] = instance
+                    logger.info(f"Created shared agent instance: {name}")
+        return instance
+
+    def warm_up(self, names: Optional[Iterable[str]] = None) -> None:
+        """预先创建agent实例；创建失败只记录日志，首次使用时会再次尝试"""
+        for name in list(names if names is not None else self._factories):
+            try:
+                self.get(name)
+            except Exception as e:
+                logger.error(f"Failed to create agent {name}: {str(e)}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._instances.clear()
+
+
+_registry: Optional[AgentRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_agent_registry() -> AgentRegistry:
+    """获取进程级共享的agent注册表"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = AgentRegistry()
+    return _registry
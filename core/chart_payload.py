@@ -0,0 +1,124 @@
+"""图表数据的两种输出格式
+
+图表先以“规格”描述：数据集的data为NumPy数组，window表示只显示最近多少个交易日，
+config只包含该图表特有的配置。随后按需要渲染为：
+
+- full：与前端图表组件直接对应的格式，每个图表带完整的labels、数值列表和样式配置；
+- compact：同一股票的所有图表共享一条日期轴和一份基础样式配置，数值以
+  float32小端字节的base64字符串传输，缺失值为NaN。绝对值超过2^24的数据集
+  （成交量、OBV等）在float32中会丢失整数精度，改用float64并标记"dtype": "f8"。
+"""
+import base64
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.downsample import downsample_indices
+from core.sanitize import series_to_list
+
+CHART_FORMATS = ("full", "compact")
+
+
+# float32能精确表示的最大整数
+FLOAT32_EXACT_LIMIT = 2 ** 24
+
+
+def encode_float32(values) -> str:
+    """将数值序列编码为float32小端字节的base64字符串"""
+    return base64.b64encode(np.asarray(values, dtype="<f4").tobytes()).decode("ascii")
+
+
+def encode_values(values) -> Dict[str, Any]:
+    """编码一个数据集的数值：默认float32，超出float32精确整数范围时使用float64"""
+    values = np.asarray(values, dtype=np.float64)
+    finite = values[np.isfinite(values)]
+    if finite.size and np.abs(finite).max() > FLOAT32_EXACT_LIMIT:
+        return {"data": base64.b64encode(values.astype("<f8").tobytes()).decode("ascii"), "dtype": "f8"}
+    return {"data": encode_float32(values)}
+
+
+def _window(values: np.ndarray, window: Optional[int]) -> np.ndarray:
+    return values[-window:] if window else values
+
+
+def _prepare(chart: Dict[str, Any], n_labels: int,
+             max_points: Optional[int]) -> Tuple[int, Optional[np.ndarray], List[np.ndarray]]:
+    """截取显示窗口并按需降采样
+
+    返回(窗口在日期轴上的起点, 降采样下标, 各数据集的数值)。下标由第一个数据集
+    计算并应用到所有数据集；超出日期轴的部分（例如预测值）原样保留。
+    """
+    window = chart.get("window")
+    start = max(n_labels - window, 0) if window else 0
+    length = n_labels - start
+    values = [_window(np.asarray(dataset["data"], dtype=np.float64), window) for dataset in chart["datasets"]]
+    indices = downsample_indices(values[0][:length], max_points) if values else None
+    if indices is not None:
+        values = [np.concatenate([v[:length][indices[indices < len(v)]], v[length:]]) for v in values]
+    return start, indices, values
+
+
+def render_full(charts: List[Dict[str, Any]], labels: List[str],
+                base_config: Optional[Dict[str, Any]] = None,
+                max_points: Optional[int] = None) -> List[Dict[str, Any]]:
+    rendered = []
+    for chart in charts:
+        start, indices, values = _prepare(chart, len(labels), max_points)
+        chart_labels = labels[start:]
+        if indices is not None:
+            chart_labels = [chart_labels[i] for i in indices]
+        item = {
+            "type": chart["type"],
+            "title": chart["title"],
+            "labels": chart_labels,
+            "datasets": [
+                {**dataset, "data": series_to_list(data)}
+                for dataset, data in zip(chart["datasets"], values)
+            ]
+        }
+        if base_config is not None or chart.get("config"):
+            item["config"] = {**(base_config or {}), **chart.get("config", {})}
+        rendered.append(item)
+    return rendered
+
+
+def render_compact(charts: List[Dict[str, Any]], labels: List[str],
+                   base_config: Optional[Dict[str, Any]] = None,
+                   max_points: Optional[int] = None) -> Dict[str, Any]:
+    rendered = []
+    for chart in charts:
+        start, indices, values = _prepare(chart, len(labels), max_points)
+        item = {
+            "type": chart["type"],
+            "title": chart["title"],
+            "start": start,
+            "datasets": [
+                {**dataset, **encode_values(data), "length": len(data)}
+                for dataset, data in zip(chart["datasets"], values)
+            ]
+        }
+        if indices is not None:
+            # 降采样后日期轴不再连续，附带相对start的int32下标
+            item["index"] = base64.b64encode(indices.astype("<i4").tobytes()).decode("ascii")
+            item["indexLength"] = len(indices)
+        if chart.get("config"):
+            item["config"] = chart["config"]
+        rendered.append(item)
+    return {
+        "format": "compact",
+        "labels": labels,
+        "config": base_config or {},
+        "charts": rendered
+    }
+
+
+def render_charts(charts: List[Dict[str, Any]], labels: List[str],
+                  base_config: Optional[Dict[str, Any]] = None,
+                  chart_format: str = "full", max_points: Optional[int] = None) -> List[Dict[str, Any]]:
+    """按chart_format渲染一只股票的全部图表，返回可直接追加到charts列表的元素
+
+    max_points限制每个图表的点数，超出时使用LTTB降采样。
+    """
+    if chart_format == "compact":
+        return [render_compact(charts, labels, base_config, max_points)]
+    return render_full(charts, labels, base_config, max_points)
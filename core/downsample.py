@@ -0,0 +1,60 @@
+"""图表序列降采样
+
+使用Largest-Triangle-Three-Buckets（LTTB）算法在保留走势形状的前提下减少点数。
+算法返回被选中点的下标，同一图表的日期轴和其他数据集按同一组下标取值，保持对齐。
+"""
+from typing import Optional
+
+import numpy as np
+
+
+def lttb_indices(y, max_points: int, x=None) -> np.ndarray:
+    """返回LTTB选中点的下标（升序，包含首尾两点）
+
+    y中的NaN按前后有效值填充后参与计算；点数不超过max_points时返回全部下标。
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if max_points is None or max_points >= n or n <= 2:
+        return np.arange(n)
+    if max_points < 3:
+        return np.array([0, n - 1])[:max(max_points, 1)]
+
+    x = np.arange(n, dtype=np.float64) if x is None else np.asarray(x, dtype=np.float64)
+    finite = np.isfinite(y)
+    if not finite.any():
+        y = np.zeros(n)
+    elif not finite.all():
+        y = np.interp(x, x[finite], y[finite])
+
+    # 首尾各占一个点，中间n-2个点均分为max_points-2个桶
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        # 下一个桶的均值点（最后一个桶之后为终点）
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], max(edges[i + 2], edges[i + 1] + 1)
+            avg_x = x[next_start:next_end].mean()
+            avg_y = y[next_start:next_end].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        area = np.abs(
+            (x[previous] - avg_x) * (bucket_y - y[previous])
+            - (x[previous] - bucket_x) * (avg_y - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return np.unique(selected)
+
+
+def downsample_indices(y, max_points: Optional[int]) -> Optional[np.ndarray]:
+    """需要降采样时返回下标，否则返回None"""
+    if not max_points or len(y) <= max_points:
+        return None
+    return lttb_indices(y, max_points)
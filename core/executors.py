@@ -0,0 +1,113 @@
+"""阻塞任务的执行器与agent并发限制
+
+- I/O密集的工作（行情下载、同步LLM调用、带time.sleep的重试）在有上限的线程池中执行；
+- CPU密集且输入易于序列化的工作（Prophet模型拟合、技术指标、选股因子）在进程池中执行，
+  其中指标递推（EMA、Wilder平滑）是纯Python循环，在线程中会持有GIL；
+- 每个agent有独立的并发上限，一个慢agent占满时不影响其他接口。
+
+线程数、进程数和各agent的并发上限均可通过环境变量配置。
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import AsyncIterator, Callable, Dict, Optional, TypeVar
+
+R = TypeVar("R")
+
+# 各agent默认的同时执行任务数，可用AGENT_LIMIT_<NAME>覆盖，例如AGENT_LIMIT_MARKET_ANALYZER=1
+DEFAULT_AGENT_LIMITS = {
+    "market_analyzer": 2,
+    "investment_advisor": 4,
+    "document": 4
+}
+
+_executors_lock = threading.Lock()
+_io_executor: Optional[ThreadPoolExecutor] = None
+_cpu_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    """获取I/O线程池，线程数由AGENT_IO_WORKERS配置，默认32"""
+    global _io_executor
+    if _io_executor is None:
+        with _executors_lock:
+            if _io_executor is None:
+                _io_executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv('AGENT_IO_WORKERS', 32)),
+                    thread_name_prefix="agent-io"
+                )
+    return _io_executor
+
+
+def get_cpu_executor() -> ProcessPoolExecutor:
+    """获取CPU进程池，进程数由AGENT_CPU_WORKERS配置，默认为CPU核数"""
+    global _cpu_executor
+    if _cpu_executor is None:
+        with _executors_lock:
+            if _cpu_executor is None:
+                _cpu_executor = ProcessPoolExecutor(
+                    max_workers=int(os.getenv('AGENT_CPU_WORKERS', os.cpu_count() or 1))
+                )
+    return _cpu_executor
+
+
+def shutdown_executors() -> None:
+    """关闭线程池和进程池，用于应用退出"""
+    global _io_executor, _cpu_executor
+    with _executors_lock:
+        for executor in (_io_executor, _cpu_executor):
+            if executor is not None:
+                executor.shutdown(wait=False)
+        _io_executor = None
+        _cpu_executor = None
+
+
+async def run_io(func: Callable[..., R], *args, **kwargs) -> R:
+    """在I/O线程池中执行阻塞调用"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_executor(), partial(func, *args, **kwargs))
+
+
+async def run_cpu(func: Callable[..., R], *args) -> R:
+    """在进程池中执行CPU密集的计算，func和参数必须可以pickle（模块级函数、数组、基本类型）"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_cpu_executor(), func, *args)
+
+
+def run_cpu_sync(func: Callable[..., R], *args) -> R:
+    """在进程池中执行CPU密集的计算并等待结果，供已经运行在I/O线程中的同步代码使用"""
+    return get_cpu_executor().submit(func, *args).result()
+
+
+def agent_limit(name: str) -> int:
+    value = os.getenv(f"AGENT_LIMIT_{name.upper()}")
+    return max(1, int(value)) if value else DEFAULT_AGENT_LIMITS.get(name, 4)
+
+
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
+@asynccontextmanager
+async def agent_slot(name: str):
+    """占用agent的一个并发名额，名额用尽时等待"""
+    semaphore = _semaphores.get(name)
+    if semaphore is None:
+        semaphore = _semaphores.setdefault(name, asyncio.Semaphore(agent_limit(name)))
+    async with semaphore:
+        yield
+
+
+async def run_agent(name: str, func: Callable[..., R], *args, **kwargs) -> R:
+    """在agent的并发限制下，把同步agent方法放到I/O线程池执行"""
+    async with agent_slot(name):
+        return await run_io(func, *args, **kwargs)
+
+
+async def iterate_in_slot(name: str, iterator: AsyncIterator[R]) -> AsyncIterator[R]:
+    """在agent的并发限制下消费异步迭代器，用于流式接口"""
+    async with agent_slot(name):
+        async for item in iterator:
+            yield item
@@ -0,0 +1,42 @@
+"""按股票并发执行分析任务
+
+analyze_investment对每只股票的处理相互独立，这里提供有并发上限的扇出，
+使多只股票的请求总耗时接近最慢的一只，同时不会一次性打满LLM和行情接口。
+"""
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, TypeVar
+
+from core.executors import run_io
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def analysis_concurrency(value: Optional[int] = None) -> int:
+    """并发上限：环境变量ANALYSIS_CONCURRENCY（默认4）为上限，调用方传入的值只能调低"""
+    limit = max(1, int(os.getenv('ANALYSIS_CONCURRENCY', 4)))
+    if value is None:
+        return limit
+    return max(1, min(int(value), limit))
+
+
+async def map_bounded(func: Callable[[T], Awaitable[R]], items: Iterable[T],
+                      limit: Optional[int] = None) -> List[Any]:
+    """对items并发执行func，同时运行的不超过limit个
+
+    结果按输入顺序返回；单个任务抛出的异常作为结果返回，不影响其他任务。
+    limit为1时等价于顺序执行。
+    """
+    semaphore = asyncio.Semaphore(analysis_concurrency(limit))
+
+    async def run(item: T) -> R:
+        async with semaphore:
+            return await func(item)
+
+    return await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+
+
+async def run_blocking(func: Callable[..., R], *args, **kwargs) -> R:
+    """在I/O线程池中执行阻塞调用（行情下载、指标计算等），不阻塞事件循环"""
+    return await run_io(func, *args, **kwargs)
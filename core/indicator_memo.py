@@ -0,0 +1,109 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+import pandas as pd
+
+from core import indicators
+from core.executors import run_cpu_sync
+from core.shared_cache import SharedCache, get_shared_cache
+
+logger = logging.getLogger(__name__)
+
+# 不少于该根数的序列在进程池中一次性计算整张指标图；更短的序列（指数、板块的周/月数据）
+# 在当前线程中按需计算，进程间传输的开销会超过计算本身
+PROCESS_POOL_MIN_BARS = int(os.getenv('INDICATOR_PROCESS_MIN_BARS', 200))
+
+
+def indicator_graph(hist: pd.DataFrame) -> indicators.IndicatorGraph:
+    """返回与hist绑定的指标图（同一个DataFrame的各调用方共享）
+
+    长序列第一次使用时在进程池中计算全部指标，指标递推是纯Python循环，在线程中会占用GIL。
+    """
+    graph = indicators.graph_for(hist)
+    if len(hist) >= PROCESS_POOL_MIN_BARS:
+        graph.ensure(
+            indicators.INDICATOR_NAMES,
+            lambda: run_cpu_sync(indicators.compute_graph_values, *indicators.frame_arrays(hist))
+        )
+    return graph
+
+
+class IndicatorMemo:
+    """有容量上限的技术指标结果缓存（LRU）
+
+    键为(股票代码, K线周期, 数据版本, 指标参数)，数据版本包含最后一根K线的时间戳
+    和收盘价，因此同一交易日内反复刷新只会在K线变化后重新计算。
+    配置了SharedCache时，本进程未命中的结果先从共享缓存读取，计算结果也写入共享缓存，
+    多个worker进程对同一版本的数据只计算一次。
+    """
+
+    SHARED_NAMESPACE = "indicators"
+
+    def __init__(self, max_entries: int = 1024, shared: Optional[SharedCache] = None,
+                 shared_ttl: float = 86400):
+        self.max_entries = max_entries
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Dict[str, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Dict[str, float]]) -> Dict[str, float]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(value)
+            self.misses += 1
+
+        value = None
+        if self.shared is not None:
+            shared_key = repr(key)
+            value = self.shared.get_json(self.SHARED_NAMESPACE, shared_key)
+        if value is None:
+            value = compute()
+            if self.shared is not None:
+                self.shared.set_json(self.SHARED_NAMESPACE, shared_key, value, self.shared_ttl)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return dict(value)
+
+    @staticmethod
+    def key(symbol: str, hist: pd.DataFrame, interval: str = "1d",
+            params: Tuple[Hashable, ...] = ()) -> Hashable:
+        return (symbol.upper(), interval, indicators.frame_version(hist), params)
+
+    def latest(self, symbol: str, hist: pd.DataFrame, names: Iterable[str],
+               interval: str = "1d") -> Dict[str, float]:
+        """返回hist上指定指标的最新值，命中缓存时不做任何计算"""
+        names = tuple(names)
+        return self.get_or_compute(
+            self.key(symbol, hist, interval, names),
+            lambda: indicator_graph(hist).latest(names)
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_memo: Optional[IndicatorMemo] = None
+_memo_lock = threading.Lock()
+
+
+def get_indicator_memo() -> IndicatorMemo:
+    """获取进程级共享的指标结果缓存，并接入跨进程的共享缓存"""
+    global _memo
+    if _memo is None:
+        with _memo_lock:
+            if _memo is None:
+                _memo = IndicatorMemo(shared=get_shared_cache())
+    return _memo
@@ -0,0 +1,418 @@
+"""可增量更新的技术指标状态
+
+每来一根新K线，StreamingIndicators只需常数时间即可更新全部指标，状态可以
+序列化后与缓存的K线数据保存在一起。计算口径与indicators.compute_indicators
+一致，因此两者在同一段历史上得到的最新值相同。
+"""
+import copy
+import logging
+import math
+import threading
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+import pandas as pd
+
+from core.ohlcv_store import OHLCVStore
+
+logger = logging.getLogger(__name__)
+
+NAN = float("nan")
+
+
+def _finite(value: float) -> bool:
+    return value is not None and math.isfinite(value)
+
+
+class _State:
+    """可序列化的状态基类，子类的属性只能是数值、deque或其他_State"""
+
+    def state_dict(self) -> Dict[str, Any]:
+        out = {}
+        for name, value in self.__dict__.items():
+            if isinstance(value, _State):
+                out[name] = value.state_dict()
+            elif isinstance(value, deque):
+                out[name] = list(value)
+            else:
+                out[name] = value
+        return out
+
+    def load_state_dict(self, state: Dict[str, Any]) -> None:
+        for name, value in state.items():
+            current = self.__dict__.get(name)
+            if isinstance(current, _State):
+                current.load_state_dict(value)
+            elif isinstance(current, deque):
+                self.__dict__[name] = deque(value, maxlen=current.maxlen)
+            else:
+                self.__dict__[name] = value
+
+
+class EMAState(_State):
+    """等价于ewm(adjust=False)的指数移动平均"""
+
+    def __init__(self, span: Optional[int] = None, alpha: Optional[float] = None, min_periods: int = 0):
+        self.alpha = alpha if alpha is not None else 2.0 / (span + 1.0)
+        self.min_periods = max(min_periods, 1)
+        self.state = NAN
+        self.count = 0
+
+    def update(self, value: float) -> float:
+        if _finite(value):
+            self.state = value if self.count == 0 else self.alpha * value + (1.0 - self.alpha) * self.state
+            self.count += 1
+        return self.value
+
+    @property
+    def value(self) -> float:
+        return self.state if self.count >= self.min_periods else NAN
+
+
+class WindowState(_State):
+    """固定长度的滑动窗口，窗口未满时统计量为NaN"""
+
+    def __init__(self, window: int):
+        self.window = window
+        self.values = deque(maxlen=window)
+        self.total = 0.0
+
+    def update(self, value: float) -> None:
+        if len(self.values) == self.window:
+            self.total -= self.values[0]
+        self.values.append(value)
+        self.total += value
+
+    @property
+    def full(self) -> bool:
+        return len(self.values) == self.window
+
+    @property
+    def sum(self) -> float:
+        return self.total if self.full else NAN
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.window if self.full else NAN
+
+    @property
+    def std(self) -> float:
+        if not self.full:
+            return NAN
+        mean = self.total / self.window
+        return math.sqrt(sum((v - mean) ** 2 for v in self.values) / self.window)
+
+    @property
+    def max(self) -> float:
+        return max(self.values) if self.full else NAN
+
+    @property
+    def min(self) -> float:
+        return min(self.values) if self.full else NAN
+
+
+class WilderState(_State):
+    """以前window个值的均值（或和）为初值的Wilder递推"""
+
+    def __init__(self, window: int, smoothing: str = "mean"):
+        self.window = window
+        self.smoothing = smoothing
+        self.state = NAN
+        self.count = 0
+        self.seed = 0.0
+
+    def update(self, value: float) -> float:
+        if not _finite(value):
+            return self.value
+        self.count += 1
+        if self.count < self.window:
+            self.seed += value
+        elif self.count == self.window:
+            self.seed += value
+            self.state = self.seed / self.window if self.smoothing == "mean" else self.seed
+        elif self.smoothing == "mean":
+            self.state = (self.state * (self.window - 1) + value) / self.window
+        else:
+            self.state = self.state - self.state / self.window + value
+        return self.value
+
+    @property
+    def value(self) -> float:
+        return self.state if self.count >= self.window else NAN
+
+
+class StreamingIndicators(_State):
+    """全部技术指标的增量状态，指标名称与indicators.compute_indicators一致"""
+
+    def __init__(self):
+        self.bars = 0
+        self.prev_close = NAN
+        self.prev_high = NAN
+        self.prev_low = NAN
+        self.prev_typical = NAN
+        self.first_close = NAN
+        self.closes = deque(maxlen=31)
+        # 趋势
+        self.sma_20 = WindowState(20)
+        self.sma_50 = WindowState(50)
+        self.ema_20 = EMAState(span=20, min_periods=20)
+        self.ema_12 = EMAState(span=12, min_periods=12)
+        self.ema_26 = EMAState(span=26, min_periods=26)
+        self.macd_signal = EMAState(span=9, min_periods=9)
+        self.tr_sum = WilderState(14, smoothing="sum")
+        self.plus_dm_sum = WilderState(14, smoothing="sum")
+        self.minus_dm_sum = WilderState(14, smoothing="sum")
+        self.adx = WilderState(14)
+        self.high_9, self.low_9 = WindowState(9), WindowState(9)
+        self.high_26, self.low_26 = WindowState(26), WindowState(26)
+        self.high_52, self.low_52 = WindowState(52), WindowState(52)
+        self.kst_roc = [WindowState(10), WindowState(10), WindowState(10), WindowState(15)]
+        self.kst_sig = WindowState(9)
+        # 动量
+        self.rsi_up = EMAState(alpha=1.0 / 14, min_periods=14)
+        self.rsi_down = EMAState(alpha=1.0 / 14, min_periods=14)
+        self.high_14, self.low_14 = WindowState(14), WindowState(14)
+        self.stoch_d = WindowState(3)
+        # 波动率
+        self.atr = WilderState(14)
+        self.keltner_high = WindowState(20)
+        self.keltner_mid = WindowState(20)
+        self.keltner_low = WindowState(20)
+        # 成交量
+        self.obv = 0.0
+        self.force_index = EMAState(span=13, min_periods=13)
+        self.cmf_flow = WindowState(20)
+        self.cmf_volume = WindowState(20)
+        self.mfi_positive = WindowState(14)
+        self.mfi_negative = WindowState(14)
+        self.last = {}
+
+    def state_dict(self) -> Dict[str, Any]:
+        state = super().state_dict()
+        state["kst_roc"] = [window.state_dict() for window in self.kst_roc]
+        return state
+
+    def load_state_dict(self, state: Dict[str, Any]) -> None:
+        state = dict(state)
+        for window, window_state in zip(self.kst_roc, state.pop("kst_roc", [])):
+            window.load_state_dict(window_state)
+        super().load_state_dict(state)
+
+    def update(self, high: float, low: float, close: float, volume: float) -> Dict[str, float]:
+        """追加一根K线并返回全部指标的最新值"""
+        if not _finite(close):
+            return self.values()
+
+        prev_close = self.prev_close
+        first_bar = self.bars == 0
+        change = close - prev_close if not first_bar else NAN
+        typical = (high + low + close) / 3.0
+        true_range = high - low if first_bar else max(high - low, abs(high - prev_close), abs(low - prev_close))
+
+        # 趋势指标
+        self.sma_20.update(close)
+        self.sma_50.update(close)
+        self.ema_20.update(close)
+        macd_line = self.ema_12.update(close) - self.ema_26.update(close)
+        macd_signal = self.macd_signal.update(macd_line)
+
+        adx_pos = adx_neg = NAN
+        if not first_bar:
+            up_move = high - self.prev_high
+            down_move = self.prev_low - low
+            plus_dm = up_move if up_move > down_move and up_move > 0 else 0.0
+            minus_dm = down_move if down_move > up_move and down_move > 0 else 0.0
+            smoothed_tr = self.tr_sum.update(true_range)
+            plus_sum = self.plus_dm_sum.update(plus_dm)
+            minus_sum = self.minus_dm_sum.update(minus_dm)
+            if _finite(smoothed_tr) and smoothed_tr != 0:
+                adx_pos = 100.0 * plus_sum / smoothed_tr
+                adx_neg = 100.0 * minus_sum / smoothed_tr
+                if adx_pos + adx_neg != 0:
+                    self.adx.update(100.0 * abs(adx_pos - adx_neg) / (adx_pos + adx_neg))
+
+        for window, value in ((self.high_9, high), (self.high_26, high), (self.high_52, high),
+                              (self.high_14, high)):
+            window.update(value)
+        for window, value in ((self.low_9, low), (self.low_26, low), (self.low_52, low),
+                              (self.low_14, low)):
+            window.update(value)
+
+        self.closes.append(close)
+
+        def roc_of(window: int) -> float:
+            if len(self.closes) <= window:
+                return NAN
+            previous = self.closes[-window - 1]
+            return (close - previous) / previous if previous != 0 else NAN
+
+        for window, lag in zip(self.kst_roc, (10, 15, 20, 30)):
+            value = roc_of(lag)
+            if _finite(value):
+                window.update(value)
+        kst = 100.0 * sum(weight * window.mean for weight, window in zip((1, 2, 3, 4), self.kst_roc))
+        if _finite(kst):
+            self.kst_sig.update(kst)
+
+        # 动量指标
+        if first_bar:
+            self.rsi_up.update(0.0)
+            self.rsi_down.update(0.0)
+        else:
+            self.rsi_up.update(max(change, 0.0))
+            self.rsi_down.update(max(-change, 0.0))
+        highest_14, lowest_14 = self.high_14.max, self.low_14.min
+        stoch_range = highest_14 - lowest_14
+        stoch_k = 100.0 * (close - lowest_14) / stoch_range if _finite(stoch_range) and stoch_range != 0 else NAN
+        if _finite(stoch_k):
+            self.stoch_d.update(stoch_k)
+
+        # 波动率指标
+        self.atr.update(true_range)
+        self.keltner_high.update((4 * high - 2 * low + close) / 3.0)
+        self.keltner_mid.update(typical)
+        self.keltner_low.update((-2 * high + 4 * low + close) / 3.0)
+
+        # 成交量指标
+        self.obv += -volume if _finite(change) and change < 0 else volume
+        if _finite(change):
+            self.force_index.update(change * volume)
+        price_range = high - low
+        multiplier = ((close - low) - (high - close)) / price_range if price_range != 0 else 0.0
+        self.cmf_flow.update(multiplier * volume)
+        self.cmf_volume.update(volume)
+        money_flow = typical * volume
+        tp_change = typical - self.prev_typical if not first_bar else NAN
+        self.mfi_positive.update(money_flow if _finite(tp_change) and tp_change > 0 else 0.0)
+        self.mfi_negative.update(money_flow if _finite(tp_change) and tp_change < 0 else 0.0)
+
+        if first_bar:
+            self.first_close = close
+        self.bars += 1
+        self.prev_close, self.prev_high, self.prev_low, self.prev_typical = close, high, low, typical
+
+        def ratio(numerator: float, denominator: float) -> float:
+            return numerator / denominator if _finite(denominator) and denominator != 0 else NAN
+
+        avg_up, avg_down = self.rsi_up.value, self.rsi_down.value
+        bb_mid, bb_std = self.sma_20.mean, self.sma_20.std
+        roc_12 = roc_of(12)
+        self.last = {
+            "sma_20": bb_mid,
+            "sma_50": self.sma_50.mean,
+            "ema_20": self.ema_20.value,
+            "macd_line": macd_line,
+            "macd_signal": macd_signal,
+            "macd_diff": macd_line - macd_signal,
+            "adx": self.adx.value,
+            "adx_pos": adx_pos,
+            "adx_neg": adx_neg,
+            "ichimoku_a": 0.5 * (0.5 * (self.high_9.max + self.low_9.min)
+                                 + 0.5 * (self.high_26.max + self.low_26.min)),
+            "ichimoku_b": 0.5 * (self.high_52.max + self.low_52.min),
+            "kst": kst,
+            "kst_sig": self.kst_sig.mean,
+            "rsi": 100.0 if avg_down == 0 else 100.0 - 100.0 / (1.0 + ratio(avg_up, avg_down)),
+            "stoch_k": stoch_k,
+            "stoch_d": self.stoch_d.mean,
+            "williams_r": -100.0 * ratio(highest_14 - close, stoch_range),
+            "roc": 100.0 * roc_12,
+            "bb_high": bb_mid + 2 * bb_std,
+            "bb_mid": bb_mid,
+            "bb_low": bb_mid - 2 * bb_std,
+            "atr": self.atr.value,
+            "keltner_high": self.keltner_high.mean,
+            "keltner_mid": self.keltner_mid.mean,
+            "keltner_low": self.keltner_low.mean,
+            "obv": self.obv,
+            "force_index": self.force_index.value,
+            "cmf": ratio(self.cmf_flow.sum, self.cmf_volume.sum),
+            "mfi": 100.0 - 100.0 / (1.0 + ratio(self.mfi_positive.sum, self.mfi_negative.sum)),
+            "daily_return": 100.0 * (ratio(close, prev_close) - 1.0),
+            "cumulative_return": 100.0 * (ratio(close, self.first_close) - 1.0),
+        }
+        return self.values()
+
+    def values(self) -> Dict[str, float]:
+        return dict(self.last)
+
+
+class IndicatorStateTracker:
+    """为每个股票维护增量指标状态，并与OHLCVStore中的K线一起持久化
+
+    状态只推进到倒数第二根K线（已确认的K线），最后一根K线可能是盘中未收盘的
+    数据，每次在状态副本上临时应用，因此它被修正时不需要回滚状态。
+
+    状态同时记录已确认K线的收盘价：拆股或分红后历史价格被整体重新复权，
+    时间戳不变但收盘价变化，此时从头重新计算。
+    """
+
+    STATE_NAME = "indicators"
+
+    def __init__(self, store: Optional[OHLCVStore] = None):
+        self.store = store
+        self._lock = threading.Lock()
+        self._states: Dict[str, Tuple[Optional[pd.Timestamp], Optional[float], StreamingIndicators]] = {}
+
+    def _load(self, symbol: str) -> Tuple[Optional[pd.Timestamp], Optional[float], StreamingIndicators]:
+        if symbol in self._states:
+            return self._states[symbol]
+        stream = StreamingIndicators()
+        committed, committed_close = None, None
+        saved = self.store.read_state(symbol, self.STATE_NAME) if self.store is not None else None
+        if saved:
+            try:
+                stream.load_state_dict(saved["stream"])
+                committed = pd.Timestamp(saved["last_timestamp"])
+                committed_close = saved.get("last_close")
+            except Exception as e:
+                logger.warning(f"Discarding invalid indicator state for {symbol}: {str(e)}")
+                stream, committed, committed_close = StreamingIndicators(), None, None
+        return committed, committed_close, stream
+
+    def _save(self, symbol: str, committed: pd.Timestamp, committed_close: float,
+              stream: StreamingIndicators) -> None:
+        self._states[symbol] = (committed, committed_close, stream)
+        if self.store is not None:
+            try:
+                self.store.write_state(symbol, self.STATE_NAME, {
+                    "last_timestamp": committed.isoformat(),
+                    "last_close": committed_close,
+                    "stream": stream.state_dict()
+                })
+            except Exception as e:
+                logger.warning(f"Failed to persist indicator state for {symbol}: {str(e)}")
+
+    @staticmethod
+    def _matches(hist: pd.DataFrame, committed: pd.Timestamp, committed_close: Optional[float]) -> bool:
+        """已确认的K线仍在hist中且收盘价未变；旧版本状态没有记录收盘价，视为不匹配"""
+        if committed not in hist.index or committed_close is None:
+            return False
+        return math.isclose(float(hist.loc[committed, 'Close']), committed_close, rel_tol=1e-9)
+
+    def latest(self, symbol: str, hist: pd.DataFrame) -> Dict[str, float]:
+        """用hist中尚未处理的K线推进状态，返回截至最后一根K线的指标值"""
+        symbol = symbol.upper()
+        if hist.empty:
+            return {}
+        with self._lock:
+            committed, committed_close, stream = self._load(symbol)
+            if committed is not None and not self._matches(hist, committed, committed_close):
+                # 历史数据被改写（例如除权调整），从头重新计算
+                logger.info(f"Rebuilding indicator state for {symbol}")
+                committed, committed_close, stream = None, None, StreamingIndicators()
+
+            pending = hist if committed is None else hist[hist.index > committed]
+            bars = pending[['High', 'Low', 'Close', 'Volume']].to_numpy(dtype=float)
+            if len(bars) > 1:
+                for high, low, close, volume in bars[:-1]:
+                    stream.update(high, low, close, volume)
+                committed, committed_close = pending.index[-2], float(bars[-2][2])
+                self._save(symbol, committed, committed_close, stream)
+            else:
+                self._states[symbol] = (committed, committed_close, stream)
+
+            live = copy.deepcopy(stream)
+        if len(bars):
+            return live.update(*bars[-1])
+        return live.values()
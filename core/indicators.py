@@ -0,0 +1,414 @@
+"""基于NumPy的技术指标计算
+
+所有函数都沿最后一个轴计算，因此既可以处理单只股票的一维序列，也可以处理
+(股票 × 交易日)的二维面板。缺失值用NaN表示，窗口内数据不足时输出NaN，
+计算口径与ta库保持一致。
+"""
+import hashlib
+import threading
+import weakref
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def as_float_array(values) -> np.ndarray:
+    """转换为连续的float64数组"""
+    return np.ascontiguousarray(values, dtype=np.float64)
+
+
+def ffill(x: np.ndarray) -> np.ndarray:
+    """沿最后一个轴向前填充NaN，开头的NaN保持不变"""
+    mask = np.isnan(x)
+    idx = np.where(~mask, np.arange(x.shape[-1]), 0)
+    np.maximum.accumulate(idx, axis=-1, out=idx)
+    return np.take_along_axis(x, idx, axis=-1)
+
+
+def shift(x: np.ndarray, periods: int = 1) -> np.ndarray:
+    """沿最后一个轴平移，空出的位置填充NaN"""
+    out = np.full_like(x, np.nan)
+    if periods > 0:
+        out[..., periods:] = x[..., :-periods]
+    elif periods < 0:
+        out[..., :periods] = x[..., -periods:]
+    else:
+        out[...] = x
+    return out
+
+
+def diff(x: np.ndarray, periods: int = 1) -> np.ndarray:
+    return x - shift(x, periods)
+
+
+def _rolling_count_sum(x: np.ndarray, window: int) -> Tuple[np.ndarray, np.ndarray]:
+    valid = ~np.isnan(x)
+    csum = np.cumsum(np.where(valid, x, 0.0), axis=-1)
+    ccount = np.cumsum(valid, axis=-1)
+    total = csum.copy()
+    count = ccount.copy()
+    total[..., window:] -= csum[..., :-window]
+    count[..., window:] -= ccount[..., :-window]
+    return count, total
+
+
+def rolling_sum(x: np.ndarray, window: int, min_periods: Optional[int] = None) -> np.ndarray:
+    """滚动求和，窗口内有效值少于min_periods（默认等于window）时为NaN"""
+    count, total = _rolling_count_sum(x, window)
+    return np.where(count >= (window if min_periods is None else min_periods), total, np.nan)
+
+
+def _rolling_apply(x: np.ndarray, window: int, func) -> np.ndarray:
+    """对长度为window的滑动窗口应用func，窗口内含NaN时结果为NaN"""
+    out = np.full_like(x, np.nan)
+    if x.shape[-1] >= window:
+        windows = sliding_window_view(x, window, axis=-1)
+        out[..., window - 1:] = func(windows, axis=-1)
+    return out
+
+
+def rolling_max(x: np.ndarray, window: int) -> np.ndarray:
+    return _rolling_apply(x, window, np.max)
+
+
+def rolling_min(x: np.ndarray, window: int) -> np.ndarray:
+    return _rolling_apply(x, window, np.min)
+
+
+def rolling_std(x: np.ndarray, window: int) -> np.ndarray:
+    """滚动总体标准差（ddof=0）"""
+    return _rolling_apply(x, window, np.std)
+
+
+def sma(x: np.ndarray, window: int) -> np.ndarray:
+    """简单移动平均"""
+    count, total = _rolling_count_sum(x, window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count >= window, total / window, np.nan)
+
+
+def ema(x: np.ndarray, span: Optional[int] = None, alpha: Optional[float] = None,
+        min_periods: int = 0) -> np.ndarray:
+    """指数移动平均，等价于pandas的ewm(adjust=False)
+
+    从第一个有效值开始递推，NaN不参与计算；有效值个数少于min_periods时输出NaN。
+    """
+    if alpha is None:
+        alpha = 2.0 / (span + 1.0)
+    x = as_float_array(x)
+    out = np.full_like(x, np.nan)
+    state = np.full(x.shape[:-1], np.nan)
+    count = np.zeros(x.shape[:-1], dtype=np.int64)
+    for t in range(x.shape[-1]):
+        value = x[..., t]
+        valid = ~np.isnan(value)
+        state = np.where(
+            valid,
+            np.where(np.isnan(state), value, alpha * value + (1.0 - alpha) * state),
+            state
+        )
+        count += valid
+        out[..., t] = np.where(count >= max(min_periods, 1), state, np.nan)
+    return out
+
+
+def wilder(x: np.ndarray, window: int) -> np.ndarray:
+    """Wilder平滑（RMA），即alpha=1/window的EMA"""
+    return ema(x, alpha=1.0 / window, min_periods=window)
+
+
+def wilder_seeded(x: np.ndarray, window: int, smoothing: str = "mean") -> np.ndarray:
+    """以前window个值的均值（或和）为初值的Wilder递推，用于ATR和ADX
+
+    smoothing="mean"时 S[t] = (S[t-1] * (window - 1) + x[t]) / window，
+    smoothing="sum"时 S[t] = S[t-1] - S[t-1] / window + x[t]。
+    """
+    x = as_float_array(x)
+    out = np.full_like(x, np.nan)
+    valid = np.flatnonzero(~np.isnan(x))
+    if len(valid) < window:
+        return out
+    start = valid[0]
+    seed_end = start + window
+    state = np.sum(x[start:seed_end])
+    if smoothing == "mean":
+        state /= window
+    out[seed_end - 1] = state
+    for t in range(seed_end, len(x)):
+        if smoothing == "mean":
+            state = (state * (window - 1) + x[t]) / window
+        else:
+            state = state - state / window + x[t]
+        out[t] = state
+    return out
+
+
+def rsi(close: np.ndarray, window: int = 14) -> np.ndarray:
+    """相对强弱指标"""
+    change = diff(close)
+    # 与ta库一致：每个序列第一个有效价格处的涨跌记为0
+    first = ~np.isnan(close) & np.isnan(change)
+    up = np.where(change > 0, change, np.where(np.isnan(change), np.nan, 0.0))
+    down = np.where(change < 0, -change, np.where(np.isnan(change), np.nan, 0.0))
+    up[first] = 0.0
+    down[first] = 0.0
+    avg_up = wilder(up, window)
+    avg_down = wilder(down, window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        value = 100.0 - 100.0 / (1.0 + avg_up / avg_down)
+    return np.where(avg_down == 0, 100.0, value)
+
+
+def macd(close: np.ndarray, fast: int = 12, slow: int = 26,
+         signal: int = 9) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """返回(MACD线, 信号线, 柱状值)"""
+    line = ema(close, span=fast, min_periods=fast) - ema(close, span=slow, min_periods=slow)
+    signal_line = ema(line, span=signal, min_periods=signal)
+    return line, signal_line, line - signal_line
+
+
+def last_valid(x: np.ndarray) -> np.ndarray:
+    """取每个序列最后一个有效值"""
+    return ffill(x)[..., -1]
+
+
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    prev_close = shift(close)
+    ranges = np.stack([high - low, np.abs(high - prev_close), np.abs(low - prev_close)])
+    return np.nanmax(ranges, axis=0)
+
+
+class IndicatorGraph:
+    """按需计算的技术指标依赖图
+
+    每个节点（指标或中间结果）由一个函数定义，函数通过graph[name]获取所依赖的
+    节点，因此依赖关系随调用自动展开。同一份数据上每个节点最多计算一次，
+    不同调用方请求的指标共享真实波幅、EMA、滚动极值等中间结果。
+    """
+
+    _nodes: Dict[str, Callable[["IndicatorGraph"], np.ndarray]] = {}
+
+    def __init__(self, high, low, close, volume, version: Optional[Hashable] = None):
+        self.high = as_float_array(high)
+        self.low = as_float_array(low)
+        self.close = as_float_array(close)
+        self.volume = as_float_array(volume)
+        self.version = version
+        self._values: Dict[str, np.ndarray] = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def node(cls, name: str):
+        """注册一个节点的计算函数"""
+        def register(func):
+            cls._nodes[name] = func
+            return func
+        return register
+
+    @classmethod
+    def from_frame(cls, hist) -> "IndicatorGraph":
+        return cls(hist['High'], hist['Low'], hist['Close'], hist['Volume'], version=frame_version(hist))
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        with self._lock:
+            value = self._values.get(name)
+            if value is None:
+                if name not in self._nodes:
+                    raise KeyError(f"Unknown indicator: {name}")
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    value = self._nodes[name](self)
+                self._values[name] = value
+            return value
+
+    def series(self, names: Iterable[str]) -> Dict[str, np.ndarray]:
+        return {name: self[name] for name in names}
+
+    def latest(self, names: Iterable[str]) -> Dict[str, float]:
+        """返回指定指标的最后一个值"""
+        return latest(self.series(names))
+
+    def ensure(self, names: Iterable[str], compute_values: Callable[[], Dict[str, np.ndarray]]) -> None:
+        """names中有未计算的节点时，调用compute_values一次性取得整张图的结果并填入
+
+        持锁执行，并发的调用方等待同一次计算，而不是各自重复计算。
+        """
+        with self._lock:
+            if all(name in self._values for name in names):
+                return
+            for name, value in compute_values().items():
+                self._values.setdefault(name, value)
+
+    @property
+    def computed(self) -> List[str]:
+        """已经计算过的节点，便于排查重复计算"""
+        return list(self._values)
+
+
+def frame_version(hist) -> Hashable:
+    """DataFrame的数据版本：长度、首末时间戳、最新收盘价和价格/成交量列内容的摘要
+
+    摘要覆盖全部行，中间某根K线被原地修改时版本同样会变化。
+    """
+    if len(hist) == 0:
+        return (0,)
+    digest = hashlib.blake2b(digest_size=16)
+    for col in ('High', 'Low', 'Close', 'Volume'):
+        if col in hist.columns:
+            digest.update(np.ascontiguousarray(hist[col].to_numpy(dtype=float)).tobytes())
+    return (len(hist), hist.index[0], hist.index[-1], float(hist['Close'].iloc[-1]), digest.hexdigest())
+
+
+_frame_graphs: Dict[int, Tuple[weakref.ref, IndicatorGraph]] = {}
+# graph_for会在I/O线程池中并发调用；弱引用回调可能在持锁线程中触发，因此用可重入锁
+_frame_graphs_lock = threading.RLock()
+
+
+def _forget_frame(key: int, ref: weakref.ref) -> None:
+    with _frame_graphs_lock:
+        # id可能已被新的DataFrame复用，只删除属于这个弱引用的条目
+        entry = _frame_graphs.get(key)
+        if entry is not None and entry[0] is ref:
+            del _frame_graphs[key]
+
+
+def graph_for(hist) -> IndicatorGraph:
+    """返回与该DataFrame绑定的指标图，数据版本不变时复用已计算的节点"""
+    key = id(hist)
+    version = frame_version(hist)
+    with _frame_graphs_lock:
+        entry = _frame_graphs.get(key)
+        if entry is not None and entry[0]() is hist and entry[1].version == version:
+            return entry[1]
+        graph = IndicatorGraph(hist['High'], hist['Low'], hist['Close'], hist['Volume'], version=version)
+        _frame_graphs[key] = (weakref.ref(hist, lambda ref, key=key: _forget_frame(key, ref)), graph)
+        return graph
+
+
+node = IndicatorGraph.node
+
+
+# 共享的中间结果
+node("prev_close")(lambda g: shift(g.close))
+node("change")(lambda g: g.close - g["prev_close"])
+node("tr")(lambda g: true_range(g.high, g.low, g.close))
+node("typical_price")(lambda g: (g.high + g.low + g.close) / 3.0)
+node("highest_14")(lambda g: rolling_max(g.high, 14))
+node("lowest_14")(lambda g: rolling_min(g.low, 14))
+node("ema_12")(lambda g: ema(g.close, span=12, min_periods=12))
+node("ema_26")(lambda g: ema(g.close, span=26, min_periods=26))
+node("bb_std")(lambda g: rolling_std(g.close, 20))
+node("money_flow")(lambda g: g["typical_price"] * g.volume)
+node("volume_sma_5")(lambda g: sma(g.volume, 5))
+node("volume_sma_20")(lambda g: sma(g.volume, 20))
+for _window in (10, 12, 15, 20, 30):
+    node(f"roc_{_window}")(lambda g, w=_window: (g.close - shift(g.close, w)) / shift(g.close, w))
+
+
+@node("smoothed_tr")
+def _smoothed_tr(g):
+    tr_for_dm = g["tr"].copy()
+    tr_for_dm[0] = np.nan
+    return wilder_seeded(tr_for_dm, 14, smoothing="sum")
+
+
+@node("plus_dm")
+def _plus_dm(g):
+    up_move, down_move = diff(g.high), -diff(g.low)
+    plus_dm = np.where((up_move > down_move) & (up_move > 0), up_move, 0.0)
+    plus_dm[0] = np.nan
+    return plus_dm
+
+
+@node("minus_dm")
+def _minus_dm(g):
+    up_move, down_move = diff(g.high), -diff(g.low)
+    minus_dm = np.where((down_move > up_move) & (down_move > 0), down_move, 0.0)
+    minus_dm[0] = np.nan
+    return minus_dm
+
+
+# 趋势指标
+node("sma_20")(lambda g: sma(g.close, 20))
+node("sma_50")(lambda g: sma(g.close, 50))
+node("ema_20")(lambda g: ema(g.close, span=20, min_periods=20))
+node("macd_line")(lambda g: g["ema_12"] - g["ema_26"])
+node("macd_signal")(lambda g: ema(g["macd_line"], span=9, min_periods=9))
+node("macd_diff")(lambda g: g["macd_line"] - g["macd_signal"])
+node("adx_pos")(lambda g: 100.0 * wilder_seeded(g["plus_dm"], 14, smoothing="sum") / g["smoothed_tr"])
+node("adx_neg")(lambda g: 100.0 * wilder_seeded(g["minus_dm"], 14, smoothing="sum") / g["smoothed_tr"])
+node("adx")(lambda g: wilder_seeded(
+    100.0 * np.abs(g["adx_pos"] - g["adx_neg"]) / (g["adx_pos"] + g["adx_neg"]), 14))
+node("ichimoku_a")(lambda g: 0.5 * (0.5 * (rolling_max(g.high, 9) + rolling_min(g.low, 9))
+                                    + 0.5 * (rolling_max(g.high, 26) + rolling_min(g.low, 26))))
+node("ichimoku_b")(lambda g: 0.5 * (rolling_max(g.high, 52) + rolling_min(g.low, 52)))
+node("kst")(lambda g: 100.0 * (sma(g["roc_10"], 10) + 2 * sma(g["roc_15"], 10)
+                               + 3 * sma(g["roc_20"], 10) + 4 * sma(g["roc_30"], 15)))
+node("kst_sig")(lambda g: sma(g["kst"], 9))
+
+# 动量指标
+node("rsi")(lambda g: rsi(g.close, 14))
+node("stoch_k")(lambda g: 100.0 * (g.close - g["lowest_14"]) / (g["highest_14"] - g["lowest_14"]))
+node("stoch_d")(lambda g: sma(g["stoch_k"], 3))
+node("williams_r")(lambda g: -100.0 * (g["highest_14"] - g.close) / (g["highest_14"] - g["lowest_14"]))
+node("roc")(lambda g: 100.0 * g["roc_12"])
+
+# 波动率指标
+node("bb_mid")(lambda g: g["sma_20"])
+node("bb_high")(lambda g: g["sma_20"] + 2 * g["bb_std"])
+node("bb_low")(lambda g: g["sma_20"] - 2 * g["bb_std"])
+node("atr")(lambda g: wilder_seeded(g["tr"], 14))
+node("keltner_high")(lambda g: sma((4 * g.high - 2 * g.low + g.close) / 3.0, 20))
+node("keltner_mid")(lambda g: sma(g["typical_price"], 20))
+node("keltner_low")(lambda g: sma((-2 * g.high + 4 * g.low + g.close) / 3.0, 20))
+
+# 成交量指标
+node("obv")(lambda g: np.cumsum(np.where(g["change"] < 0, -g.volume, g.volume)))
+node("force_index")(lambda g: ema(g["change"] * g.volume, span=13, min_periods=13))
+node("cmf")(lambda g: rolling_sum(
+    np.nan_to_num(((g.close - g.low) - (g.high - g.close)) / (g.high - g.low)) * g.volume, 20)
+    / rolling_sum(g.volume, 20))
+
+
+@node("mfi")
+def _mfi(g):
+    tp_change = diff(g["typical_price"])
+    positive_flow = rolling_sum(np.where(tp_change > 0, g["money_flow"], 0.0), 14)
+    negative_flow = rolling_sum(np.where(tp_change < 0, g["money_flow"], 0.0), 14)
+    return 100.0 - 100.0 / (1.0 + positive_flow / negative_flow)
+
+
+# 收益率
+node("daily_return")(lambda g: 100.0 * (g.close / g["prev_close"] - 1.0))
+node("cumulative_return")(lambda g: 100.0 * (g.close / g.close[0] - 1.0))
+
+
+INDICATOR_NAMES = (
+    "sma_20", "sma_50", "ema_20", "macd_line", "macd_signal", "macd_diff",
+    "adx", "adx_pos", "adx_neg", "ichimoku_a", "ichimoku_b", "kst", "kst_sig",
+    "rsi", "stoch_k", "stoch_d", "williams_r", "roc",
+    "bb_high", "bb_mid", "bb_low", "atr", "keltner_high", "keltner_mid", "keltner_low",
+    "obv", "force_index", "cmf", "mfi", "daily_return", "cumulative_return",
+)
+
+
+def compute_indicators(high, low, close, volume) -> Dict[str, np.ndarray]:
+    """计算全部技术指标，返回每个指标的完整序列"""
+    return IndicatorGraph(high, low, close, volume).series(INDICATOR_NAMES)
+
+
+def frame_arrays(hist) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """取出计算指标所需的最高价、最低价、收盘价和成交量数组"""
+    return tuple(hist[col].to_numpy(dtype=float) for col in ('High', 'Low', 'Close', 'Volume'))
+
+
+def compute_graph_values(high, low, close, volume) -> Dict[str, np.ndarray]:
+    """计算全部技术指标及其中间结果；模块级函数，参数均为数组，便于在进程池中执行"""
+    graph = IndicatorGraph(high, low, close, volume)
+    graph.series(INDICATOR_NAMES)
+    return dict(graph._values)
+
+
+def latest(series: Dict[str, np.ndarray]) -> Dict[str, float]:
+    """取每个指标序列的最后一个值"""
+    return {name: float(values[-1]) if len(values) else float("nan") for name, values in series.items()}
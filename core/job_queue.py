@@ -0,0 +1,275 @@
+"""基于SQLite的后台任务队列
+
+耗时较长的分析（市场分析、多股票投资分析）可以入队后立即返回任务ID，由后台worker执行，
+客户端轮询状态、阶段性结果和最终结果。队列持久化在本地SQLite文件中，
+同一文件可被多个进程共享：认领任务在IMMEDIATE事务中完成，同一任务只会被一个worker执行。
+
+相同任务类型和参数的任务在排队或执行期间只保留一个，重复提交返回已有任务的ID。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from core.executors import run_io
+from core.json_response import dumps
+
+logger = logging.getLogger(__name__)
+
+# 任务处理函数：接收参数和进度回调，返回最终结果
+JobHandler = Callable[[Dict[str, Any], Callable[[Any], None]], Awaitable[Any]]
+
+
+def job_dedup_key(task_type: str, kwargs: Dict[str, Any]) -> str:
+    """由任务类型和参数计算去重键，参数按键排序"""
+    payload = json.dumps({"task_type": task_type, "kwargs": kwargs}, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class JobQueue:
+    """持久化的任务队列"""
+
+    def __init__(self, path: str = "cache/jobs.sqlite3"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30,
+                                     isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, task_type TEXT NOT NULL, kwargs TEXT NOT NULL, "
+                "dedup_key TEXT NOT NULL, status TEXT NOT NULL, progress TEXT NOT NULL DEFAULT '[]', "
+                "result TEXT, error TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedup ON jobs(dedup_key, status)")
+
+    def _transaction(self, sql_calls: Callable[[sqlite3.Connection], Any]) -> Any:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                value = sql_calls(self._conn)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return value
+
+    def submit(self, task_type: str, kwargs: Dict[str, Any]) -> Tuple[str, bool]:
+        """提交任务，返回(任务ID, 是否新建)；已有相同任务在排队或执行时返回其ID"""
+        dedup_key = job_dedup_key(task_type, kwargs)
+
+        def insert(conn: sqlite3.Connection) -> Tuple[str, bool]:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE dedup_key = ? AND status IN ('queued', 'running') "
+                "ORDER BY created_at LIMIT 1", (dedup_key,)
+            ).fetchone()
+            if row is not None:
+                return row["id"], False
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, task_type, kwargs, dedup_key, status, created_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?)",
+                (job_id, task_type, dumps(kwargs).decode("utf-8"), dedup_key, time.time())
+            )
+            return job_id, True
+
+        job_id, created = self._transaction(insert)
+        logger.info(f"{'Queued' if created else 'Deduplicated'} job {job_id} ({task_type})")
+        return job_id, created
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """认领最早排队的任务并标记为running，没有任务时返回None"""
+        def take(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            row = conn.execute(
+                "SELECT id, task_type, kwargs FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), row["id"]))
+            return {"id": row["id"], "task_type": row["task_type"], "kwargs": json.loads(row["kwargs"])}
+
+        return self._transaction(take)
+
+    def append_progress(self, job_id: str, update: Any) -> None:
+        """追加一条阶段性结果"""
+        def append(conn: sqlite3.Connection) -> None:
+            row = conn.execute("SELECT progress FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            progress = json.loads(row["progress"])
+            progress.append(json.loads(dumps(update)))
+            conn.execute("UPDATE jobs SET progress = ? WHERE id = ?", (json.dumps(progress, ensure_ascii=False), job_id))
+
+        self._transaction(append)
+
+    def complete(self, job_id: str, result: Any) -> None:
+        self._finish(job_id, "succeeded", result=dumps(result).decode("utf-8"))
+
+    def fail(self, job_id: str, error: str) -> None:
+        self._finish(job_id, "failed", error=error)
+
+    def _finish(self, job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, result, error, time.time(), job_id)
+            )
+
+    def get(self, job_id: str, include_result: bool = False) -> Optional[Dict[str, Any]]:
+        """获取任务状态和阶段性结果，include_result为True时附带最终结果"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {
+            "job_id": row["id"],
+            "task_type": row["task_type"],
+            "status": row["status"],
+            "progress": json.loads(row["progress"]),
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"]
+        }
+        if include_result:
+            job["result"] = json.loads(row["result"]) if row["result"] else None
+        return job
+
+    def requeue_stale(self, max_running_seconds: float) -> int:
+        """将执行时间超过max_running_seconds的任务重新排队（例如执行它的进程已退出）"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL, progress = '[]' "
+                "WHERE status = 'running' AND started_at < ?",
+                (time.time() - max_running_seconds,)
+            )
+        if cursor.rowcount:
+            logger.warning(f"Requeued {cursor.rowcount} stale jobs")
+        return cursor.rowcount
+
+    def purge(self, max_age_seconds: float) -> int:
+        """删除完成时间早于max_age_seconds的任务"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?",
+                (time.time() - max_age_seconds,)
+            )
+        return cursor.rowcount
+
+
+class JobWorkerPool:
+    """在事件循环中运行固定数量的worker，从队列认领并执行任务"""
+
+    def __init__(self, queue: JobQueue, handlers: Dict[str, JobHandler], workers: int = 2,
+                 poll_interval: float = 1.0, retention: float = 7 * 86400, purge_interval: float = 3600):
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.purge_interval = purge_interval
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._run()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._purge_periodically()))
+        logger.info(f"Started {self.workers} job workers")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self) -> None:
+        """有新任务入队时唤醒等待中的worker"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            job = await run_io(self.queue.claim)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._execute(job)
+
+    async def _purge_periodically(self) -> None:
+        """定期删除超过保留期的已完成任务，避免任务表无限增长"""
+        while True:
+            try:
+                purged = await run_io(self.queue.purge, self.retention)
+                if purged:
+                    logger.info(f"Purged {purged} finished jobs")
+            except Exception as e:
+                logger.warning(f"Failed to purge finished jobs: {str(e)}")
+            await asyncio.sleep(self.purge_interval)
+
+    async def _execute(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        handler = self.handlers.get(job["task_type"])
+        if handler is None:
+            await run_io(self.queue.fail, job_id, f"Unsupported task type: {job['task_type']}")
+            return
+        logger.info(f"Running job {job_id} ({job['task_type']})")
+        # 进度回调由处理函数在事件循环中同步调用：这里只排入写入，按调用顺序在I/O线程池中依次执行
+        pending: Optional[asyncio.Future] = None
+
+        def on_progress(update: Any) -> None:
+            nonlocal pending
+            previous = pending
+
+            async def write() -> None:
+                if previous is not None:
+                    await previous
+                try:
+                    await run_io(self.queue.append_progress, job_id, update)
+                except Exception as e:
+                    logger.warning(f"Failed to record progress for job {job_id}: {str(e)}")
+
+            pending = asyncio.ensure_future(write())
+
+        try:
+            result = await handler(job["kwargs"], on_progress)
+            if pending is not None:
+                await pending
+            await run_io(self.queue.complete, job_id, result)
+            logger.info(f"Job {job_id} succeeded")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            if pending is not None:
+                await asyncio.gather(pending, return_exceptions=True)
+            await run_io(self.queue.fail, job_id, str(e))
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """获取进程级共享的任务队列，路径由JOB_QUEUE_PATH配置"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue(os.getenv('JOB_QUEUE_PATH', 'cache/jobs.sqlite3'))
+    return _queue
@@ -0,0 +1,70 @@
+import datetime
+import json
+import math
+from typing import Any
+
+import numpy as np
+import pandas as pd
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖，缺失时退回标准库
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    """序列化JSON原生不支持的NumPy/pandas对象"""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    # NaT也是datetime的实例，必须在时间类型之前判断
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, (pd.Timestamp, datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, pd.Series):
+        return obj.tolist()
+    if isinstance(obj, pd.Index):
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _replace_non_finite(obj: Any) -> Any:
+    if isinstance(obj, (np.ndarray, np.generic, pd.Series, pd.Index)):
+        obj = obj.tolist()
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {k: _replace_non_finite(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_replace_non_finite(v) for v in obj]
+    return obj
+
+
+def dumps(content: Any) -> bytes:
+    """一次性序列化为JSON字节串，NaN/inf输出为null"""
+    if orjson is not None:
+        return orjson.dumps(
+            content,
+            default=_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        )
+    try:
+        text = json.dumps(content, default=_default, ensure_ascii=False, allow_nan=False,
+                          separators=(",", ":"))
+    except ValueError:
+        # 含有NaN/inf时才需要额外遍历一次
+        text = json.dumps(_replace_non_finite(content), default=_default, ensure_ascii=False,
+                          separators=(",", ":"))
+    return text.encode("utf-8")
+
+
+class NumpyJSONResponse(JSONResponse):
+    """直接序列化NumPy标量/数组、pandas时间戳和NaN/inf的JSON响应"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 各类内容的缓存有效期（秒）；提示词中包含的数据变化时缓存键随之变化
+TTL_COMPANY_PROFILE = 7 * 24 * 3600  # 公司介绍、主营业务
+TTL_FUNDAMENTALS = 24 * 3600  # 基本面分析、投资建议
+TTL_NEWS = 3600  # 新闻摘要与情绪
+TTL_MARKET_REPORT = 1800  # 市场分析报告、宏观分析
+
+
+def normalize_prompt(text: str) -> str:
+    """去掉每行首尾空白和空行，使缩进不同的同一提示词得到相同的缓存键"""
+    return "\n".join(line.strip() for line in text.strip().splitlines() if line.strip())
+
+
+def cache_key(model: str, messages: List[Dict[str, str]], temperature: float,
+              response_format: Optional[Dict[str, Any]] = None) -> str:
+    """由模型、消息、温度和输出格式计算内容寻址的缓存键"""
+    payload = json.dumps({
+        "model": model,
+        "messages": [{"role": m["role"], "content": normalize_prompt(m["content"])} for m in messages],
+        "temperature": round(float(temperature), 4),
+        "response_format": response_format
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """基于SQLite的LLM响应缓存
+
+    每条记录带有写入时指定的过期时间（各调用方按内容的时效性设置TTL），
+    记录数超过max_entries时按最近访问时间淘汰。使用WAL模式，多个worker进程可以
+    共用同一个缓存文件，读取不会被其他进程的写入阻塞。
+
+    读取是只读查询：访问时间先记在内存中，与过期清理、容量淘汰一起每EVICT_EVERY次
+    写入批量落盘一次，因此淘汰顺序是近似的LRU。
+    """
+
+    EVICT_EVERY = 100
+
+    def __init__(self, path: str = "cache/llm_cache.sqlite3", max_entries: int = 5000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT NOT NULL, "
+                "created_at REAL NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+        self._accessed: Dict[str, float] = {}
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT response FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row is None:
+                    return None
+                self._accessed[key] = now
+                return row[0]
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read LLM cache: {str(e)}")
+            return None
+
+    def set(self, key: str, response: str, ttl: float, model: Optional[str] = None) -> None:
+        now = time.time()
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, response, created_at, expires_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model, response, now, now + ttl, now)
+                )
+                self._accessed.pop(key, None)
+                self._writes += 1
+                # 定期清理过期记录并限制总量，避免每次写入都扫描
+                if self._writes % self.EVICT_EVERY == 0:
+                    self._evict(now)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to write LLM cache: {str(e)}")
+
+    def _evict(self, now: float) -> None:
+        """批量写入访问时间，再删除过期记录和超出容量的最久未访问记录"""
+        accessed, self._accessed = self._accessed, {}
+        if accessed:
+            self._conn.executemany(
+                "UPDATE responses SET last_access = MAX(last_access, ?) WHERE key = ?",
+                [(access_time, key) for key, access_time in accessed.items()]
+            )
+        self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+            self._accessed.clear()
+
+
+_cache: Optional[LLMResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """获取进程级共享的LLM响应缓存，设置LLM_CACHE_DISABLED时返回None"""
+    global _cache
+    if os.getenv('LLM_CACHE_DISABLED'):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMResponseCache(
+                    os.getenv('LLM_CACHE_PATH', 'cache/llm_cache.sqlite3'),
+                    int(os.getenv('LLM_CACHE_MAX_ENTRIES', 5000))
+                )
+    return _cache
@@ -1,17 +1,96 @@
 import os
+import json
 import time
-from openai import OpenAI
+import asyncio
+import threading
+from openai import OpenAI, AsyncOpenAI
 from openai import APIError, RateLimitError
-from typing import Optional
+from typing import Any, AsyncIterator, Dict, List, Optional
 from dotenv import load_dotenv
 import logging
 import httpx
 
+from core.executors import run_io
+from core.llm_cache import cache_key, get_llm_cache
+
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+API_BASE_URL = "https://api.openai.com/v1"  # 使用默认的API端点
+
+# 进程内所有LLMProvider共享同一组OpenAI客户端及其HTTP连接池
+_clients_lock = threading.Lock()
+_sync_client: Optional[OpenAI] = None
+_async_client: Optional[AsyncOpenAI] = None
+
+
+def _http_limits() -> httpx.Limits:
+    max_connections = int(os.getenv('LLM_MAX_CONNECTIONS', 20))
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+
+def get_openai_client(api_key: str, timeout: float) -> OpenAI:
+    """获取共享的同步OpenAI客户端"""
+    global _sync_client
+    if _sync_client is None:
+        with _clients_lock:
+            if _sync_client is None:
+                _sync_client = OpenAI(
+                    api_key=api_key,
+                    base_url=API_BASE_URL,
+                    http_client=httpx.Client(limits=_http_limits(), timeout=timeout)
+                )
+    return _sync_client
+
+
+def get_async_openai_client(api_key: str, timeout: float) -> AsyncOpenAI:
+    """获取共享的异步OpenAI客户端，并发请求复用同一个连接池"""
+    global _async_client
+    if _async_client is None:
+        with _clients_lock:
+            if _async_client is None:
+                _async_client = AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=API_BASE_URL,
+                    http_client=httpx.AsyncClient(limits=_http_limits(), timeout=timeout)
+                )
+    return _async_client
+
+
+_JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool
+}
+
+
+def validate_schema(data: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """按结构化输出所用的JSON Schema子集（type/properties/required/items/enum）校验数据，返回错误列表"""
+    errors = []
+    expected = schema.get("type")
+    if expected in _JSON_TYPES:
+        if not isinstance(data, _JSON_TYPES[expected]) or (expected != "boolean" and isinstance(data, bool)):
+            return [f"{path} should be {expected}"]
+    if "enum" in schema and data not in schema["enum"]:
+        errors.append(f"{path} should be one of {schema['enum']}")
+    if expected == "object":
+        for name in schema.get("required", []):
+            if name not in data:
+                errors.append(f"{path}.{name} is required")
+        for name, subschema in schema.get("properties", {}).items():
+            if name in data:
+                errors.extend(validate_schema(data[name], subschema, f"{path}.{name}"))
+    elif expected == "array" and "items" in schema:
+        for i, item in enumerate(data):
+            errors.extend(validate_schema(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+
 class LLMProvider:
     def __init__(self, model: Optional[str] = None):
         self.api_key = os.getenv('OPENAI_API_KEY')
@@ -23,25 +102,53 @@ class LLMProvider:
         if not self.api_key:
             raise ValueError("API key not found in environment variables")
         
-        # 初始化OpenAI客户端
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url="https://api.openai.com/v1"  # 使用默认的API端点
-        )
-
-    def generate_response(self, prompt: str, attempt: int = 1) -> Optional[str]:
-        """生成回复"""
+        # 使用进程内共享的OpenAI客户端
+        self.client = get_openai_client(self.api_key, self.timeout)
+        self.async_client = get_async_openai_client(self.api_key, self.timeout)
+        self.cache = get_llm_cache()
+
+    def _cache_lookup(self, model: str, messages: List[Dict[str, str]], temperature: float,
+                      cache_ttl: Optional[float],
+                      response_format: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """返回命中的响应；未指定cache_ttl、缓存不可用或未命中时为None"""
+        if not cache_ttl or self.cache is None:
+            return None
+        cached = self.cache.get(cache_key(model, messages, temperature, response_format))
+        if cached is not None:
+            logger.info(f"LLM cache hit for model {model}")
+        return cached
+
+    def _cache_store(self, model: str, messages: List[Dict[str, str]], temperature: float,
+                     cache_ttl: Optional[float], response: Optional[str],
+                     response_format: Optional[Dict[str, Any]] = None) -> None:
+        """按实际生成响应的模型计算缓存键：回退到其他模型时，结果不会记在原模型名下"""
+        if cache_ttl and self.cache is not None and response:
+            self.cache.set(cache_key(model, messages, temperature, response_format), response, cache_ttl, model=model)
+
+    def generate_response(self, prompt: str, attempt: int = 1, model: Optional[str] = None,
+                          cache_ttl: Optional[float] = None) -> Optional[str]:
+        """生成回复（同步），在异步代码中请使用generate_response_async
+
+        指定cache_ttl（秒）时，相同模型、提示词和温度的响应在有效期内直接从缓存返回。
+        """
+        model = model or self.model or self.default_model
+        messages = [{"role": "user", "content": prompt}]
+        cached = self._cache_lookup(model, messages, 0.7, cache_ttl)
+        if cached is not None:
+            return cached
         try:
-            logger.info(f"Attempting to generate response with model {self.model or self.default_model} (attempt {attempt})")
+            logger.info(f"Attempting to generate response with model {model} (attempt {attempt})")
             
             response = self.client.chat.completions.create(
-                model=self.model or self.default_model,
-                messages=[{"role": "user", "content": prompt}],
+                model=model,
+                messages=messages,
                 temperature=0.7,
                 timeout=self.timeout
             )
             
-            return response.choices[0].message.content.strip()
+            content = response.choices[0].message.content.strip()
+            self._cache_store(model, messages, 0.7, cache_ttl, content)
+            return content
                 
         except RateLimitError:
             wait_time = (2 ** attempt) + 1  # 指数退避
@@ -52,10 +159,9 @@ class LLMProvider:
             logger.error(f"API Error: {str(e)}")
             if "model_not_found" in str(e):
                 # 如果模型不可用，尝试回退到GPT-3.5
-                if self.model != "gpt-3.5-turbo":
+                if model != "gpt-3.5-turbo":
                     logger.info("Falling back to GPT-3.5-turbo")
-                    self.model = "gpt-3.5-turbo"
-                    return self.generate_response(prompt, attempt)
+                    return self.generate_response(prompt, attempt, model="gpt-3.5-turbo", cache_ttl=cache_ttl)
             raise
                 
         except Exception as e:
@@ -65,13 +171,166 @@ class LLMProvider:
                 
         return None
 
-    def generate_response_sync(self, prompt: str, max_attempts: int = 3) -> str:
-        """同步方式生成响应"""
+    async def generate_response_async(self, prompt: str, model: Optional[str] = None,
+                                      temperature: float = 0.7, max_tokens: Optional[int] = None,
+                                      system_prompt: Optional[str] = None,
+                                      max_attempts: Optional[int] = None,
+                                      cache_ttl: Optional[float] = None,
+                                      response_format: Optional[Dict[str, Any]] = None) -> str:
+        """异步生成回复，等待响应和退避期间不阻塞事件循环
+
+        指定cache_ttl（秒）时，相同模型、消息、温度和输出格式的响应在有效期内直接从缓存返回。
+        response_format原样传给Chat Completions接口，例如JSON Schema约束的结构化输出。
+        """
+        model = model or self.model or self.default_model
+        messages: List[Dict[str, str]] = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        max_attempts = max_attempts or self.max_retries
+        # SQLite读写可能等待其他进程的写锁，异步路径中放到I/O线程池执行
+        cached = await run_io(self._cache_lookup, model, messages, temperature, cache_ttl, response_format)
+        if cached is not None:
+            return cached
+
+        for attempt in range(max_attempts):
+            try:
+                logger.info(f"Attempting to generate response with model {model} (attempt {attempt + 1})")
+                kwargs = {"max_tokens": max_tokens} if max_tokens else {}
+                if response_format:
+                    kwargs["response_format"] = response_format
+                response = await self.async_client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    timeout=self.timeout,
+                    **kwargs
+                )
+                content = (response.choices[0].message.content or "").strip()
+                await run_io(self._cache_store, model, messages, temperature, cache_ttl, content, response_format)
+                return content
+
+            except RateLimitError:
+                if attempt == max_attempts - 1:
+                    raise
+                wait_time = (2 ** attempt) + 1  # 指数退避
+                logger.warning(f"Rate limit reached. Waiting {wait_time} seconds...")
+                await asyncio.sleep(wait_time)
+
+            except APIError as e:
+                logger.error(f"API Error: {str(e)}")
+                if "model_not_found" in str(e) and model != "gpt-3.5-turbo":
+                    # 如果模型不可用，尝试回退到GPT-3.5
+                    logger.info("Falling back to GPT-3.5-turbo")
+                    model = "gpt-3.5-turbo"
+                    continue
+                if attempt == max_attempts - 1:
+                    raise
+                await asyncio.sleep(2)
+
+            except Exception as e:
+                logger.error(f"Unexpected error: {str(e)}")
+                if attempt == max_attempts - 1:
+                    raise
+                await asyncio.sleep(2)
+
+        raise RuntimeError(f"Failed to generate response after {max_attempts} attempts")
+
+    async def generate_response_stream(self, prompt: str, model: Optional[str] = None,
+                                       temperature: float = 0.7, max_tokens: Optional[int] = None,
+                                       system_prompt: Optional[str] = None,
+                                       max_attempts: Optional[int] = None,
+                                       cache_ttl: Optional[float] = None) -> AsyncIterator[str]:
+        """流式生成回复，按到达顺序逐段产出文本
+
+        只在尚未产出任何内容时重试；缓存命中时一次性产出完整响应，
+        完整生成后按cache_ttl写入缓存。
+        """
+        model = model or self.model or self.default_model
+        messages: List[Dict[str, str]] = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        max_attempts = max_attempts or self.max_retries
+        cached = await run_io(self._cache_lookup, model, messages, temperature, cache_ttl)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks: List[str] = []
+        for attempt in range(max_attempts):
+            try:
+                logger.info(f"Attempting to stream response with model {model} (attempt {attempt + 1})")
+                kwargs = {"max_tokens": max_tokens} if max_tokens else {}
+                stream = await self.async_client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    timeout=self.timeout,
+                    stream=True,
+                    **kwargs
+                )
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        chunks.append(delta)
+                        yield delta
+                break
+
+            except (RateLimitError, APIError) as e:
+                # 已经产出的内容无法撤回，此时只能向调用方报告错误
+                if chunks or attempt == max_attempts - 1:
+                    raise
+                if isinstance(e, RateLimitError):
+                    wait_time = (2 ** attempt) + 1  # 指数退避
+                    logger.warning(f"Rate limit reached. Waiting {wait_time} seconds...")
+                    await asyncio.sleep(wait_time)
+                    continue
+                logger.error(f"API Error: {str(e)}")
+                if "model_not_found" in str(e) and model != "gpt-3.5-turbo":
+                    # 如果模型不可用，尝试回退到GPT-3.5
+                    logger.info("Falling back to GPT-3.5-turbo")
+                    model = "gpt-3.5-turbo"
+                    continue
+                await asyncio.sleep(2)
+
+        await run_io(self._cache_store, model, messages, temperature, cache_ttl, "".join(chunks).strip())
+
+    async def generate_structured_async(self, prompt: str, schema: Dict[str, Any], schema_name: str,
+                                        **kwargs) -> Dict[str, Any]:
+        """按JSON Schema约束生成结构化结果并解析为字典
+
+        其余参数同generate_response_async。响应不是合法JSON或不符合schema时抛出ValueError，
+        由调用方决定如何降级。
+        """
+        response_format = {
+            "type": "json_schema",
+            "json_schema": {"name": schema_name, "schema": schema, "strict": True}
+        }
+        content = await self.generate_response_async(prompt, response_format=response_format, **kwargs)
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Structured response is not valid JSON: {str(e)}")
+        errors = validate_schema(data, schema)
+        if errors:
+            raise ValueError(f"Structured response does not match schema: {'; '.join(errors)}")
+        return data
+
+    def generate_response_sync(self, prompt: str, max_attempts: int = 3,
+                               cache_ttl: Optional[float] = None) -> str:
+        """同步方式生成响应，cache_ttl含义同generate_response"""
         try:
             messages = [
                 {"role": "system", "content": "你是一个专业的AI助手，擅长分析和生成高质量内容。"},
                 {"role": "user", "content": prompt}
             ]
+            model = self.model or self.default_model
+            cached = self._cache_lookup(model, messages, 0.7, cache_ttl)
+            if cached is not None:
+                return cached
             
             for attempt in range(max_attempts):
                 try:
@@ -85,7 +344,9 @@ class LLMProvider:
                     )
                     
                     logger.info(f"Response generated successfully")
-                    return response.choices[0].message.content
+                    content = response.choices[0].message.content
+                    self._cache_store(model, messages, 0.7, cache_ttl, content)
+                    return content
                     
                 except RateLimitError:
                     wait_time = (2 ** attempt) + 1
@@ -0,0 +1,402 @@
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import pandas as pd
+import yfinance as yf
+
+from core.indicator_state import IndicatorStateTracker
+from core.ohlcv_store import OHLCVStore
+from core.shared_cache import SharedCache, get_shared_cache
+
+logger = logging.getLogger(__name__)
+
+
+# 日线period对应的时间跨度，整数表示交易日根数
+PERIOD_SPANS = {
+    "1d": 1,
+    "5d": 5,
+    "1mo": pd.DateOffset(months=1),
+    "3mo": pd.DateOffset(months=3),
+    "6mo": pd.DateOffset(months=6),
+    "1y": pd.DateOffset(years=1),
+}
+
+
+def slice_period(hist: pd.DataFrame, period: str) -> pd.DataFrame:
+    """从更长的日线数据中截取period对应的部分"""
+    if hist.empty:
+        return hist
+    span = PERIOD_SPANS[period]
+    if isinstance(span, int):
+        return hist.tail(span)
+    return hist[hist.index > hist.index[-1] - span]
+
+
+class MarketDataGateway:
+    """进程内共享的行情数据网关
+
+    所有agent都通过该网关访问yfinance。相同(symbol, period, interval)的并发请求
+    只会触发一次上游下载，其余请求等待并共享这次下载的结果（single-flight）。
+
+    日线数据按股票只保留一份最长的序列（base_period），较短的period都从这份
+    序列中切片得到；配置了OHLCVStore时，该序列会落盘并在过期后增量刷新。
+
+    配置了SharedCache时，single-flight扩展到多个worker进程：日线刷新和info/news下载
+    由持有租约的进程执行，其余进程等待后读取落盘数据或共享缓存中的结果。
+    """
+
+    def __init__(self, store: Optional[OHLCVStore] = None, timeout: int = 10,
+                 base_period: str = "1y", max_age: int = 600,
+                 shared: Optional[SharedCache] = None, info_ttl: int = 3600, lease_ttl: int = 60):
+        self.store = store
+        self.timeout = timeout
+        self.base_period = base_period
+        self.max_age = max_age
+        self.shared = shared
+        self.info_ttl = info_ttl
+        self.lease_ttl = lease_ttl
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, Future] = {}
+        self._daily: Dict[str, Tuple[pd.DataFrame, float]] = {}
+        self.indicator_states = IndicatorStateTracker(store)
+
+    def _single_flight(self, key: Hashable, fetch: Callable[[], Any]) -> Any:
+        """同一个key同时只允许一个请求访问上游，其余请求等待其结果"""
+        with self._lock:
+            future = self._inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[key] = future
+
+        if not is_leader:
+            logger.info(f"Joining in-flight request {key}")
+            return future.result()
+
+        try:
+            result = fetch()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def history(self, symbol: str, period: str = "1mo", interval: str = "1d",
+                timeout: Optional[int] = None) -> pd.DataFrame:
+        """获取历史K线数据"""
+        symbol = symbol.upper()
+        if interval == "1d" and period in PERIOD_SPANS:
+            hist = slice_period(self.daily_history(symbol, timeout=timeout), period)
+        else:
+            hist = self._download_history(symbol, period, interval, timeout)
+        # 每个调用方拿到独立副本，避免某个agent修改DataFrame影响其他请求
+        return hist.copy()
+
+    def daily_history(self, symbol: str, timeout: Optional[int] = None) -> pd.DataFrame:
+        """返回该股票base_period长度的日线数据，调用方不应修改返回值"""
+        symbol = symbol.upper()
+        hist = self._cached_daily(symbol, include_store=False)
+        if hist is not None:
+            return hist
+
+        hist = self._single_flight(("daily", symbol), lambda: self._load_daily(symbol, timeout))
+        self._remember_daily(symbol, hist)
+        return hist
+
+    def latest_indicators(self, symbol: str, timeout: Optional[int] = None) -> Dict[str, float]:
+        """返回该股票日线技术指标的最新值
+
+        指标状态随日线数据增量推进，每根新K线只需常数时间更新，无需重算整段序列。
+        """
+        symbol = symbol.upper()
+        return self.indicator_states.latest(symbol, self.daily_history(symbol, timeout=timeout))
+
+    def data_version(self, symbols: Iterable[str] = ()) -> str:
+        """行情数据版本，用于判断基于行情的分析结果是否过期
+
+        由刷新周期编号（每max_age秒变化一次）和各股票落盘数据的版本号组成，
+        任一股票的数据被刷新后版本随之变化。
+        """
+        parts = [str(int(time.time() // self.max_age))]
+        if self.store is not None:
+            parts.extend(f"{symbol.upper()}:{self.store.version(symbol) or ''}" for symbol in sorted(set(symbols)))
+        return "|".join(parts)
+
+    def _cached_daily(self, symbol: str, include_store: bool = True) -> Optional[pd.DataFrame]:
+        """返回未过期的内存或落盘日线数据，没有时返回None"""
+        with self._lock:
+            entry = self._daily.get(symbol)
+        if entry is not None and time.time() - entry[1] < self.max_age:
+            return entry[0]
+        if include_store:
+            hist = self._stored_daily(symbol)
+            if hist is not None:
+                self._remember_daily(symbol, hist)
+                return hist
+        return None
+
+    def _stored_daily(self, symbol: str) -> Optional[pd.DataFrame]:
+        """返回未过期的落盘日线数据，没有时返回None"""
+        if self.store is not None and self.store.period(symbol) == self.base_period:
+            age = self.store.age(symbol)
+            if age is not None and age < self.max_age:
+                hist = self.store.read(symbol)
+                if hist is not None and not hist.empty:
+                    return hist
+        return None
+
+    def _remember_daily(self, symbol: str, hist: pd.DataFrame) -> None:
+        with self._lock:
+            self._daily[symbol] = (hist, time.time())
+
+    def _load_daily(self, symbol: str, timeout: Optional[int]) -> pd.DataFrame:
+        """多进程共用落盘数据时，只有持有租约的进程访问上游，其余进程等它落盘后直接读取"""
+        if self.shared is None or self.store is None:
+            return self._refresh_daily(symbol, timeout)
+        return self.shared.single_flight(
+            f"daily:{symbol}",
+            lambda: self._refresh_daily(symbol, timeout),
+            ready=lambda: self._stored_daily(symbol),
+            lease_ttl=self.lease_ttl
+        )
+
+    def _refresh_daily(self, symbol: str, timeout: Optional[int]) -> pd.DataFrame:
+        """依次尝试：未过期的落盘数据、增量刷新、完整下载"""
+        if self.store is not None and self.store.period(symbol) == self.base_period:
+            hist = self.store.read(symbol)
+            if hist is not None and not hist.empty:
+                age = self.store.age(symbol)
+                if age is not None and age < self.max_age:
+                    return hist
+                try:
+                    # 从倒数第二根K线开始获取：最后一根可能是盘中未收盘的K线需要覆盖，
+                    # 倒数第二根已收盘，用来核对历史数据是否被重新复权
+                    reference = hist.index[-2] if len(hist) > 1 else hist.index[-1]
+                    new_bars = self.history_since(symbol, reference, timeout=timeout)
+                    if not self._readjusted(hist, new_bars, reference):
+                        logger.info(f"Incrementally refreshed {symbol} with {len(new_bars)} bars")
+                        return self.store.append(symbol, new_bars)
+                    logger.info(f"{symbol} history was re-adjusted, downloading full {self.base_period}")
+                except Exception as e:
+                    logger.warning(f"Failed to incrementally refresh {symbol}: {str(e)}")
+
+        hist = self._download_history(symbol, self.base_period, "1d", timeout)
+        if self.store is not None and not hist.empty:
+            try:
+                self.store.write(symbol, hist, period=self.base_period)
+            except Exception as e:
+                logger.warning(f"Failed to store history for {symbol}: {str(e)}")
+        return hist
+
+    @staticmethod
+    def _readjusted(hist: pd.DataFrame, new_bars: pd.DataFrame, reference: pd.Timestamp) -> bool:
+        """判断拆股或分红后yfinance是否已重新复权整段历史
+
+        复权后旧K线的价格会整体缩放，只追加新K线会留下永久的价格跳变，
+        此时必须重新下载完整序列。
+        """
+        if new_bars is None or new_bars.empty:
+            return False
+        events = new_bars[new_bars.index > hist.index[-1]]
+        for column in ("Stock Splits", "Dividends"):
+            if column in events.columns and (events[column].fillna(0) != 0).any():
+                return True
+        if reference not in new_bars.index:
+            return True
+        return not math.isclose(float(new_bars.loc[reference, "Close"]),
+                                float(hist.loc[reference, "Close"]), rel_tol=1e-4)
+
+    def _download_history(self, symbol: str, period: str, interval: str,
+                          timeout: Optional[int]) -> pd.DataFrame:
+        key = ("history", symbol, period, interval)
+
+        def fetch():
+            logger.info(f"Downloading {symbol} history (period={period}, interval={interval})")
+            return yf.Ticker(symbol).history(
+                period=period,
+                interval=interval,
+                timeout=timeout or self.timeout
+            )
+
+        return self._single_flight(key, fetch)
+
+    def history_panel(self, symbols: List[str], period: str = "6mo", chunk_size: int = 100,
+                      timeout: Optional[int] = None) -> pd.DataFrame:
+        """批量获取多只股票的日线数据
+
+        返回以日期为索引、列为(字段, 股票代码)的面板，例如panel["Close"]
+        即为日期×股票代码的收盘价矩阵。已缓存的股票不会重复下载，
+        其余股票按chunk_size分组批量下载。
+        """
+        symbols = list(dict.fromkeys(symbol.upper() for symbol in symbols))
+        frames: Dict[str, pd.DataFrame] = {}
+        missing = []
+        for symbol in symbols:
+            hist = self._cached_daily(symbol)
+            if hist is not None:
+                frames[symbol] = hist
+            else:
+                missing.append(symbol)
+
+        for start in range(0, len(missing), chunk_size):
+            chunk = tuple(missing[start:start + chunk_size])
+            frames.update(self._single_flight(("batch", chunk), lambda: self._download_batch(chunk, timeout)))
+
+        frames = {
+            symbol: slice_period(hist, period)
+            for symbol, hist in frames.items()
+            if not hist.empty
+        }
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, axis=1).swaplevel(axis=1).sort_index(axis=1)
+
+    def _download_batch(self, symbols: Tuple[str, ...], timeout: Optional[int],
+                        max_retries: int = 3) -> Dict[str, pd.DataFrame]:
+        """一次请求下载一组股票的base_period日线数据，并写入缓存"""
+        logger.info(f"Downloading {len(symbols)} symbols in one batch (period={self.base_period})")
+        data = None
+        for attempt in range(max_retries):
+            try:
+                data = yf.download(
+                    list(symbols),
+                    period=self.base_period,
+                    interval="1d",
+                    group_by="ticker",
+                    auto_adjust=True,  # 与Ticker.history的默认行为保持一致
+                    ignore_tz=False,
+                    threads=True,
+                    progress=False,
+                    timeout=timeout or self.timeout
+                )
+                break
+            except Exception as e:
+                logger.error(f"Batch download failed (attempt {attempt + 1}): {str(e)}")
+                if attempt == max_retries - 1:
+                    return {}
+                time.sleep(2 ** attempt)  # 指数退避
+
+        frames = {}
+        for symbol in symbols:
+            if isinstance(data.columns, pd.MultiIndex):
+                if symbol not in data.columns.get_level_values(0):
+                    continue
+                hist = data[symbol]
+            else:
+                hist = data
+            hist = hist.dropna(how="all")
+            if hist.empty:
+                logger.warning(f"No data available for {symbol}")
+                continue
+
+            frames[symbol] = hist
+            self._remember_daily(symbol, hist)
+            if self.store is not None:
+                try:
+                    self.store.write(symbol, hist, period=self.base_period)
+                except Exception as e:
+                    logger.warning(f"Failed to store history for {symbol}: {str(e)}")
+        return frames
+
+    def history_since(self, symbol: str, start: pd.Timestamp, interval: str = "1d",
+                      timeout: Optional[int] = None) -> pd.DataFrame:
+        """只获取start（含）之后的K线，用于增量刷新"""
+        symbol = symbol.upper()
+        start_date = pd.Timestamp(start).strftime("%Y-%m-%d")
+        key = ("history_since", symbol, start_date, interval)
+
+        def fetch():
+            logger.info(f"Downloading {symbol} history since {start_date} (interval={interval})")
+            return yf.Ticker(symbol).history(
+                start=start_date,
+                interval=interval,
+                timeout=timeout or self.timeout
+            )
+
+        return self._single_flight(key, fetch).copy()
+
+    def info(self, symbol: str) -> Dict[str, Any]:
+        """获取公司基本信息"""
+        symbol = symbol.upper()
+
+        def fetch():
+            logger.info(f"Downloading {symbol} info")
+            return yf.Ticker(symbol).info or {}
+
+        return dict(self._single_flight(("info", symbol), lambda: self._shared_fetch("info", symbol, self.info_ttl, fetch)))
+
+    def news(self, symbol: str) -> List[Dict[str, Any]]:
+        """获取个股新闻"""
+        symbol = symbol.upper()
+
+        def fetch():
+            logger.info(f"Downloading {symbol} news")
+            return yf.Ticker(symbol).news or []
+
+        return list(self._single_flight(("news", symbol), lambda: self._shared_fetch("news", symbol, self.max_age, fetch)))
+
+    def _shared_fetch(self, namespace: str, symbol: str, ttl: int, fetch: Callable[[], Any]) -> Any:
+        """先读共享缓存；未命中时由持有租约的进程下载并写入，其余进程等待后读取"""
+        if self.shared is None:
+            return fetch()
+        value = self.shared.get_json(namespace, symbol)
+        if value is not None:
+            return value
+
+        def download():
+            value = fetch()
+            self.shared.set_json(namespace, symbol, value, ttl)
+            return value
+
+        return self.shared.single_flight(
+            f"{namespace}:{symbol}",
+            download,
+            ready=lambda: self.shared.get_json(namespace, symbol),
+            lease_ttl=self.lease_ttl
+        )
+
+    def ticker(self, symbol: str) -> "GatewayTicker":
+        """返回与yf.Ticker接口兼容、但经由网关取数的对象"""
+        return GatewayTicker(self, symbol)
+
+
+class GatewayTicker:
+    """yf.Ticker的轻量替身，history/info/news均经由MarketDataGateway获取"""
+
+    def __init__(self, gateway: MarketDataGateway, symbol: str):
+        self._gateway = gateway
+        self.ticker = symbol.upper()
+
+    def history(self, period: str = "1mo", interval: str = "1d",
+                timeout: Optional[int] = None) -> pd.DataFrame:
+        return self._gateway.history(self.ticker, period=period, interval=interval, timeout=timeout)
+
+    @property
+    def info(self) -> Dict[str, Any]:
+        return self._gateway.info(self.ticker)
+
+    @property
+    def news(self) -> List[Dict[str, Any]]:
+        return self._gateway.news(self.ticker)
+
+
+_gateway: Optional[MarketDataGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_market_data_gateway() -> MarketDataGateway:
+    """获取进程级共享的行情数据网关，多个worker进程通过共享缓存协调上游访问"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = MarketDataGateway(store=OHLCVStore("cache/stock_data"), shared=get_shared_cache())
+    return _gateway
@@ -0,0 +1,244 @@
+import json
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class OHLCVStore:
+    """按股票代码分区的列式K线存储
+
+    每个股票代码一个目录，时间索引和每一列分别保存为独立的.npy文件，
+    读取时以内存映射方式打开，只读取需要的列。目录结构：
+
+        {root}/{SYMBOL}/meta.json
+        {root}/{SYMBOL}/{version}.index.npy
+        {root}/{SYMBOL}/{version}.{column}.npy
+
+    meta.json指向当前版本，写入时先写新版本的列文件再原子替换meta.json，
+    并保留上一个版本的文件直到下一次写入，因此已读到旧meta.json、正在逐列加载的读者
+    不会遇到文件被删除；读取仍然失败时会重新读取meta.json再试一次。
+    """
+
+    META_FILE = "meta.json"
+
+    def __init__(self, root: str = "cache/stock_data"):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _symbol_dir(self, symbol: str) -> Path:
+        return self.root / symbol.upper()
+
+    def _read_meta(self, symbol: str) -> Optional[Dict[str, Any]]:
+        meta_path = self._symbol_dir(symbol) / self.META_FILE
+        if not meta_path.exists():
+            return None
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to read store metadata for {symbol}: {str(e)}")
+            return None
+
+    def _column_path(self, symbol: str, version: str, column: str) -> Path:
+        return self._symbol_dir(symbol) / f"{version}.{column}.npy"
+
+    def write(self, symbol: str, hist: pd.DataFrame, info: Optional[Dict[str, Any]] = None,
+              period: Optional[str] = None) -> None:
+        """写入某个股票的完整历史数据，period记录这份数据覆盖的下载区间"""
+        symbol_dir = self._symbol_dir(symbol)
+        symbol_dir.mkdir(parents=True, exist_ok=True)
+        version = uuid.uuid4().hex
+
+        index = pd.DatetimeIndex(hist.index)
+        tz = str(index.tz) if index.tz is not None else None
+        if tz is not None:
+            index = index.tz_convert("UTC").tz_localize(None)
+        np.save(self._column_path(symbol, version, "index"), index.values.astype("datetime64[ns]").view("int64"))
+
+        columns = [col for col in hist.columns if np.issubdtype(hist[col].dtype, np.number)]
+        for col in columns:
+            np.save(self._column_path(symbol, version, col), np.ascontiguousarray(hist[col].to_numpy()))
+
+        previous = self._read_meta(symbol)
+        meta = {
+            "symbol": symbol.upper(),
+            "version": version,
+            "columns": columns,
+            "rows": len(hist),
+            "tz": tz,
+            "period": period or (previous or {}).get("period"),
+            "updated_at": time.time(),
+            "info": info if info is not None else (previous or {}).get("info", {}),
+            "info_updated_at": time.time() if info is not None else (previous or {}).get("info_updated_at")
+        }
+        tmp_path = symbol_dir / f"{self.META_FILE}.{version}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, symbol_dir / self.META_FILE)
+
+        # 只清理更早的版本：上一个版本可能仍有读者正在加载
+        keep = {version, (previous or {}).get("version")}
+        for path in symbol_dir.glob("*.npy"):
+            if path.name.split(".", 1)[0] not in keep:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def append(self, symbol: str, bars: pd.DataFrame, info: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+        """将新K线合并到已有数据末尾，时间戳重复的K线以新数据为准，返回合并后的完整数据"""
+        existing = self.read(symbol)
+        if existing is None or existing.empty:
+            merged = bars
+        elif bars is None or bars.empty:
+            merged = existing
+        else:
+            existing, bars = self._align_tz(existing, bars)
+            merged = pd.concat([existing, bars])
+            merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+        self.write(symbol, merged, info)
+        return merged
+
+    @staticmethod
+    def _align_tz(existing: pd.DataFrame, bars: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """统一两份数据的时区，以便合并
+
+        备用数据源返回不带时区的日期，这里把不带时区的一方视为另一方时区的当地时间。
+        """
+        existing_tz, bars_tz = existing.index.tz, bars.index.tz
+        if existing_tz is not None and bars_tz is None:
+            bars = bars.tz_localize(existing_tz)
+        elif existing_tz is None and bars_tz is not None:
+            existing = existing.tz_localize(bars_tz)
+        elif existing_tz is not None and bars_tz is not None:
+            bars = bars.tz_convert(existing_tz)
+        return existing, bars
+
+    def _state_path(self, symbol: str, name: str) -> Path:
+        return self._symbol_dir(symbol) / f"{name}.state.json"
+
+    def write_state(self, symbol: str, name: str, state: Dict[str, Any]) -> None:
+        """保存与该股票K线关联的派生状态（例如增量指标状态）"""
+        symbol_dir = self._symbol_dir(symbol)
+        symbol_dir.mkdir(parents=True, exist_ok=True)
+        path = self._state_path(symbol, name)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, default=str)
+        os.replace(tmp_path, path)
+
+    def read_state(self, symbol: str, name: str) -> Optional[Dict[str, Any]]:
+        path = self._state_path(symbol, name)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to read {name} state for {symbol}: {str(e)}")
+            return None
+
+    def last_timestamp(self, symbol: str) -> Optional[pd.Timestamp]:
+        """返回已缓存的最后一根K线的时间戳"""
+        meta = self._read_meta(symbol)
+        if meta is None or not meta.get("rows"):
+            return None
+        try:
+            return self._read_index(symbol, meta)[-1]
+        except Exception as e:
+            logger.warning(f"Failed to read last timestamp for {symbol}: {str(e)}")
+            return None
+
+    def version(self, symbol: str) -> Optional[str]:
+        """当前数据版本号，每次写入都会变化，不存在时返回None"""
+        meta = self._read_meta(symbol)
+        return meta.get("version") if meta is not None else None
+
+    def has(self, symbol: str) -> bool:
+        return self._read_meta(symbol) is not None
+
+    def age(self, symbol: str) -> Optional[float]:
+        """距离上次写入的秒数，不存在时返回None"""
+        meta = self._read_meta(symbol)
+        if meta is None:
+            return None
+        return time.time() - meta.get("updated_at", 0)
+
+    def info_age(self, symbol: str) -> Optional[float]:
+        """距离上次写入公司信息的秒数，不存在时返回None"""
+        meta = self._read_meta(symbol)
+        if meta is None or meta.get("info_updated_at") is None:
+            return None
+        return time.time() - meta["info_updated_at"]
+
+    def period(self, symbol: str) -> Optional[str]:
+        meta = self._read_meta(symbol)
+        return meta.get("period") if meta else None
+
+    def info(self, symbol: str) -> Dict[str, Any]:
+        meta = self._read_meta(symbol)
+        return dict(meta.get("info", {})) if meta else {}
+
+    def _read_index(self, symbol: str, meta: Dict[str, Any]) -> pd.DatetimeIndex:
+        raw = np.load(self._column_path(symbol, meta["version"], "index"), mmap_mode="r")
+        index = pd.DatetimeIndex(np.asarray(raw).view("datetime64[ns]"))
+        if meta.get("tz"):
+            index = index.tz_localize("UTC").tz_convert(meta["tz"])
+        return index
+
+    def read_column(self, symbol: str, column: str) -> Optional[np.ndarray]:
+        """以只读内存映射方式读取单列，不复制数据"""
+        meta = self._read_meta(symbol)
+        if meta is None or column not in meta["columns"]:
+            return None
+        return np.load(self._column_path(symbol, meta["version"], column), mmap_mode="r")
+
+    def read(self, symbol: str, columns: Optional[Iterable[str]] = None) -> Optional[pd.DataFrame]:
+        """读取历史数据，可通过columns只读取需要的列"""
+        columns = list(columns) if columns is not None else None
+        for attempt in range(2):
+            meta = self._read_meta(symbol)
+            if meta is None:
+                return None
+            try:
+                wanted = [col for col in (columns or meta["columns"]) if col in meta["columns"]]
+                data = {
+                    col: np.load(self._column_path(symbol, meta["version"], col), mmap_mode="r")
+                    for col in wanted
+                }
+                return pd.DataFrame(data, index=self._read_index(symbol, meta), columns=wanted)
+            except FileNotFoundError:
+                # 读取期间其他进程连续写入了两个新版本，重新读取meta.json后再试一次
+                if attempt == 0:
+                    continue
+                logger.warning(f"Store data for {symbol} changed while reading")
+                return None
+            except Exception as e:
+                logger.warning(f"Failed to read store data for {symbol}: {str(e)}")
+                return None
+        return None
+
+    def read_panel(self, symbols: Iterable[str], column: str = "Close") -> pd.DataFrame:
+        """读取多个股票的同一列，返回日期×股票代码的面板"""
+        series: Dict[str, pd.Series] = {}
+        for symbol in symbols:
+            meta = self._read_meta(symbol)
+            if meta is None or column not in meta["columns"]:
+                continue
+            try:
+                values = np.load(self._column_path(symbol, meta["version"], column), mmap_mode="r")
+                series[symbol.upper()] = pd.Series(values, index=self._read_index(symbol, meta))
+            except Exception as e:
+                logger.warning(f"Failed to read {column} for {symbol}: {str(e)}")
+        return pd.DataFrame(series)
+
+    def symbols(self) -> List[str]:
+        return sorted(p.name for p in self.root.iterdir() if (p / self.META_FILE).exists())
@@ -0,0 +1,188 @@
+"""分析接口的响应缓存
+
+热门股票的分析常在几分钟内被重复请求。缓存以归一化的任务类型和参数（股票代码大写、
+去重、排序）加上行情数据版本为键，数据版本变化即视为失效；相同键的并发请求
+等待同一次计算的结果，而不是各自重新计算。
+
+配置了SharedCache时，响应同时写入跨进程的共享缓存，其他worker进程可以直接命中；
+不同进程的相同请求通过租约合并，只有一个进程执行计算。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from core.executors import run_io
+from core.json_response import dumps
+from core.shared_cache import SharedCache, get_shared_cache
+
+logger = logging.getLogger(__name__)
+
+
+# 只影响执行方式、不影响结果的参数，不参与缓存键
+EXECUTION_KWARGS = ("concurrency",)
+
+
+def normalize_task_kwargs(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """股票代码大写、去重并排序，去掉执行参数，其余参数原样保留"""
+    normalized = {k: v for k, v in kwargs.items() if k not in EXECUTION_KWARGS}
+    symbols = normalized.get("symbols")
+    if isinstance(symbols, str):
+        symbols = symbols.split(",")
+    if isinstance(symbols, (list, tuple)):
+        normalized["symbols"] = sorted({str(s).strip().upper() for s in symbols if str(s).strip()})
+    return normalized
+
+
+def response_cache_key(task_type: str, kwargs: Dict[str, Any], data_version: str) -> str:
+    return json.dumps({
+        "task_type": task_type,
+        "kwargs": normalize_task_kwargs(kwargs),
+        "data_version": data_version
+    }, ensure_ascii=False, sort_keys=True, default=str)
+
+
+class ResponseCache:
+    """带过期时间和LRU淘汰的响应缓存，同一键的并发计算合并为一次"""
+
+    SHARED_NAMESPACE = "responses"
+
+    def __init__(self, ttl: float = 300, max_entries: int = 256, shared: Optional[SharedCache] = None,
+                 lease_ttl: float = 600, poll_interval: float = 0.5):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, content: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, content)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _shared_key(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _shared_get(self, key: str) -> Optional[Any]:
+        if self.shared is None:
+            return None
+        return self.shared.get_json(self.SHARED_NAMESPACE, self._shared_key(key))
+
+    def _store(self, key: str, content: Any) -> None:
+        """写入本进程缓存和共享缓存，在I/O线程池中调用"""
+        self.set(key, content)
+        if self.shared is not None:
+            self.shared.set(self.SHARED_NAMESPACE, self._shared_key(key), dumps(content), self.ttl)
+
+    async def _compute_across_processes(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """持有租约时执行计算；其他进程正在计算时等待其写入共享缓存，租约过期仍无结果则自行计算"""
+        if self.shared is None:
+            return await compute()
+        lease = f"response:{self._shared_key(key)}"
+        deadline = time.time() + self.lease_ttl
+        while not await run_io(self.shared.acquire_lease, lease, self.lease_ttl):
+            if time.time() >= deadline:
+                return await compute()
+            await asyncio.sleep(self.poll_interval)
+            content = await run_io(self._shared_get, key)
+            if content is not None:
+                logger.info("Reusing analysis computed by another worker")
+                return content
+        try:
+            return await compute()
+        finally:
+            await run_io(self.shared.release_lease, lease)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]],
+                             cacheable: Callable[[Any], bool] = lambda content: True,
+                             final_key: Optional[Callable[[], str]] = None) -> Any:
+        """返回缓存的响应，没有时计算；同一键正在计算时等待其结果
+
+        cacheable判断结果是否写入缓存（例如出错的响应不缓存）。计算过程可能刷新行情数据
+        而改变数据版本，final_key用于在计算完成后按新版本再写入一份，避免下一次请求未命中；
+        final_key可能读取落盘数据，在I/O线程池中调用。
+
+        计算在独立的任务中执行，发起请求的客户端断开只取消它自己的等待，
+        不影响合并到同一次计算的其他请求，结果仍会写入缓存。
+        """
+        content = self.get(key)
+        if content is None and self.shared is not None:
+            content = await run_io(self._shared_get, key)
+            if content is not None:
+                self.set(key, content)
+        if content is not None:
+            self.hits += 1
+            return content
+
+        task = self._inflight.get(key)
+        if task is not None:
+            logger.info("Joining in-flight analysis request")
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._compute_and_store(key, compute, cacheable, final_key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish_inflight(key, done))
+        return await asyncio.shield(task)
+
+    def _finish_inflight(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 所有等待者都已取消时避免"exception was never retrieved"警告
+        if not task.cancelled():
+            task.exception()
+
+    async def _compute_and_store(self, key: str, compute: Callable[[], Awaitable[Any]],
+                                 cacheable: Callable[[Any], bool],
+                                 final_key: Optional[Callable[[], str]]) -> Any:
+        content = await self._compute_across_processes(key, compute)
+        if cacheable(content):
+            await run_io(self._store, key, content)
+            if final_key is not None:
+                await run_io(self._store, await run_io(final_key), content)
+        return content
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """获取进程级共享的响应缓存，有效期由RESPONSE_CACHE_TTL（秒）配置，并接入跨进程的共享缓存"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(
+                    float(os.getenv('RESPONSE_CACHE_TTL', 300)),
+                    int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 256)),
+                    shared=get_shared_cache()
+                )
+    return _cache
@@ -0,0 +1,52 @@
+"""JSON输出前的NaN/inf清理
+
+数组和序列整体做向量化替换后再转换为列表，标量叶子节点只做一次math.isfinite判断，
+避免对图表数据逐个元素调用NumPy函数。
+"""
+import math
+from typing import Any, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+def sanitize_array(values, fill: float = 0.0) -> np.ndarray:
+    """将NaN/inf整体替换为fill"""
+    return np.nan_to_num(np.asarray(values, dtype=np.float64), nan=fill, posinf=fill, neginf=fill)
+
+
+def series_to_list(values, fill: Optional[float] = None, decimals: Optional[int] = None) -> List[Optional[float]]:
+    """将数值序列转换为JSON列表，NaN/inf替换为fill（默认None，前端据此断开绘制）"""
+    values = np.asarray(values, dtype=np.float64)
+    if decimals is not None:
+        values = np.round(values, decimals)
+    if fill is not None:
+        return sanitize_array(values, fill).tolist()
+    finite = np.isfinite(values)
+    if finite.all():
+        return values.tolist()
+    out = values.astype(object)
+    out[~finite] = None
+    return out.tolist()
+
+
+def sanitize_float(value: Any, fill: float = 0.0) -> float:
+    """将单个数值转换为有限的float，无法转换或非有限值时返回fill"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return fill
+    return value if math.isfinite(value) else fill
+
+
+def sanitize(data: Any, fill: float = 0.0) -> Any:
+    """清理嵌套结构中的特殊浮点数，数组和序列整体向量化处理"""
+    if isinstance(data, dict):
+        return {k: sanitize(v, fill) for k, v in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [sanitize(item, fill) for item in data]
+    if isinstance(data, (float, np.floating)):
+        return sanitize_float(data, fill)
+    if isinstance(data, (np.ndarray, pd.Series)) and np.issubdtype(data.dtype, np.floating):
+        return sanitize_array(data, fill).tolist()
+    return data
@@ -0,0 +1,73 @@
+"""横截面选股引擎
+
+在(股票 × 交易日)的收盘价矩阵上一次性计算整个股票池的筛选因子和评分，
+评分规则与MarketAnalyzer原有的逐只股票计算保持一致。
+"""
+from typing import Dict, Tuple
+
+import numpy as np
+
+from core import indicators
+
+
+def compute_factors(close: np.ndarray, momentum_window: int = 20) -> Dict[str, np.ndarray]:
+    """计算筛选因子，返回的每个数组长度都等于股票数量"""
+    close = indicators.ffill(indicators.as_float_array(close))
+    _, _, macd_diff = indicators.macd(close)
+    valid_days = np.sum(~np.isnan(close), axis=-1)
+    price = close[..., -1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        momentum = (price / close[..., -momentum_window] - 1) * 100
+    return {
+        "price": price,
+        "rsi": indicators.rsi(close, window=14)[..., -1],
+        "macd_diff": macd_diff[..., -1],
+        "sma_20": indicators.sma(close, 20)[..., -1],
+        "sma_50": indicators.sma(close, 50)[..., -1],
+        "momentum": momentum,
+        "valid": valid_days >= momentum_window
+    }
+
+
+def screen(close: np.ndarray) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """计算筛选因子和技术面评分；模块级函数，便于在进程池中执行"""
+    factors = compute_factors(close)
+    return factors, technical_scores(factors)
+
+
+def technical_scores(factors: Dict[str, np.ndarray]) -> np.ndarray:
+    """技术面评分（0-80分）"""
+    rsi = factors["rsi"]
+    price = factors["price"]
+    sma_20 = factors["sma_20"]
+    sma_50 = factors["sma_50"]
+    momentum = factors["momentum"]
+    with np.errstate(invalid="ignore"):
+        # RSI评分 (0-20分)
+        score = np.select(
+            [(rsi >= 40) & (rsi <= 60),
+             ((rsi >= 30) & (rsi < 40)) | ((rsi > 60) & (rsi <= 70)),
+             rsi < 30],
+            [20, 15, 10],
+            default=0
+        )
+        # MACD评分 (0-20分)
+        score = score + np.where(factors["macd_diff"] > 0, 20, 0)
+        # 均线评分 (0-20分)
+        score = score + np.select(
+            [(price > sma_20) & (sma_20 > sma_50), price > sma_20],
+            [20, 10],
+            default=0
+        )
+        # 动量评分 (0-20分)
+        score = score + np.select([momentum > 0, momentum > -5], [20, 10], default=0)
+    return np.where(factors["valid"], score, 0)
+
+
+def fundamental_scores(pe_ratio: np.ndarray, profit_margin: np.ndarray) -> np.ndarray:
+    """基本面评分（0-20分），profit_margin以百分比表示，缺失值用NaN"""
+    pe_ratio = indicators.as_float_array(pe_ratio)
+    profit_margin = indicators.as_float_array(profit_margin)
+    with np.errstate(invalid="ignore"):
+        return (np.where((pe_ratio > 0) & (pe_ratio < 30), 10, 0)
+                + np.where(profit_margin > 10, 10, 0))
@@ -0,0 +1,169 @@
+"""多进程共享的缓存层
+
+以多个uvicorn worker运行时，各进程的内存缓存互不可见。这里用一个WAL模式的SQLite文件
+作为所有进程共享的键值缓存（按namespace区分用途），并提供跨进程的租约：
+同一资源同时只有一个进程访问上游，其余进程等待它写入共享缓存或落盘数据后直接读取。
+
+K线数组本身由OHLCVStore以内存映射的.npy文件保存，各进程共享操作系统的页缓存，
+不经过这里。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SharedCache:
+    """基于SQLite WAL的跨进程键值缓存与租约"""
+
+    def __init__(self, path: str = "cache/shared_cache.sqlite3", max_entries: int = 20000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30,
+                                     isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+                "expires_at REAL NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_expires ON entries(expires_at)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+        self._writes = 0
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT value FROM entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+                    (namespace, key, time.time())
+                ).fetchone()
+            return bytes(row[0]) if row is not None else None
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read shared cache: {str(e)}")
+            return None
+
+    def set(self, namespace: str, key: str, value: bytes, ttl: float) -> None:
+        now = time.time()
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (namespace, key, value, expires_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (namespace, key, sqlite3.Binary(value), now + ttl, now)
+                )
+                self._writes += 1
+                # 定期清理过期记录并限制总量，避免每次写入都扫描
+                if self._writes % 100 == 0:
+                    self._evict(now)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to write shared cache: {str(e)}")
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+        count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM entries WHERE rowid IN "
+                "(SELECT rowid FROM entries ORDER BY updated_at LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def get_json(self, namespace: str, key: str) -> Optional[Any]:
+        value = self.get(namespace, key)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, namespace: str, key: str, value: Any, ttl: float) -> None:
+        self.set(namespace, key, json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"), ttl)
+
+    def acquire_lease(self, name: str, ttl: float) -> bool:
+        """尝试获取租约，成功返回True；租约到期后自动失效，持有者崩溃不会永久阻塞其他进程"""
+        now = time.time()
+        try:
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self._conn.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+                    acquired = row is None or row[1] <= now or row[0] == self.owner
+                    if acquired:
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                            (name, self.owner, now + ttl)
+                        )
+                finally:
+                    self._conn.execute("COMMIT")
+            return acquired
+        except sqlite3.Error as e:
+            # 共享层不可用时退化为各进程独立访问上游
+            logger.warning(f"Failed to acquire lease {name}: {str(e)}")
+            return True
+
+    def release_lease(self, name: str) -> None:
+        try:
+            with self._lock:
+                self._conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.owner))
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to release lease {name}: {str(e)}")
+
+    def single_flight(self, name: str, compute: Callable[[], T], ready: Callable[[], Optional[T]],
+                      lease_ttl: float = 60, poll_interval: float = 0.2) -> T:
+        """跨进程的single-flight
+
+        获得租约的进程执行compute（应负责把结果写入共享缓存或落盘），其余进程轮询ready，
+        拿到结果即返回；持有者失败释放租约或租约过期时，由等待者接手执行compute。
+        """
+        waiting = False
+        while not self.acquire_lease(name, lease_ttl):
+            if not waiting:
+                logger.info(f"Waiting for another process to finish {name}")
+                waiting = True
+            time.sleep(poll_interval)
+            value = ready()
+            if value is not None:
+                return value
+        try:
+            return compute()
+        finally:
+            self.release_lease(name)
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        with self._lock:
+            if namespace is None:
+                self._conn.execute("DELETE FROM entries")
+            else:
+                self._conn.execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+
+
+_cache: Optional[SharedCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_shared_cache() -> Optional[SharedCache]:
+    """获取共享缓存，路径由SHARED_CACHE_PATH配置；设置SHARED_CACHE_DISABLED时返回None"""
+    global _cache
+    if os.getenv('SHARED_CACHE_DISABLED'):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SharedCache(
+                    os.getenv('SHARED_CACHE_PATH', 'cache/shared_cache.sqlite3'),
+                    int(os.getenv('SHARED_CACHE_MAX_ENTRIES', 20000))
+                )
+    return _cache
@@ -0,0 +1,47 @@
+"""Server-Sent Events格式化
+
+每个事件为一行event和一行JSON格式的data，数据用core.json_response序列化，
+因此可以直接包含NumPy数值。
+"""
+import logging
+from typing import Any, AsyncIterator, Optional, Tuple
+
+from core.json_response import dumps
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"  # 禁止nginx等反向代理缓冲事件流
+}
+
+
+def sse_event(data: Any, event: Optional[str] = None) -> bytes:
+    """编码一个SSE事件"""
+    prefix = f"event: {event}\n".encode("utf-8") if event else b""
+    return prefix + b"data: " + dumps(data) + b"\n\n"
+
+
+async def stream_events(events: AsyncIterator[Tuple[str, Any]]) -> AsyncIterator[bytes]:
+    """将(事件类型, 数据)流编码为SSE
+
+    连接建立后立即发送start事件，结束时发送done事件，出错时发送error事件。
+    """
+    yield sse_event({}, "start")
+    try:
+        async for event, data in events:
+            yield sse_event(data, event)
+        yield sse_event({}, "done")
+    except Exception as e:
+        logger.error(f"Error while streaming events: {str(e)}")
+        yield sse_event({"message": str(e)}, "error")
+
+
+async def _token_events(tokens: AsyncIterator[str]) -> AsyncIterator[Tuple[str, Any]]:
+    async for token in tokens:
+        yield "token", {"text": token}
+
+
+def stream_tokens(tokens: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    """将文本片段流编码为SSE的token事件"""
+    return stream_events(_token_events(tokens))
@@ -68,6 +68,9 @@ interface MarketResult {
       volume_trend: string;
     };
   };
+  macro_indicators?: {
+    [key: string]: any;
+  };
   news_summary?: string;
   potential_stocks?: Array<{
     symbol: string;
@@ -109,6 +112,17 @@ interface MarketResult {
   charts?: ChartData[];
 }
 
+// 市场分析各阶段对应的结果字段
+const MARKET_STAGE_FIELDS: Record<string, keyof MarketResult> = {
+  market_indices: 'market_overview',
+  sector_performance: 'hot_sectors',
+  macro_indicators: 'macro_indicators',
+  financial_news: 'news_summary',
+  potential_stocks: 'potential_stocks',
+  market_sentiment: 'market_sentiment',
+  final_report: 'analysis_report'
+};
+
 function App() {
   const [activeTab, setActiveTab] = useState<'home' | 'investment' | 'market'>('home');
   const [marketResult, setMarketResult] = useState<MarketResult | null>(null);
@@ -118,64 +132,47 @@ function App() {
 
   const handleMarketAnalysis = async () => {
     setLoading(true);
-    try {
-      const response = await fetch('http://localhost:8000/api/task', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          task_type: 'analyze_market',
-          kwargs: {}
-        }),
-      });
-
-      if (!response.ok) {
-        throw new Error('市场分析请求失败');
-      }
+    setMarketResult(null);
 
-      const reader = response.body?.getReader();
-      if (!reader) {
-        throw new Error('无法读取响应流');
-      }
+    // 各分析阶段完成后立即合并到结果中，报告在生成过程中逐段追加
+    await new Promise<void>((resolve, reject) => {
+      const source = new EventSource('http://localhost:8000/api/market-analysis/stream');
+      const finish = () => {
+        source.close();
+        setLoading(false);
+      };
 
-      let partialResponse = '';
+      source.addEventListener('stage', (event) => {
+        const update = JSON.parse((event as MessageEvent).data);
+        const field = MARKET_STAGE_FIELDS[update.stage];
+        if (!field) return;
+        setMarketResult((prevResult: MarketResult | null) => ({
+          ...(prevResult ?? {}),
+          [field]: update.data
+        } as MarketResult));
+      });
 
-      while (true) {
-        const { done, value } = await reader.read();
-        if (done) break;
+      source.addEventListener('token', (event) => {
+        const { text } = JSON.parse((event as MessageEvent).data);
+        setMarketResult((prevResult: MarketResult | null) => ({
+          ...(prevResult ?? {}),
+          analysis_report: (prevResult?.analysis_report ?? '') + text
+        } as MarketResult));
+      });
 
-        const chunk = new TextDecoder().decode(value);
-        console.log('Received chunk:', chunk);
-        partialResponse += chunk;
+      source.addEventListener('done', () => {
+        finish();
+        resolve();
+      });
 
-        try {
-          const data = JSON.parse(partialResponse);
-          console.log('Parsed data:', data);
-          if (data.status === 'success') {
-            setMarketResult((prevResult: MarketResult | null) => {
-              console.log('Previous result:', prevResult);
-              console.log('New data:', data.data);
-              const newResult = {
-                ...prevResult,
-                ...data.data
-              };
-              console.log('Updated result:', newResult);
-              return newResult;
-            });
-          }
-          partialResponse = '';
-        } catch (e) {
-          console.log('JSON parse error (expected for partial chunks):', e);
-          continue;
-        }
-      }
-    } catch (error) {
-      console.error('Market analysis error:', error);
-      throw error;
-    } finally {
-      setLoading(false);
-    }
+      source.addEventListener('error', (event) => {
+        finish();
+        const data = (event as MessageEvent).data;
+        const message = data ? JSON.parse(data).message : '市场分析请求失败';
+        console.error('Market analysis error:', message);
+        reject(new Error(message));
+      });
+    });
   };
 
   const handleSearch = (query: string) => {
@@ -11,6 +11,7 @@ import {
   Tooltip,
   Legend,
 } from 'chart.js';
+import { expandCharts } from '../utils/chartPayload';
 
 ChartJS.register(
   CategoryScale,
@@ -234,7 +235,7 @@ function InvestmentAnalysis({ initialQuery = '' }: InvestmentAnalysisProps) {
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ symbols }),
+        body: JSON.stringify({ symbols, chart_format: 'compact' }),
       });
 
       const data = await response.json();
@@ -248,6 +249,7 @@ function InvestmentAnalysis({ initialQuery = '' }: InvestmentAnalysisProps) {
         throw new Error('返回数据格式不正确');
       }
 
+      data.data.investmentAdvice.charts = expandCharts<ChartData>(data.data.investmentAdvice.charts);
       setResult(data.data);
       saveSearch(query.trim());
     } catch (err) {
@@ -0,0 +1,94 @@
+// 解码后端紧凑格式（chart_format: 'compact'）的图表数据，还原为图表组件使用的完整格式
+
+interface CompactDataset {
+  data: string;
+  length: number;
+  // 数值超出float32精确整数范围（成交量等）时为'f8'，默认float32
+  dtype?: 'f8';
+  [key: string]: unknown;
+}
+
+interface CompactChart {
+  type: string;
+  title: string;
+  start: number;
+  index?: string;
+  indexLength?: number;
+  datasets: CompactDataset[];
+  config?: Record<string, unknown>;
+}
+
+interface CompactBundle {
+  format: 'compact';
+  labels: string[];
+  config: Record<string, unknown>;
+  charts: CompactChart[];
+}
+
+function decodeBase64(encoded: string): DataView {
+  const binary = atob(encoded);
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i++) {
+    bytes[i] = binary.charCodeAt(i);
+  }
+  return new DataView(bytes.buffer);
+}
+
+function decodeInt32(encoded: string, length: number): number[] {
+  const view = decodeBase64(encoded);
+  const values: number[] = new Array(length);
+  for (let i = 0; i < length; i++) {
+    values[i] = view.getInt32(i * 4, true);
+  }
+  return values;
+}
+
+function decodeFloat32(encoded: string, length: number): (number | null)[] {
+  const view = decodeBase64(encoded);
+  const values: (number | null)[] = new Array(length);
+  for (let i = 0; i < length; i++) {
+    const value = view.getFloat32(i * 4, true);
+    values[i] = Number.isNaN(value) ? null : value;
+  }
+  return values;
+}
+
+function decodeFloat64(encoded: string, length: number): (number | null)[] {
+  const view = decodeBase64(encoded);
+  const values: (number | null)[] = new Array(length);
+  for (let i = 0; i < length; i++) {
+    const value = view.getFloat64(i * 8, true);
+    values[i] = Number.isNaN(value) ? null : value;
+  }
+  return values;
+}
+
+function isCompactBundle(item: unknown): item is CompactBundle {
+  return typeof item === 'object' && item !== null && (item as CompactBundle).format === 'compact';
+}
+
+export function expandCharts<T>(charts: unknown[] | undefined): T[] {
+  if (!charts) {
+    return [];
+  }
+  return charts.flatMap((item) => {
+    if (!isCompactBundle(item)) {
+      return [item as T];
+    }
+    return item.charts.map((chart) => {
+      const { start, index, indexLength, config, ...rest } = chart;
+      const axis = item.labels.slice(start);
+      // 降采样后的图表附带日期轴下标
+      const labels = index ? decodeInt32(index, indexLength ?? 0).map((i) => axis[i]) : axis;
+      return {
+        ...rest,
+        labels,
+        datasets: chart.datasets.map(({ data, length, dtype, ...style }) => ({
+          ...style,
+          data: dtype === 'f8' ? decodeFloat64(data, length) : decodeFloat32(data, length),
+        })),
+        config: { ...item.config, ...(config || {}) },
+      } as unknown as T;
+    });
+  });
+}
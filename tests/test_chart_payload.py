@@ -0,0 +1,27 @@
+import base64
+
+import numpy as np
+
+from core.chart_payload import render_compact
+
+
+def _decode(dataset):
+    dtype = "<f8" if dataset.get("dtype") == "f8" else "<f4"
+    return np.frombuffer(base64.b64decode(dataset["data"]), dtype=dtype)
+
+
+def test_large_volumes_keep_integer_precision():
+    volume = np.array([123456789.0, 98765431.0, np.nan])
+    close = np.array([101.25, 102.5, 103.75])
+    chart = {"type": "bar", "title": "Volume", "datasets": [{"label": "Volume", "data": volume}]}
+    price = {"type": "line", "title": "Price", "datasets": [{"label": "Close", "data": close}]}
+
+    bundle = render_compact([chart, price], ["2024-01-01", "2024-01-02", "2024-01-03"])
+    volume_dataset = bundle["charts"][0]["datasets"][0]
+    price_dataset = bundle["charts"][1]["datasets"][0]
+
+    assert volume_dataset["dtype"] == "f8"
+    np.testing.assert_array_equal(_decode(volume_dataset), volume)
+    # 价格仍使用float32
+    assert "dtype" not in price_dataset
+    np.testing.assert_allclose(_decode(price_dataset), close)
@@ -0,0 +1,31 @@
+import pandas as pd
+
+from core.ohlcv_store import OHLCVStore
+
+
+def _bars(index):
+    return pd.DataFrame({"Close": [float(i) for i in range(len(index))], "Volume": 1.0}, index=index)
+
+
+def test_append_naive_bars_to_tz_aware_history(tmp_path):
+    store = OHLCVStore(str(tmp_path))
+    store.write("X", _bars(pd.date_range("2024-01-01", periods=3, tz="America/New_York")))
+
+    merged = store.append("X", _bars(pd.date_range("2024-01-03", periods=2)))
+
+    assert str(merged.index.tz) == "America/New_York"
+    assert list(merged.index.strftime("%Y-%m-%d")) == ["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04"]
+    # 重复的日期以新数据为准
+    assert merged.loc["2024-01-03", "Close"].item() == 0.0
+    assert len(store.read("X")) == 4
+
+
+def test_append_tz_aware_bars_to_naive_history(tmp_path):
+    store = OHLCVStore(str(tmp_path))
+    store.write("X", _bars(pd.date_range("2024-01-01", periods=3)))
+
+    merged = store.append("X", _bars(pd.date_range("2024-01-04", periods=2, tz="America/New_York")))
+
+    assert str(merged.index.tz) == "America/New_York"
+    assert len(merged) == 5
+    assert merged.index.is_monotonic_increasing